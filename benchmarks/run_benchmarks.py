@@ -0,0 +1,445 @@
+"""
+Набор бенчмарков системы
+
+Запуск (без PyQt и сети):
+    python -m benchmarks.run_benchmarks --scale 1000 --output bench.json
+    python -m benchmarks.run_benchmarks --scale 100000 --compare bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import SyntheticKnowledgeBase, SyntheticCorpus
+from core.batch_inference import BatchInference
+from core.kb_archive import ArchiveReader
+from core.inference_engine import InferenceEngine
+from core.text_processor import TextProcessor
+from core.vectorized_conditions import ColumnarBatch, VectorizedConditions
+from database.db_manager import DatabaseManager
+from database.sharded_db_manager import ShardedDatabaseManager
+
+RESULTS_SCHEMA = 1
+
+
+class BenchmarkRunner:
+    """Прогон и сбор замеров"""
+
+    def __init__(self, repeat: int = 3):
+        self.repeat = repeat
+        self.results: List[Dict] = []
+
+    def measure(self, name: str, group: str, func: Callable, iterations: int = 1,
+                setup: Callable = None):
+        """Замер функции: repeat прогонов по iterations вызовов"""
+        timings = []
+        for _ in range(self.repeat):
+            args = setup() if setup else None
+            start = time.perf_counter()
+            for i in range(iterations):
+                func(args, i) if setup else func(i)
+            timings.append(time.perf_counter() - start)
+
+        result = {
+            'name': name,
+            'group': group,
+            'iterations': iterations,
+            'repeat': self.repeat,
+            'min_s': min(timings),
+            'median_s': statistics.median(timings),
+            'mean_s': statistics.mean(timings),
+            'max_s': max(timings),
+            'per_op_s': statistics.median(timings) / iterations,
+        }
+        self.results.append(result)
+        print(f"  {name:<45} {result['per_op_s'] * 1000:10.3f} мс/оп")
+
+    def skip(self, name: str, group: str, reason: str):
+        self.results.append({'name': name, 'group': group, 'skipped': reason})
+        print(f"  {name:<45} пропущен: {reason}")
+
+    def check(self, name: str, group: str, passed: bool, detail: str = ''):
+        """Проверка корректности; при неудачной проверке прогон завершается с ошибкой"""
+        self.results.append({'name': name, 'group': group, 'passed': passed, 'detail': detail})
+        print(f"  {name:<45} {'ok' if passed else 'ОШИБКА: ' + detail}")
+
+
+def bench_repositories(runner: BenchmarkRunner, db: DatabaseManager, kb: SyntheticKnowledgeBase,
+                       agents: List[Dict], operations: int):
+    """CRUD-операции репозиториев"""
+    print("Репозитории:")
+    agent = agents[0]
+    rules = db.get_rules_by_agent(agent['id'])
+    rule_ids = [rule['id'] for rule in rules] or [None]
+    variables = kb.variables
+
+    runner.measure('domains.create_domain', 'crud',
+                   lambda i: db.create_domain(f"bench-{time.perf_counter_ns()}-{i}"),
+                   iterations=operations)
+    runner.measure('agents.create_agent', 'crud',
+                   lambda i: db.create_agent(f"bench-{i}", agent['domain_id']),
+                   iterations=operations)
+    runner.measure('agents.get_all_agents', 'crud', lambda i: db.get_all_agents())
+
+    new_rules = list(kb.iter_rules(agents))[:operations]
+    # Одинаковые правила агента не сохраняются повторно: каждое сохранение - новое правило
+    serial = itertools.count()
+
+    def save_rule(i):
+        rule = dict(new_rules[i % len(new_rules)])
+        rule.pop('id')
+        rule['condition'] += f" and bench_{next(serial)} > 0"
+        db.save_rule(rule)
+
+    runner.measure('rules.save_rule', 'crud', save_rule, iterations=operations)
+    runner.measure('rules.get_rule', 'crud',
+                   lambda i: db.get_rule(rule_ids[i % len(rule_ids)]), iterations=operations)
+    runner.measure('rules.get_rules_by_agent', 'crud',
+                   lambda i: db.get_rules_by_agent(agent['id']))
+    runner.measure('rules.get_rules_by_domain', 'crud',
+                   lambda i: db.get_rules_by_domain(agent['domain_id']))
+    runner.measure('rules.get_all_rules', 'crud', lambda i: db.get_all_rules())
+    runner.measure('rules.search_rules', 'crud',
+                   lambda i: db.search_rules(variables[i % len(variables)]), iterations=3)
+    runner.measure('rules.update_rule_priority', 'crud',
+                   lambda i: db.update_rule_priority(rule_ids[i % len(rule_ids)], i % 10 + 1),
+                   iterations=operations)
+
+    def delete_setup():
+        return [db.save_rule({'condition': f'x > {next(serial)}', 'action': 'y = 1',
+                              'agent_id': agent['id'], 'domain_id': agent['domain_id']})['id']
+                for _ in range(operations)]
+
+    runner.measure('rules.delete_rule', 'crud',
+                   lambda ids, i: db.delete_rule(ids[i]),
+                   iterations=operations, setup=delete_setup)
+
+    fact = next(kb.iter_facts(agents))
+
+    def save_fact(i):
+        data = dict(fact)
+        data.pop('id')
+        db.save_fact(data)
+
+    runner.measure('facts.save_fact', 'crud', save_fact, iterations=operations)
+    runner.measure('facts.get_facts_by_agent', 'crud',
+                   lambda i: db.get_facts_by_agent(agent['id']))
+    runner.measure('facts.get_facts_by_variable', 'crud',
+                   lambda i: db.get_facts_by_variable(variables[i % len(variables)]),
+                   iterations=operations)
+    runner.measure('facts.get_all_facts', 'crud', lambda i: db.get_all_facts())
+    runner.measure('statistics.get_statistics', 'crud', lambda i: db.get_statistics())
+
+
+def bench_analysis(runner: BenchmarkRunner, db: DatabaseManager, agents: List[Dict]):
+    """Попарный анализ правил в пределах агента"""
+    print("Анализ правил:")
+    agent_id = agents[0]['id']
+    runner.measure('rules.find_similar_rules', 'analysis',
+                   lambda i: db.find_similar_rules(agent_id))
+    runner.measure('rules.find_conflicting_rules', 'analysis',
+                   lambda i: db.find_conflicting_rules(agent_id))
+
+
+def bench_export(runner: BenchmarkRunner, db: DatabaseManager, tmp: str):
+    """Экспорт всей базы знаний и чтение выгрузки обратно"""
+    print("Экспорт:")
+    json_file = str(Path(tmp) / 'export.json')
+    archive_file = str(Path(tmp) / 'export.kba')
+
+    runner.measure('export.to_json', 'export', lambda i: db.export_to_json(json_file))
+    runner.measure('export.to_archive', 'export', lambda i: db.export_to_archive(archive_file))
+
+    def read_json(i):
+        with open(json_file, 'r', encoding='utf-8') as f:
+            json.load(f)
+
+    def read_archive(i):
+        with ArchiveReader(archive_file) as reader:
+            for _ in reader.iter_batches():
+                pass
+
+    runner.measure('export.read_json', 'export', read_json)
+    runner.measure('export.read_archive', 'export', read_archive)
+    print(f"  размер: JSON {os.path.getsize(json_file) / 2 ** 20:.1f} МБ, "
+          f"архив {os.path.getsize(archive_file) / 2 ** 20:.1f} МБ")
+
+
+def bench_inference(runner: BenchmarkRunner, db: DatabaseManager, kb: SyntheticKnowledgeBase,
+                    agents: List[Dict]):
+    """Прямой и обратный вывод"""
+    print("Логический вывод:")
+    engine = InferenceEngine()
+    rules = db.get_rules_by_agent(agents[0]['id'])
+    initial_facts = kb.initial_facts()
+    goal = kb.variables[0]
+
+    runner.measure('inference.forward_chaining', 'inference',
+                   lambda i: engine.forward_chaining(initial_facts, rules))
+    runner.measure('inference.backward_chaining', 'inference',
+                   lambda i: engine.backward_chaining(goal, rules), iterations=10)
+
+    # Пакетный скрининг: разные подмножества начальных фактов
+    cases = [{'id': i, 'facts': {fact['variable']: fact['value']
+                                 for fact in initial_facts[:i % len(initial_facts) + 1]}}
+             for i in range(500)] if initial_facts else []
+    scalar = BatchInference(rules, workers=1, vectorized=False)
+    runner.measure('inference.batch_screen.scalar', 'inference',
+                   lambda i: list(scalar.screen(cases)))
+    if VectorizedConditions.available():
+        vectorized = BatchInference(rules, workers=1, vectorized=True)
+        runner.measure('inference.batch_screen.vectorized', 'inference',
+                       lambda i: list(vectorized.screen(cases)))
+    else:
+        runner.skip('inference.batch_screen.vectorized', 'inference', 'NumPy не установлен')
+    check_vectorized_conditions(runner)
+
+
+def check_vectorized_conditions(runner: BenchmarkRunner):
+    """Векторная проверка условий совпадает с InferenceEngine.check_rule_condition"""
+    if not VectorizedConditions.available():
+        runner.skip('inference.vectorized.equivalence', 'inference', 'NumPy не установлен')
+        return
+
+    # Значения, которые похожи на числа, но не являются литералами Python
+    values = [5, 2, 3.5, '7', ' 4 ', '1_000', '.5', '5.', '1e1', '007', '08', '007.5', '00',
+              '1__0', '_1', '1_', '1e_1', 'abc', '', True, None]
+    rules = [{'condition': condition} for condition in
+             ('a > 3', 'a + 1 > 3 and b < 10', 'a == 7 or not b > 2', '2 < a * 2 <= 20')]
+    cases = [{'a': a, 'b': b} for a in values for b in (1, '08', 50)] + [{'b': 1}]
+
+    engine = InferenceEngine()
+    expected = [[index for index, rule in enumerate(rules)
+                 if engine.check_rule_condition(rule['condition'], case)] for case in cases]
+    actual = VectorizedConditions(rules, engine).initial_matches(ColumnarBatch(cases))
+    mismatches = [cases[row] for row in range(len(cases)) if expected[row] != actual[row]]
+    runner.check('inference.vectorized.equivalence', 'inference', not mismatches,
+                 f"расхождений: {len(mismatches)}, например {mismatches[:3]}")
+
+
+def check_shard_concepts(runner: BenchmarkRunner, tmp: str):
+    """Индекс концепций переносится в шард вместе с правилами и фактами"""
+    print("Шарды:")
+    db = ShardedDatabaseManager(str(Path(tmp) / 'sharded.sqlite3'), shard_new_domains=False)
+    domain = db.create_domain('check-shard')
+    agent = db.create_agent('check-shard', domain['id'])
+    rule = db.save_rule({'condition': 'температура > 30', 'action': 'охлаждение = 1',
+                         'agent_id': agent['id'], 'domain_id': domain['id'], 'source_file': 'check.txt'})
+    fact = db.save_fact({'variable_name': 'температура', 'value': '25', 'agent_id': agent['id'],
+                         'domain_id': domain['id'], 'source_file': 'check.txt'})
+    db.index_concepts([{'text': 'температура', 'type': 'TERM'}],
+                      [{'subject': 'температура', 'relation': 'вызывать', 'object': 'охлаждение'}],
+                      [rule], [fact], 'check.txt')
+
+    def state():
+        concepts = db.find_concepts('температура')
+        return (len(db.get_rules_by_concept('температура')), len(db.get_facts_by_concept('температура')),
+                [(concept['rules'], concept['facts']) for concept in concepts],
+                len(db.get_concept_relations('температура')))
+
+    before = state()
+    moved = db.shard_domain(domain['id'])
+    after = state()
+    runner.check('sharding.shard_domain.concepts', 'sharding', moved and before == after,
+                 f"до переноса {before}, после {after}")
+
+
+def bench_text_processors(runner: BenchmarkRunner, language: str, sentences: int, seed: int):
+    """Все три текстовых процессора на синтетическом корпусе"""
+    print(f"Текстовые процессоры ({language}):")
+    text = SyntheticCorpus(language, seed).generate(sentences)
+    source_info = {'source_file': 'benchmark.txt', 'author': 'benchmark',
+                   'agent_id': 'agent_bench', 'domain_id': None}
+
+    processor = TextProcessor(language)
+    runner.measure(f'text.regex.extract_from_text.{language}', 'text',
+                   lambda i: processor.extract_from_text(text, source_info))
+    runner.measure(f'text.regex.analyze_text_structure.{language}', 'text',
+                   lambda i: processor.analyze_text_structure(text))
+
+    from additional.core.simple_text_processor import SimpleTextProcessor
+    simple = SimpleTextProcessor(language)
+    runner.measure(f'text.simple.extract_rules_from_text.{language}', 'text',
+                   lambda i: simple.extract_rules_from_text(text, source_info))
+    runner.measure(f'text.simple.extract_facts_from_text.{language}', 'text',
+                   lambda i: simple.extract_facts_from_text(text, source_info))
+
+    try:
+        from core.text_processor_spacy import TextProcessor as SpacyTextProcessor
+    except ImportError:
+        runner.skip(f'text.spacy.extract_from_text.{language}', 'text', 'spaCy не установлен')
+        return
+
+    spacy_processor = SpacyTextProcessor(language)
+    if not spacy_processor.nlp.has_pipe('parser'):
+        # Без модели процессор использует пустой конвейер: нет ни
+        # разбиения на предложения, ни частей речи для Matcher
+        for name in ('extract_from_text', 'extract_from_text_tiered', 'analyze_text_structure',
+                     'analyze_text_structure_cached', 'extraction_pool'):
+            runner.skip(f'text.spacy.{name}.{language}', 'text', 'модель spaCy не установлена')
+        return
+
+    runner.measure(f'text.spacy.extract_from_text.{language}', 'text',
+                   lambda i: spacy_processor.extract_from_text(text, source_info))
+    runner.measure(f'text.spacy.extract_from_text_tiered.{language}', 'text',
+                   lambda i: spacy_processor.extract_from_text(text, source_info, tiered=True))
+    runner.measure(f'text.spacy.analyze_text_structure.{language}', 'text',
+                   lambda i: spacy_processor.analyze_text_structure(text))
+
+    # Повторный анализ того же текста с кэшем разобранных документов
+    from core.doc_cache import DocCache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cached_processor = SpacyTextProcessor(language, doc_cache=DocCache(cache_dir))
+        cached_processor.analyze_text_structure(text)
+        runner.measure(f'text.spacy.analyze_text_structure_cached.{language}', 'text',
+                       lambda i: cached_processor.analyze_text_structure(text))
+
+    # Пул исполнителей с общей моделью: восемь документов за прогон
+    from core.extraction_pool import ExtractionPool
+    documents = [(text, source_info)] * 8
+    with ExtractionPool(spacy_processor, max_documents=None) as pool:
+        runner.measure(f'text.spacy.extraction_pool.{language}', 'text',
+                       lambda i: pool.map(documents))
+
+
+def environment_info() -> Dict:
+    """Сведения об окружении для сопоставления результатов"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = ''
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'git_revision': revision or None,
+    }
+
+
+def compare_results(current: Dict, baseline_file: str, tolerance: float) -> List[Dict]:
+    """Сравнение с предыдущими результатами, список регрессий"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    previous = {r['name']: r for r in baseline.get('results', []) if 'per_op_s' in r}
+    regressions = []
+
+    print(f"\nСравнение с {baseline_file}:")
+    for result in current['results']:
+        old = previous.get(result['name'])
+        if not old or 'per_op_s' not in result or not old['per_op_s']:
+            continue
+
+        ratio = result['per_op_s'] / old['per_op_s']
+        marker = ''
+        if ratio > 1 + tolerance:
+            marker = '  <-- регрессия'
+            regressions.append({'name': result['name'], 'ratio': ratio})
+        print(f"  {result['name']:<45} x{ratio:6.2f}{marker}")
+
+    return regressions
+
+
+def run(args) -> Dict:
+    kb = SyntheticKnowledgeBase(rules=args.scale, facts=args.facts, agents=args.agents,
+                                language=args.language, seed=args.seed)
+    runner = BenchmarkRunner(repeat=args.repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(str(Path(tmp) / 'benchmark.sqlite3'))
+
+        print(f"Генерация: {kb.rules_count} правил, {kb.facts_count} фактов, "
+              f"{kb.agents_count} агентов, {kb.domains_count} доменов")
+        start = time.perf_counter()
+        generated = kb.populate(db)
+        populate_s = time.perf_counter() - start
+        print(f"  загрузка заняла {populate_s:.2f} с")
+
+        agents = generated['agents']
+        bench_repositories(runner, db, kb, agents, args.operations)
+        bench_analysis(runner, db, agents)
+        bench_inference(runner, db, kb, agents)
+        bench_export(runner, db, tmp)
+        check_shard_concepts(runner, tmp)
+
+    for language in ('ru', 'en'):
+        bench_text_processors(runner, language, args.sentences, args.seed)
+
+    return {
+        'schema': RESULTS_SCHEMA,
+        'created_at': datetime.now().isoformat(),
+        'environment': environment_info(),
+        'params': {
+            'scale': args.scale,
+            'facts': kb.facts_count,
+            'agents': kb.agents_count,
+            'domains': kb.domains_count,
+            'language': args.language,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'operations': args.operations,
+            'sentences': args.sentences,
+            'populate_s': populate_s,
+        },
+        'results': runner.results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарки базы знаний')
+    parser.add_argument('--scale', type=int, default=1000,
+                        help='Количество правил (10^3 - 10^6)')
+    parser.add_argument('--facts', type=int, default=None,
+                        help='Количество фактов (по умолчанию равно --scale)')
+    parser.add_argument('--agents', type=int, default=None,
+                        help='Количество агентов (по умолчанию scale / 500)')
+    parser.add_argument('--language', choices=['ru', 'en'], default='ru')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--operations', type=int, default=100,
+                        help='Количество вызовов для точечных операций')
+    parser.add_argument('--sentences', type=int, default=2000,
+                        help='Размер текстового корпуса в предложениях')
+    parser.add_argument('--output', default=None, help='Файл для результатов JSON')
+    parser.add_argument('--compare', default=None, help='Файл с предыдущими результатами')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Допустимое замедление при сравнении (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"Обнаружено регрессий: {len(regressions)}")
+            return 1
+
+    failed = [result['name'] for result in results['results'] if result.get('passed') is False]
+    if failed:
+        print(f"Не пройдены проверки: {', '.join(failed)}")
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+import json
+import random
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Dict, Iterator, Optional
+
+from core.text_processor import TextProcessor
+from database.dependency_repository import write_rule_dependencies
+from database.signature_repository import write_rule_signatures
+from core.tokenizer import rule_fingerprint
+
+
+WORDS = {
+    'ru': {
+        'variables': ['температура', 'давление', 'пульс', 'уровень', 'нагрузка',
+                      'скорость', 'влажность', 'напряжение', 'ток', 'частота',
+                      'вибрация', 'износ', 'расход', 'масса', 'заряд'],
+        'qualifiers': ['двигателя', 'тела', 'системы', 'насоса', 'датчика',
+                       'контура', 'узла', 'пациента', 'линии', 'блока'],
+        'states': ['перегрев', 'норма', 'авария', 'лихорадка', 'гипертония',
+                   'износ', 'отказ', 'простой', 'перегрузка', 'стабильность'],
+        'filler': ['Описание режима работы приведено в приложении',
+                   'Оборудование поставляется в собранном виде',
+                   'Дальнейшие разделы содержат справочные сведения',
+                   'Пациент поступил в отделение в плановом порядке',
+                   'Измерения проводились в течение всего дня'],
+    },
+    'en': {
+        'variables': ['temperature', 'pressure', 'pulse', 'level', 'load',
+                      'speed', 'humidity', 'voltage', 'current', 'frequency',
+                      'vibration', 'wear', 'flow', 'mass', 'charge'],
+        'qualifiers': ['engine', 'body', 'system', 'pump', 'sensor',
+                       'circuit', 'unit', 'patient', 'line', 'block'],
+        'states': ['overheating', 'normal', 'failure', 'fever', 'hypertension',
+                   'wear', 'fault', 'idle', 'overload', 'stability'],
+        'filler': ['The operating mode is described in the appendix',
+                   'The equipment is shipped fully assembled',
+                   'Further sections contain reference material',
+                   'The patient was admitted for a scheduled visit',
+                   'Measurements were taken throughout the day'],
+    },
+}
+
+# Замены элементов регулярных выражений на литералы шаблона
+_TEMPLATE_REPLACEMENTS = [
+    (r'\s*[,;]\s*', ', '),
+    (r'\s*[=:]\s*', ' = '),
+    (r'[—\-]', '—'),
+    (r'\s+', ' '),
+    (r'\s*', ' '),
+]
+
+
+class SyntheticKnowledgeBase:
+    """
+    Генератор синтетических доменов, агентов, правил и фактов
+
+    Все данные детерминированы относительно seed, поэтому результаты
+    бенчмарков сопоставимы между запусками и релизами.
+    """
+
+    def __init__(self, rules: int = 1000, facts: int = None, agents: int = None,
+                 domains: int = None, language: str = 'ru', seed: int = 42):
+        self.rules_count = rules
+        self.facts_count = rules if facts is None else facts
+        self.agents_count = agents or max(2, rules // 500)
+        self.domains_count = domains or max(1, self.agents_count // 10)
+        self.language = language
+        self.seed = seed
+
+        self.words = WORDS[language]
+        self.variables = self._build_variables()
+
+    def _build_variables(self) -> List[str]:
+        """Словарь переменных без общих префиксов"""
+        variables = []
+        for index, (name, qualifier) in enumerate(
+                (n, q) for n in self.words['variables'] for q in self.words['qualifiers']):
+            variables.append(f"{name}_{qualifier}_{index:03d}")
+        return variables
+
+    def _uuid(self, rng: random.Random) -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    def domains(self) -> List[Dict]:
+        rng = random.Random(f"{self.seed}-domains")
+        return [{
+            'id': self._uuid(rng),
+            'name': f"Синтетическая область {i:04d}",
+            'description': 'Сгенерировано для бенчмарков'
+        } for i in range(self.domains_count)]
+
+    def agents(self, domains: List[Dict]) -> List[Dict]:
+        rng = random.Random(f"{self.seed}-agents")
+        return [{
+            'id': f"agent_{rng.getrandbits(32):08x}",
+            'name': f"Синтетический агент {i:05d}",
+            'domain_id': domains[i % len(domains)]['id'],
+            'description': 'Сгенерировано для бенчмарков'
+        } for i in range(self.agents_count)]
+
+    def condition(self, rng: random.Random) -> str:
+        """Числовое условие в формате примеров из resources/rules.py"""
+        first = rng.choice(self.variables)
+        condition = f"{first} > {rng.randint(0, 100)}"
+        if rng.random() < 0.3:
+            second = rng.choice(self.variables)
+            condition += f" and {second} < {rng.randint(0, 100)}"
+        return condition
+
+    def action(self, rng: random.Random) -> str:
+        target = rng.choice(self.variables)
+        return f'{target} = "{rng.choice(self.words["states"])}"'
+
+    def iter_rules(self, agents: List[Dict]) -> Iterator[Dict]:
+        rng = random.Random(f"{self.seed}-rules")
+        start = datetime(2024, 1, 1)
+        for i in range(self.rules_count):
+            agent = agents[i % len(agents)]
+            yield {
+                'id': self._uuid(rng),
+                'name': f"Правило {i:07d}",
+                'condition': self.condition(rng),
+                'action': self.action(rng),
+                'rule_type': rng.choice(['conditional', 'causal', 'temporal']),
+                'priority': rng.randint(1, 10),
+                'confidence': round(rng.uniform(0.5, 1.0), 2),
+                'source_file': f"synthetic_{i % 100:03d}.txt",
+                'author': 'benchmark',
+                'tags': ['synthetic'],
+                'agent_id': agent['id'],
+                'domain_id': agent['domain_id'],
+                'created_at': (start + timedelta(seconds=i)).isoformat(sep=' ')
+            }
+
+    def iter_facts(self, agents: List[Dict]) -> Iterator[Dict]:
+        rng = random.Random(f"{self.seed}-facts")
+        start = datetime(2024, 1, 1)
+        for i in range(self.facts_count):
+            agent = agents[i % len(agents)]
+            yield {
+                'id': self._uuid(rng),
+                'variable_name': rng.choice(self.variables),
+                'value': str(rng.randint(0, 100)),
+                'confidence': round(rng.uniform(0.5, 1.0), 2),
+                'source_file': f"synthetic_{i % 100:03d}.txt",
+                'author': 'benchmark',
+                'is_derived': 0,
+                'agent_id': agent['id'],
+                'domain_id': agent['domain_id'],
+                'created_at': (start + timedelta(seconds=i)).isoformat(sep=' ')
+            }
+
+    def initial_facts(self, count: int = 20) -> List[Dict]:
+        """Начальные факты для прямого вывода в формате диалога MainWindow"""
+        rng = random.Random(f"{self.seed}-initial")
+        return [{'variable': variable, 'value': str(rng.randint(0, 100))}
+                for variable in rng.sample(self.variables, min(count, len(self.variables)))]
+
+    def populate(self, db_manager, batch_size: int = 10000) -> Dict:
+        """
+        Массовая загрузка данных в БД
+
+        Репозитории сохраняют по одной записи на транзакцию, что на масштабе
+        10^6 занимает часы, поэтому загрузка идет пакетами через executemany.
+        """
+        domains = self.domains()
+        agents = self.agents(domains)
+
+        conn = db_manager._get_connection()
+        try:
+            conn.executemany(
+                'INSERT INTO domains (id, name, description) VALUES (:id, :name, :description)',
+                domains)
+            conn.executemany(
+                'INSERT INTO agents (id, name, domain_id, description) '
+                'VALUES (:id, :name, :domain_id, :description)',
+                agents)
+
+            for batch in self._batches(self.iter_rules(agents), batch_size):
+                for rule in batch:
+                    rule['tags'] = '["synthetic"]'
+                    rule['fingerprint'] = rule_fingerprint(rule)
+                conn.executemany('''
+                    INSERT INTO rules (
+                        id, name, condition, action, rule_type, priority, confidence,
+                        source_file, author, tags, agent_id, domain_id, created_at, fingerprint
+                    ) VALUES (:id, :name, :condition, :action, :rule_type, :priority,
+                              :confidence, :source_file, :author, :tags, :agent_id,
+                              :domain_id, :created_at, :fingerprint)
+                    ON CONFLICT(fingerprint) DO NOTHING
+                    ''', batch)
+
+                # Случайно совпавшие правила агента пропущены уникальным индексом
+                stored = {row[0] for row in conn.execute(
+                    'SELECT id FROM rules WHERE id IN (SELECT value FROM json_each(?))',
+                    (json.dumps([rule['id'] for rule in batch]),))}
+                batch = [rule for rule in batch if rule['id'] in stored]
+
+                write_rule_dependencies(conn.cursor(), batch)
+                write_rule_signatures(conn.cursor(), batch)
+
+            for batch in self._batches(self.iter_facts(agents), batch_size):
+                conn.executemany('''
+                    INSERT INTO facts (
+                        id, variable_name, value, confidence, source_file, author,
+                        is_derived, agent_id, domain_id, created_at
+                    ) VALUES (:id, :variable_name, :value, :confidence, :source_file,
+                              :author, :is_derived, :agent_id, :domain_id, :created_at)
+                    ''', batch)
+
+            # Счетчики доменов пересчитываем одним запросом
+            conn.execute('''
+                UPDATE domains SET
+                    rules_count = (SELECT COUNT(*) FROM rules WHERE rules.domain_id = domains.id),
+                    facts_count = (SELECT COUNT(*) FROM facts WHERE facts.domain_id = domains.id),
+                    agents_count = (SELECT COUNT(*) FROM agents WHERE agents.domain_id = domains.id)
+                ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+        return {'domains': domains, 'agents': agents}
+
+    @staticmethod
+    def _batches(items: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class SyntheticCorpus:
+    """
+    Генератор текстов из шаблонов rule_patterns/fact_patterns
+
+    Регулярные выражения процессора превращаются в шаблоны предложений:
+    группы захвата заменяются сгенерированными фразами, а служебные
+    конструкции (\\s+, [,;], [=:]) - литералами. Каждое предложение
+    проверяется исходным выражением, несовпадающие шаблоны отбрасываются.
+    """
+
+    def __init__(self, language: str = 'ru', seed: int = 42,
+                 processor: Optional[TextProcessor] = None):
+        self.language = language
+        self.seed = seed
+        self.words = WORDS[language]
+
+        processor = processor or TextProcessor(language)
+        self.rule_templates = self._templates(processor.rule_patterns)
+        self.fact_templates = self._templates(processor.fact_patterns)
+
+    def _templates(self, patterns: List[tuple]) -> List[tuple]:
+        templates = []
+        for item in patterns:
+            pattern = item[0]
+            groups = re.findall(r'\((?!\?)[^)]*\)', pattern)
+            template = re.sub(r'\((?!\?)[^)]*\)', '{}', pattern)
+            for regex, literal in _TEMPLATE_REPLACEMENTS:
+                template = template.replace(regex, literal)
+            if '\\' in template or '[' in template:
+                continue
+            templates.append((pattern, template.strip(), groups))
+        return templates
+
+    def _phrase(self, rng: random.Random, group: str, capitalized: bool) -> str:
+        """Фраза для подстановки в группу захвата"""
+        multiword = r'\s' in group or '.+' in group
+        words = [rng.choice(self.words['variables'])]
+        if multiword:
+            words.append(rng.choice(self.words['qualifiers']))
+            if rng.random() < 0.5:
+                words.append(rng.choice(self.words['states']))
+        phrase = ' '.join(words)
+        return phrase.capitalize() if capitalized else phrase
+
+    def _sentence(self, rng: random.Random, templates: List[tuple]) -> Optional[str]:
+        pattern, template, groups = rng.choice(templates)
+        values = [self._phrase(rng, group, group.startswith('([А-Я') or group.startswith('([A-Z'))
+                  for group in groups]
+        sentence = template.format(*values)
+        sentence = sentence[0].upper() + sentence[1:]
+        if re.search(pattern, sentence, re.IGNORECASE | re.DOTALL):
+            return sentence
+        return None
+
+    def generate(self, sentences: int = 1000, rule_ratio: float = 0.2,
+                 fact_ratio: float = 0.2) -> str:
+        """Текст из заданного числа предложений"""
+        rng = random.Random(f"{self.seed}-corpus-{sentences}")
+        result = []
+        while len(result) < sentences:
+            roll = rng.random()
+            sentence = None
+            if roll < rule_ratio and self.rule_templates:
+                sentence = self._sentence(rng, self.rule_templates)
+            elif roll < rule_ratio + fact_ratio and self.fact_templates:
+                sentence = self._sentence(rng, self.fact_templates)
+            if sentence is None:
+                sentence = rng.choice(self.words['filler'])
+            result.append(sentence + '.')
+        return ' '.join(result)
@@ -0,0 +1,109 @@
+import heapq
+import itertools
+import re
+from typing import Callable, Dict, Optional, Union
+
+
+class Activation:
+    """Активация: правило, условие которого выполнено на текущих фактах"""
+
+    __slots__ = ('rule', 'index', 'stamp')
+
+    def __init__(self, rule: Dict, index: int, stamp: int):
+        self.rule = rule
+        self.index = index  # Позиция правила во входном списке
+        self.stamp = stamp  # Порядковый номер активации
+
+
+def condition_specificity(condition: str) -> int:
+    """Количество элементарных проверок в условии"""
+    parts = re.split(r'\s+(?:и|или|and|or)\s+', condition or '', flags=re.IGNORECASE)
+    return sum(1 for part in parts if part.strip())
+
+
+def rule_priority(rule: Dict) -> int:
+    """Приоритет правила; NULL в БД - приоритет по умолчанию, как при импорте"""
+    return rule.get('priority') or 1
+
+
+def priority_strategy(activation: Activation) -> tuple:
+    """Сначала правила с большим приоритетом, при равенстве - по порядку в списке"""
+    return (-rule_priority(activation.rule), activation.index)
+
+
+def recency_strategy(activation: Activation) -> tuple:
+    """Сначала самые новые активации (вывод в глубину)"""
+    return (-activation.stamp, -rule_priority(activation.rule), activation.index)
+
+
+def specificity_strategy(activation: Activation) -> tuple:
+    """Сначала правила с более конкретным условием"""
+    return (-condition_specificity(activation.rule.get('condition')),
+            -rule_priority(activation.rule), activation.index)
+
+
+def confidence_strategy(activation: Activation) -> tuple:
+    """Сначала правила с большей достоверностью"""
+    return (-(activation.rule.get('confidence') or 0.0),
+            -rule_priority(activation.rule), activation.index)
+
+
+STRATEGIES: Dict[str, Callable[[Activation], tuple]] = {
+    'priority': priority_strategy,
+    'recency': recency_strategy,
+    'specificity': specificity_strategy,
+    'confidence': confidence_strategy,
+}
+
+
+class Agenda:
+    """
+    Агенда активаций - куча, упорядоченная стратегией разрешения конфликтов
+
+    Стратегия - имя из STRATEGIES или функция, возвращающая ключ
+    сортировки активации (меньший ключ выбирается раньше). Удаление
+    ленивое: запись помечается и пропускается при извлечении, поэтому
+    добавление, удаление и выбор следующего правила стоят O(log n).
+    """
+
+    def __init__(self, strategy: Union[str, Callable[[Activation], tuple]] = 'priority'):
+        if isinstance(strategy, str):
+            if strategy not in STRATEGIES:
+                raise ValueError(f"Неизвестная стратегия: {strategy}")
+            strategy = STRATEGIES[strategy]
+
+        self.strategy = strategy
+        self._heap = []
+        self._entries: Dict[int, list] = {}  # индекс правила -> запись кучи
+        self._stamps = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._entries
+
+    def push(self, rule: Dict, index: int):
+        """Добавление активации правила (повторное добавление игнорируется)"""
+        if index in self._entries:
+            return
+
+        activation = Activation(rule, index, next(self._stamps))
+        entry = [self.strategy(activation), activation.stamp, activation]
+        self._entries[index] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, index: int):
+        """Удаление активации правила"""
+        entry = self._entries.pop(index, None)
+        if entry is not None:
+            entry[-1] = None
+
+    def pop(self) -> Optional[Activation]:
+        """Извлечение активации, выбранной стратегией"""
+        while self._heap:
+            activation = heapq.heappop(self._heap)[-1]
+            if activation is not None:
+                del self._entries[activation.index]
+                return activation
+        return None
@@ -0,0 +1,293 @@
+from typing import List, Dict, Optional
+
+from core.tokenizer import token_signature
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+
+class AgentComparison:
+    """
+    Пакетное сравнение баз знаний агентов
+
+    Правила превращаются в разреженные бинарные векторы токенов условия
+    и действия. Сходство агентов - косинус их профилей (сумм векторов
+    правил). Почти совпадающие правила ищутся через MinHash с разбиением
+    на полосы: кандидаты из разных агентов, попавшие в одну корзину,
+    проверяются точным коэффициентом Жаккара.
+
+    Токены, встречающиеся более чем в max_df доле правил (">", "=" и т.п.),
+    не участвуют в MinHash, иначе почти любые два правила становятся
+    кандидатами. В итоговой проверке учитываются все токены.
+    """
+
+    # Простое число Мерсенна для универсального хеширования
+    _PRIME = (1 << 31) - 1
+
+    def __init__(self, threshold: float = 0.8, top_k: int = 3,
+                 num_hashes: int = 24, bands: int = 6, max_df: float = 0.3,
+                 seed: int = 42, chunk_size: int = 100000):
+        if num_hashes % bands:
+            raise ValueError("num_hashes должно делиться на bands")
+
+        self.threshold = threshold
+        self.top_k = top_k
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.max_df = max_df
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def available() -> bool:
+        """Установлены ли NumPy и SciPy"""
+        return np is not None
+
+    @staticmethod
+    def rule_tokens(rule: Dict, signature: tuple = None) -> set:
+        """
+        Токены правила: хеши токенов условия и действия с разными метками
+
+        signature - сохраненные сигнатуры (условие, действие); без них
+        считаются по тексту тем же токенизатором (core.tokenizer)
+        """
+        if signature is None:
+            signature = (token_signature(rule.get('condition')), token_signature(rule.get('action')))
+        tokens = {('c', value) for value in signature[0]}
+        tokens.update(('a', value) for value in signature[1])
+        return tokens
+
+    def compare(self, agents: List[Dict], rules_by_agent: Dict[str, List[Dict]],
+                signatures: Optional[Dict[str, tuple]] = None) -> Dict:
+        """
+        Сравнение агентов
+
+        Args:
+            agents: Агенты в порядке строк/столбцов матриц
+            rules_by_agent: Правила каждого агента по его ID
+            signatures: Сохраненные сигнатуры правил по ID (get_rule_signatures)
+
+        Returns:
+            Матрицы сходства и пересечения, счетчики и топ общих правил по парам
+        """
+        if not self.available():
+            raise RuntimeError("Для сравнения агентов установите numpy и scipy")
+
+        n_agents = len(agents)
+        rules, rule_agent, matrix = self._build_matrix(agents, rules_by_agent, signatures or {})
+        rules_count = np.bincount(rule_agent, minlength=n_agents)
+
+        similarity = self._profile_similarity(matrix, rule_agent, n_agents)
+        pairs, scores = self._near_duplicates(matrix, rule_agent)
+
+        overlap, shared = self._overlap(pairs, rule_agent, rules_count, n_agents)
+
+        return {
+            'agents': [agent['id'] for agent in agents],
+            'rules_count': rules_count.tolist(),
+            'similarity': similarity.tolist(),
+            'overlap': overlap.tolist(),
+            'shared_pairs': shared.tolist(),
+            'top_shared': self._top_shared(pairs, scores, rules, rule_agent, agents),
+        }
+
+    def _build_matrix(self, agents: List[Dict], rules_by_agent: Dict[str, List[Dict]],
+                      signatures: Dict[str, tuple]):
+        """Разреженная матрица правила x токены"""
+        vocabulary = {}
+        indices = []
+        indptr = [0]
+        rules = []
+        rule_agent = []
+
+        for agent_index, agent in enumerate(agents):
+            for rule in rules_by_agent.get(agent['id'], []):
+                tokens = self.rule_tokens(rule, signatures.get(rule.get('id')))
+                if not tokens:
+                    continue
+                indices.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+                indptr.append(len(indices))
+                rules.append(rule)
+                rule_agent.append(agent_index)
+
+        matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32),
+             np.asarray(indices, dtype=np.int64),
+             np.asarray(indptr, dtype=np.int64)),
+            shape=(len(rules), max(len(vocabulary), 1))
+        )
+
+        return rules, np.asarray(rule_agent, dtype=np.int64), matrix
+
+    def _profile_similarity(self, matrix, rule_agent, n_agents: int):
+        """Косинусное сходство профилей токенов агентов"""
+        membership = sparse.csr_matrix(
+            (np.ones(len(rule_agent), dtype=np.float32), (rule_agent, np.arange(len(rule_agent)))),
+            shape=(n_agents, matrix.shape[0])
+        )
+        profiles = membership @ matrix
+
+        norms = np.sqrt(np.asarray(profiles.multiply(profiles).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        profiles = sparse.diags(1.0 / norms) @ profiles
+
+        similarity = (profiles @ profiles.T).toarray()
+        np.fill_diagonal(similarity, 1.0)
+        return similarity
+
+    def _signatures(self, matrix):
+        """MinHash-сигнатуры правил, по блокам строк"""
+        rng = np.random.default_rng(self.seed)
+        a = rng.integers(1, self._PRIME, self.num_hashes, dtype=np.uint64)
+        b = rng.integers(0, self._PRIME, self.num_hashes, dtype=np.uint64)
+
+        tokens = np.arange(matrix.shape[1], dtype=np.uint64)
+        token_hashes = ((tokens[:, None] * a[None, :] + b[None, :]) % self._PRIME).astype(np.uint32)
+
+        # Частые токены получают максимальный хеш и не влияют на минимум
+        filtered_hashes = token_hashes.copy()
+        document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+        filtered_hashes[document_frequency > self.max_df * matrix.shape[0]] = np.iinfo(np.uint32).max
+
+        signatures = np.empty((matrix.shape[0], self.num_hashes), dtype=np.uint32)
+        for start in range(0, matrix.shape[0], self.chunk_size):
+            block = matrix[start:start + self.chunk_size]
+            signatures[start:start + block.shape[0]] = np.minimum.reduceat(
+                filtered_hashes[block.indices], block.indptr[:-1], axis=0)
+
+        # Правила только из частых токенов хешируются по полному набору
+        common_only = np.nonzero(signatures[:, 0] == np.iinfo(np.uint32).max)[0]
+        if len(common_only):
+            block = matrix[common_only]
+            signatures[common_only] = np.minimum.reduceat(
+                token_hashes[block.indices], block.indptr[:-1], axis=0)
+
+        return signatures
+
+    def _band_candidates(self, keys, rule_agent):
+        """
+        Пары кандидатов одной полосы
+
+        Каждое правило связывается с первым правилом каждого другого
+        агента в своей корзине, поэтому большие корзины одинаковых правил
+        дают не квадратичное, а линейное по числу агентов число пар.
+        """
+        order = np.lexsort((rule_agent, keys))
+        sorted_keys = keys[order]
+        sorted_agents = rule_agent[order]
+
+        # Первые правила каждой пары (корзина, агент)
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (sorted_keys[1:] != sorted_keys[:-1]) | (sorted_agents[1:] != sorted_agents[:-1])
+        heads = order[first]
+        head_keys = sorted_keys[first]
+
+        lo = np.searchsorted(head_keys, keys, side='left')
+        hi = np.searchsorted(head_keys, keys, side='right')
+        counts = hi - lo
+
+        # Только корзины, где есть больше одного агента
+        mask = counts > 1
+        members = np.nonzero(mask)[0]
+        counts = counts[mask]
+        if not len(members):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        left = np.repeat(members, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        right = heads[np.repeat(lo[mask], counts) + offsets]
+
+        keep = rule_agent[left] != rule_agent[right]
+        return left[keep], right[keep]
+
+    def _near_duplicates(self, matrix, rule_agent):
+        """Пары почти совпадающих правил разных агентов и их сходство"""
+        if matrix.shape[0] < 2:
+            return np.empty((0, 2), dtype=np.int64), np.empty(0)
+
+        signatures = self._signatures(matrix)
+        rows = self.num_hashes // self.bands
+        n_rules = matrix.shape[0]
+
+        codes = []
+        for band in range(self.bands):
+            # Ключ корзины - свертка значений полосы в одно 64-битное число;
+            # редкие коллизии лишь добавляют кандидатов, которые отсеет проверка
+            keys = signatures[:, band * rows].astype(np.uint64)
+            for column in range(band * rows + 1, (band + 1) * rows):
+                keys = keys * np.uint64(0x100000001B3) ^ signatures[:, column]
+            left, right = self._band_candidates(keys, rule_agent)
+            codes.append(np.minimum(left, right) * n_rules + np.maximum(left, right))
+
+        codes = np.unique(np.concatenate(codes))
+        pairs = np.stack([codes // n_rules, codes % n_rules], axis=1)
+
+        # Проверка точным коэффициентом Жаккара
+        sizes = np.diff(matrix.indptr)
+        scores = np.empty(len(pairs))
+        for start in range(0, len(pairs), self.chunk_size):
+            chunk = pairs[start:start + self.chunk_size]
+            intersection = np.asarray(
+                matrix[chunk[:, 0]].multiply(matrix[chunk[:, 1]]).sum(axis=1)).ravel()
+            scores[start:start + len(chunk)] = intersection / (
+                sizes[chunk[:, 0]] + sizes[chunk[:, 1]] - intersection)
+
+        keep = scores >= self.threshold
+        return pairs[keep], scores[keep]
+
+    def _overlap(self, pairs, rule_agent, rules_count, n_agents: int):
+        """Доля правил агента i, у которых есть почти дубликат у агента j"""
+        shared = np.zeros((n_agents, n_agents), dtype=np.int64)
+        overlap = np.zeros((n_agents, n_agents))
+
+        if len(pairs):
+            agents_left = rule_agent[pairs[:, 0]]
+            agents_right = rule_agent[pairs[:, 1]]
+            np.add.at(shared, (agents_left, agents_right), 1)
+            np.add.at(shared, (agents_right, agents_left), 1)
+
+            # Уникальные (правило, другой агент) в обе стороны
+            rule_ids = np.concatenate([pairs[:, 0], pairs[:, 1]])
+            other = np.concatenate([agents_right, agents_left])
+            matched = np.unique(rule_ids * n_agents + other)
+            np.add.at(overlap, (rule_agent[matched // n_agents], matched % n_agents), 1)
+
+        overlap /= np.maximum(rules_count, 1)[:, None]
+        np.fill_diagonal(overlap, 1.0)
+        return overlap, shared
+
+    def _top_shared(self, pairs, scores, rules, rule_agent, agents) -> List[Dict]:
+        """Наиболее схожие общие правила для каждой пары агентов"""
+        if not len(pairs):
+            return []
+
+        # Пара агентов упорядочена так, чтобы первый индекс был меньше
+        left = np.where(rule_agent[pairs[:, 0]] < rule_agent[pairs[:, 1]], pairs[:, 0], pairs[:, 1])
+        right = np.where(left == pairs[:, 0], pairs[:, 1], pairs[:, 0])
+        pair_code = rule_agent[left] * len(agents) + rule_agent[right]
+
+        order = np.lexsort((-scores, pair_code))
+        sorted_codes = pair_code[order]
+        group_start = np.searchsorted(sorted_codes, sorted_codes, side='left')
+        rank = np.arange(len(order)) - group_start
+        selected = order[rank < self.top_k]
+
+        result = {}
+        for index in selected:
+            i, j = divmod(int(pair_code[index]), len(agents))
+            entry = result.setdefault((i, j), {
+                'agent1': agents[i]['id'],
+                'agent2': agents[j]['id'],
+                'rules': []
+            })
+            entry['rules'].append({
+                'rule1': rules[left[index]],
+                'rule2': rules[right[index]],
+                'similarity': float(scores[index])
+            })
+
+        return [result[key] for key in sorted(result)]
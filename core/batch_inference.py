@@ -0,0 +1,266 @@
+"""
+Пакетный прямой вывод по множеству независимых наборов фактов
+
+Запуск без графического интерфейса:
+    python -m core.batch_inference --input cases.jsonl --output results.jsonl
+    python -m core.batch_inference --agent <ID> --workers 8 < cases.jsonl
+    python -m core.batch_inference --screen --input cases.jsonl --output matches.jsonl
+
+Каждая строка входного файла - JSON-объект случая:
+    {"id": "patient-1", "facts": {"температура": 39.5, "давление": 150}}
+Объект без ключа "facts" целиком считается набором фактов.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional, Union
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.inference_engine import InferenceEngine, CompiledRules
+from core.metrics import metrics
+from core.vectorized_conditions import ColumnarBatch, VectorizedConditions
+
+
+class _Worker:
+    """Исполнитель блоков случаев с заранее подготовленными правилами"""
+
+    def __init__(self, rules: CompiledRules, strategy: Union[str, Callable], vectorized: bool):
+        self.engine = InferenceEngine()
+        self.rules = rules
+        self.strategy = strategy
+        # Предикаты - замыкания, поэтому компилируются в самом исполнителе
+        self.conditions = VectorizedConditions(rules.rules, self.engine) if vectorized else None
+
+    def initial_matches(self, facts: List[Dict]) -> Optional[List[List[int]]]:
+        if self.conditions is None:
+            return None
+        return self.conditions.initial_matches(ColumnarBatch(facts))
+
+    def run_block(self, cases: List[Dict]) -> List[Dict]:
+        """Прямой вывод по блоку случаев"""
+        facts = [case_facts(case) for case in cases]
+        matches = self.initial_matches(facts)
+
+        results = []
+        for i, case in enumerate(cases):
+            working_memory = [{'variable': variable, 'value': value}
+                              for variable, value in facts[i].items()]
+            try:
+                result = self.engine.forward_chaining(
+                    working_memory, self.rules, self.strategy,
+                    matches[i] if matches is not None else None)
+            except Exception as e:
+                results.append({'id': case.get('id'), 'error': str(e)})
+                continue
+
+            results.append({
+                'id': case.get('id'),
+                'fired_rules': result['applied_rules'],
+                'derived_facts': result['new_facts'],
+            })
+
+        return results
+
+    def screen_block(self, cases: List[Dict]) -> List[Dict]:
+        """Правила, условия которых выполнены на исходных фактах, без вывода"""
+        facts = [case_facts(case) for case in cases]
+        matches = self.initial_matches(facts)
+        if matches is None:
+            check = self.engine.check_rule_condition
+            matches = [[index for index, rule in enumerate(self.rules.rules)
+                        if check(rule['condition'], case)] for case in facts]
+
+        return [{'id': case.get('id'),
+                 'matched_rules': [self.rules.rules[index]['name'] for index in matches[i]]}
+                for i, case in enumerate(cases)]
+
+
+# Исполнитель процесса пула: правила передаются один раз при запуске
+_worker: Optional[_Worker] = None
+
+
+def _init_worker(rules: CompiledRules, strategy: Union[str, Callable], vectorized: bool):
+    global _worker
+    _worker = _Worker(rules, strategy, vectorized)
+
+
+def _run_block(cases: List[Dict]) -> List[Dict]:
+    return _worker.run_block(cases)
+
+
+def _screen_block(cases: List[Dict]) -> List[Dict]:
+    return _worker.screen_block(cases)
+
+
+def case_facts(case: Dict) -> Dict:
+    """Факты случая в виде переменная -> значение"""
+    facts = case.get('facts', case)
+    if isinstance(facts, dict):
+        return facts
+    return {fact['variable']: fact['value'] for fact in facts}
+
+
+def _blocks(cases: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    iterator = iter(cases)
+    while True:
+        block = list(itertools.islice(iterator, size))
+        if not block:
+            return
+        yield block
+
+
+class BatchInference:
+    """
+    Прямой вывод одного набора правил по множеству случаев
+
+    Правила компилируются один раз и передаются исполнителям при
+    запуске пула, а не с каждым случаем. Случаи обрабатываются блоками:
+    условия всех правил на исходных фактах блока проверяются векторно
+    (core.vectorized_conditions), если установлен NumPy, после чего
+    вывод для каждого случая начинается с готовой агенды. Результаты
+    возвращаются в порядке входных случаев по мере готовности.
+    """
+
+    def __init__(self, rules: List[Dict], strategy: Union[str, Callable] = 'priority',
+                 workers: int = None, block_size: int = 1024, vectorized: bool = None):
+        self.rules = InferenceEngine.compile_rules(rules)
+        self.strategy = strategy
+        self.workers = workers or os.cpu_count() or 1
+        self.block_size = block_size
+        if vectorized is None:
+            vectorized = VectorizedConditions.available()
+        self.vectorized = vectorized
+
+    def run(self, cases: Iterable[Dict]) -> Iterator[Dict]:
+        """Вывод по всем случаям, результаты в порядке случаев"""
+        return self._map(_run_block, 'run_block', cases)
+
+    def screen(self, cases: Iterable[Dict]) -> Iterator[Dict]:
+        """Скрининг: какие правила срабатывают на исходных фактах каждого случая"""
+        return self._map(_screen_block, 'screen_block', cases)
+
+    def _map(self, function: Callable, method: str, cases: Iterable[Dict]) -> Iterator[Dict]:
+        blocks = _blocks(cases, self.block_size)
+
+        if self.workers <= 1:
+            worker = _Worker(self.rules, self.strategy, self.vectorized)
+            for block in blocks:
+                yield from getattr(worker, method)(block)
+            return
+
+        with multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                  initargs=(self.rules, self.strategy, self.vectorized)) as pool:
+            for results in pool.imap(function, blocks):
+                yield from results
+
+    @metrics.timed('inference.batch')
+    def run_to_jsonl(self, cases: Iterable[Dict], output: IO[str], screen: bool = False) -> Dict:
+        """
+        Вывод (или скрининг) с записью результатов в JSON Lines
+
+        Returns:
+            Счетчики обработанных случаев и ошибок
+        """
+        processed = 0
+        errors = 0
+
+        for result in (self.screen(cases) if screen else self.run(cases)):
+            output.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+            processed += 1
+            if 'error' in result:
+                errors += 1
+
+        return {'cases': processed, 'errors': errors}
+
+
+def read_cases(stream: IO[str]) -> Iterator[Dict]:
+    """Чтение случаев из JSON Lines, номер строки - ID по умолчанию"""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            case = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Строка {line_number} пропущена: {e}", file=sys.stderr)
+            continue
+        if isinstance(case, dict):
+            if 'facts' in case:
+                case.setdefault('id', line_number)
+            else:
+                case = {'id': line_number, 'facts': case}
+            yield case
+
+
+def load_rules(db_path: str, agent_id: str = None, domain_id: str = None) -> List[Dict]:
+    """
+    Правила из снимка базы знаний
+
+    Отсутствующий файл - ошибка: open_database создал бы пустую базу,
+    и все случаи получили бы пустой результат.
+    """
+    from database.sharded_db_manager import open_database
+
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"Файл базы знаний не найден: {db_path}")
+
+    # Сообщения базы данных не должны попадать в поток результатов
+    with contextlib.redirect_stdout(sys.stderr):
+        snapshot = open_database(db_path).get_snapshot()
+    if agent_id:
+        return snapshot.get_rules_by_agent(agent_id)
+    if domain_id:
+        return snapshot.get_rules_by_domain(domain_id)
+    return snapshot.rules
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Пакетный прямой вывод')
+    parser.add_argument('--db', default='knowledge_base.sqlite3', help='Файл базы знаний')
+    parser.add_argument('--agent', default=None, help='Только правила агента')
+    parser.add_argument('--domain', default=None, help='Только правила предметной области')
+    parser.add_argument('--input', default=None, help='Случаи в JSON Lines (по умолчанию stdin)')
+    parser.add_argument('--output', default=None, help='Результаты в JSON Lines (по умолчанию stdout)')
+    parser.add_argument('--strategy', default='priority',
+                        choices=['priority', 'recency', 'specificity', 'confidence'])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Количество процессов (по умолчанию по числу ядер)')
+    parser.add_argument('--block-size', type=int, default=1024,
+                        help='Случаев в блоке, который исполнитель обрабатывает за раз')
+    parser.add_argument('--screen', action='store_true',
+                        help='Только проверка условий правил на исходных фактах, без вывода')
+    parser.add_argument('--scalar', action='store_true',
+                        help='Не использовать векторную проверку условий')
+    args = parser.parse_args(argv)
+
+    try:
+        rules = load_rules(args.db, args.agent, args.domain)
+    except FileNotFoundError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    batch = BatchInference(rules, args.strategy, args.workers, args.block_size,
+                           vectorized=False if args.scalar else None)
+
+    input_stream = open(args.input, 'r', encoding='utf-8') if args.input else sys.stdin
+    output_stream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+
+    try:
+        summary = batch.run_to_jsonl(read_cases(input_stream), output_stream, args.screen)
+    finally:
+        if args.input:
+            input_stream.close()
+        if args.output:
+            output_stream.close()
+
+    print(f"Обработано случаев: {summary['cases']}, ошибок: {summary['errors']}, "
+          f"правил: {len(rules)}", file=sys.stderr)
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
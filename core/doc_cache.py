@@ -0,0 +1,170 @@
+"""
+Дисковый кэш разобранных spaCy документов
+
+Разбор текста полным конвейером (тегер, парсер, NER) - самая дорогая
+часть извлечения знаний. Результат разбора сохраняется в DocBin под
+ключом из хэша текста и версии модели; повторный анализ структуры,
+извлечение концепций или извлечение с измененными паттернами того же
+текста загружает готовый Doc вместо разбора.
+
+Размер кэша ограничен: при превышении удаляются записи, к которым
+дольше всего не обращались (время обращения - mtime файла).
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import spacy
+from spacy.tokens import Doc, DocBin
+
+from core.metrics import metrics
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# После вытеснения кэш занимает не больше этой доли лимита,
+# чтобы не сканировать каталог при каждой записи
+_LOW_WATERMARK = 0.8
+_SUFFIX = '.spacy'
+
+
+def model_key(nlp) -> str:
+    """Версия конвейера: от нее зависит результат разбора"""
+    meta = nlp.meta
+    return ':'.join((nlp.lang, meta.get('name', ''), meta.get('version', ''),
+                     spacy.__version__, '+'.join(nlp.pipe_names)))
+
+
+class DocCache:
+    """
+    Кэш Doc в каталоге directory, не больше max_bytes байт
+
+    Файлы записываются через временный файл и переименование, поэтому
+    кэш можно использовать из нескольких процессов (ExtractionPool).
+    Поврежденная запись удаляется, текст разбирается заново.
+    """
+
+    def __init__(self, directory, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None  # занятое место, считается при первой записи
+        self._model_keys = {}  # id(nlp) -> версия конвейера
+
+    def _path(self, nlp, text: str) -> Path:
+        key = self._model_keys.get(id(nlp))
+        if key is None:
+            key = self._model_keys[id(nlp)] = model_key(nlp)
+        digest = hashlib.sha256(key.encode('utf-8') + b'\0' + text.encode('utf-8')).hexdigest()
+        return self.directory / digest[:2] / (digest + _SUFFIX)
+
+    def parse(self, nlp, text: str) -> Doc:
+        """Doc текста: из кэша или разбором nlp(text) с сохранением"""
+        path = self._path(nlp, text)
+        doc = self._load(nlp, path)
+        if doc is not None:
+            if metrics.enabled:
+                metrics.increment('doc_cache.hits')
+            return doc
+
+        if metrics.enabled:
+            metrics.increment('doc_cache.misses')
+        doc = nlp(text)
+        self._store(doc, path)
+        return doc
+
+    def _load(self, nlp, path: Path) -> Optional[Doc]:
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+
+        try:
+            with metrics.timer('doc_cache.load'):
+                doc = next(iter(DocBin().from_bytes(data).get_docs(nlp.vocab)))
+        except Exception as e:
+            print(f"Запись кэша документов повреждена, удалена: {path.name} ({e})")
+            self._remove(path)
+            return None
+
+        try:
+            # Время обращения для вытеснения давно не использованных записей
+            os.utime(path)
+        except OSError:
+            pass
+        return doc
+
+    def _store(self, doc: Doc, path: Path):
+        doc_bin = DocBin(store_user_data=False)
+        doc_bin.add(doc)
+        data = doc_bin.to_bytes()
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Ошибка записи в кэш документов: {e}")
+            return
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """(mtime, размер, путь) всех записей"""
+        entries = []
+        if not self.directory.exists():
+            return entries
+        for path in self.directory.glob('*/*' + _SUFFIX):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @staticmethod
+    def _remove(path: Path) -> bool:
+        try:
+            path.unlink()
+            return True
+        except OSError:
+            return False
+
+    def size(self) -> int:
+        """Место, занятое записями, в байтах"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target_bytes: int = None) -> int:
+        """
+        Удаление давно не использованных записей, пока кэш больше target_bytes
+
+        Returns:
+            Количество удаленных записей
+        """
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * _LOW_WATERMARK)
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target_bytes:
+                break
+            if self._remove(path):
+                removed += 1
+            total -= size
+
+        self._size = total
+        if metrics.enabled and removed:
+            metrics.increment('doc_cache.evictions', removed)
+        return removed
+
+    def clear(self) -> int:
+        """Удаление всех записей"""
+        return self.evict(0)
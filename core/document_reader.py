@@ -0,0 +1,186 @@
+"""
+Чтение больших текстовых документов через mmap
+
+Файл не загружается в память целиком: байты отображаются mmap и
+декодируются кусками инкрементальным декодером, а текстовым процессорам
+передаются окна, выровненные по границам предложений. Так документ в
+сотни мегабайт обрабатывается с памятью порядка размера окна.
+"""
+import codecs
+import mmap
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from core.metrics import metrics
+
+# Символов в окне, передаваемом процессору за один вызов
+DEFAULT_WINDOW_CHARS = 100_000
+# Байтов, декодируемых за один шаг
+CHUNK_BYTES = 1 << 20
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Конец предложения (с закрывающими кавычками и скобками) или пустая строка
+_SENTENCE_END = re.compile(r'[.!?…]+["»”)\]]*\s+|\n\s*\n')
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Кодировка по началу файла: метка BOM, иначе UTF-8, если начало
+    корректно в UTF-8, иначе cp1251 (старые русские документы)
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # final=False: последний символ образца может быть обрезан
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+
+def sentence_boundary(text: str, limit: int) -> int:
+    """
+    Позиция разреза text не дальше limit: после последнего конца
+    предложения во второй половине окна, иначе после последнего пробела
+    """
+    boundary = 0
+    for match in _SENTENCE_END.finditer(text, limit // 2, limit):
+        boundary = match.end()
+    if boundary:
+        return boundary
+    space = max(text.rfind(' ', limit // 2, limit), text.rfind('\n', limit // 2, limit))
+    return space + 1 if space > 0 else limit
+
+
+class DocumentReader:
+    """
+    Документ на диске, отображенный в память
+
+    Байты, которые не удалось декодировать, заменяются символом U+FFFD:
+    одна испорченная страница не прерывает чтение документа.
+    """
+
+    def __init__(self, path, encoding: str = None, chunk_bytes: int = CHUNK_BYTES):
+        self.path = Path(path)
+        self.chunk_bytes = chunk_bytes
+        self.size = os.path.getsize(self.path)
+
+        self._file = open(self.path, 'rb')
+        self._map = None
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self._map, 'madvise'):
+                # Файл читается один раз от начала к концу
+                self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+        self.encoding = encoding or detect_encoding(self._map[:chunk_bytes] if self._map else b'')
+
+    def iter_chunks(self) -> Iterator[str]:
+        """Декодированный текст кусками по chunk_bytes байт"""
+        if self._map is None:
+            return
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        for start in range(0, self.size, self.chunk_bytes):
+            end = min(start + self.chunk_bytes, self.size)
+            text = decoder.decode(self._map[start:end], final=end == self.size)
+            if metrics.enabled:
+                metrics.increment('document_reader.bytes', end - start)
+            if text:
+                yield text
+
+    def iter_windows(self, window_chars: int = DEFAULT_WINDOW_CHARS) -> Iterator[str]:
+        """Текст окнами не длиннее window_chars, разрезанными между предложениями"""
+        buffer = ''
+        for chunk in self.iter_chunks():
+            buffer += chunk
+            while len(buffer) >= window_chars:
+                cut = sentence_boundary(buffer, window_chars)
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+        if buffer.strip():
+            yield buffer
+
+    def preview(self, max_chars: int = DEFAULT_WINDOW_CHARS) -> Tuple[str, bool]:
+        """
+        Начало документа для показа в редакторе
+
+        Returns:
+            (текст, весь ли документ в него вошел)
+        """
+        windows = self.iter_windows(max_chars)
+        first = next(windows, '')
+        return first, next(windows, None) is None
+
+    def read_text(self) -> str:
+        """Весь текст документа (для небольших файлов)"""
+        return ''.join(self.iter_chunks())
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _add_statistics(total: Dict, part: Dict):
+    """Суммирование числовых статистик (в том числе вложенных словарей)"""
+    for key, value in part.items():
+        if isinstance(value, dict):
+            _add_statistics(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+
+
+def extract_from_document(processor, path, source_info: Dict,
+                          window_chars: int = DEFAULT_WINDOW_CHARS,
+                          structure: bool = False, concepts: bool = False) -> Dict:
+    """
+    Извлечение знаний из документа по окнам
+
+    processor - TextProcessor (обычный или spaCy). Результат того же вида,
+    что у extract_from_text: правила и факты всех окон, статистика
+    просуммирована. При structure=True в результате есть и 'structure' -
+    сумма analyze_text_structure по окнам. При concepts=True (только
+    процессор spaCy) - 'concepts' и 'relationships' всех окон.
+    """
+    result = {'rules': [], 'facts': [], 'statistics': {'windows': 0}}
+    totals: Optional[Dict] = {} if structure else None
+    if concepts:
+        result['concepts'] = []
+        result['relationships'] = []
+        seen = set()
+
+    with DocumentReader(path) as reader:
+        for window in reader.iter_windows(window_chars):
+            extracted = processor.extract_from_text(window, source_info)
+            result['rules'].extend(extracted['rules'])
+            result['facts'].extend(extracted['facts'])
+            _add_statistics(result['statistics'], extracted.get('statistics', {}))
+            result['statistics']['windows'] += 1
+            if totals is not None:
+                _add_statistics(totals, processor.analyze_text_structure(window))
+            if concepts:
+                for concept in processor.extract_key_concepts(window):
+                    if (concept['text'], concept['type']) not in seen:
+                        seen.add((concept['text'], concept['type']))
+                        result['concepts'].append(concept)
+                result['relationships'].extend(processor.extract_relationships(window))
+
+    if totals is not None:
+        result['structure'] = totals
+    return result
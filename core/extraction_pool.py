@@ -0,0 +1,317 @@
+"""
+Пул процессов для извлечения знаний из множества документов
+
+Модель spaCy загружается один раз в родительском процессе, исполнители
+создаются через fork и используют ее память совместно (копирование при
+записи), поэтому при N процессах в памяти остается примерно одна модель.
+
+Запуск без графического интерфейса:
+    python -m core.extraction_pool --output extracted.jsonl docs/*.txt
+    python -m core.extraction_pool --workers 4 --max-documents 200 < docs.jsonl
+
+Строка входа в JSON Lines: {"id": "doc-1", "text": "...", "source_info": {...}}
+"""
+import argparse
+import collections
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.document_reader import DEFAULT_WINDOW_CHARS, DocumentReader
+from core.metrics import metrics
+
+
+# Процессоры пулов этого процесса: исполнители наследуют их при fork
+_processors: Dict[int, object] = {}
+_pool_ids = itertools.count(1)
+
+# Сообщение исполнителя о завершении после max_documents документов
+_RECYCLE = 'recycle'
+
+
+def _worker_loop(pool_id: int, tasks, results, max_documents: Optional[int]):
+    """Цикл исполнителя: берет документы из очереди до лимита или до None"""
+    processor = _processors[pool_id]
+    processed = 0
+
+    while max_documents is None or processed < max_documents:
+        task = tasks.get()
+        if task is None:
+            return
+        index, text, source_info = task
+        try:
+            results.put((index, processor.extract_from_text(text, source_info), None))
+        except Exception as e:
+            results.put((index, None, str(e)))
+        processed += 1
+
+    results.put((_RECYCLE, os.getpid(), None))
+
+
+class ExtractionPool:
+    """
+    Постоянный пул исполнителей TextProcessor.extract_from_text
+
+    Документы передаются исполнителям через очередь; одновременно в работе
+    не больше queue_size документов, поэтому входной итератор читается по
+    мере обработки, а не целиком. Исполнитель завершается после
+    max_documents документов и заменяется новым, ответвленным от родителя:
+    так рост памяти исполнителя (кэши словаря spaCy, фрагментация) ограничен.
+
+    Без fork (Windows, macOS по умолчанию) или при workers=1 документы
+    обрабатываются в текущем процессе.
+    """
+
+    def __init__(self, processor=None, language: str = 'ru', workers: int = None,
+                 max_documents: Optional[int] = 500, queue_size: int = None):
+        if processor is None:
+            from core.text_processor_spacy import TextProcessor
+            processor = TextProcessor(language)
+        self.processor = processor
+        self.workers = workers or os.cpu_count() or 1
+        self.max_documents = max_documents
+        self.queue_size = queue_size or self.workers * 2
+
+        self.pool_id = next(_pool_ids)
+        self._context = None
+        self._tasks = None
+        self._results = None
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self.recycled = 0
+
+    @staticmethod
+    def fork_available() -> bool:
+        return 'fork' in multiprocessing.get_all_start_methods()
+
+    @property
+    def parallel(self) -> bool:
+        return self.workers > 1 and self.fork_available()
+
+    def start(self):
+        """Запуск исполнителей (вызывается автоматически при первой обработке)"""
+        if not self.parallel or self._processes:
+            return
+
+        _processors[self.pool_id] = self.processor
+        self._context = multiprocessing.get_context('fork')
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+
+        # Объекты модели переводятся в постоянное поколение сборщика мусора:
+        # он не обходит их в исполнителях и не копирует их страницы памяти
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _spawn(self):
+        process = self._context.Process(
+            target=_worker_loop, daemon=True,
+            args=(self.pool_id, self._tasks, self._results, self.max_documents))
+        process.start()
+        self._processes[process.pid] = process
+
+    def _recycle(self, pid: int):
+        process = self._processes.pop(pid, None)
+        if process is not None:
+            process.join()
+        self.recycled += 1
+        if metrics.enabled:
+            metrics.increment('text.extraction_pool.recycled')
+        self._spawn()
+
+    def _next_result(self) -> Tuple[int, Optional[Dict], Optional[str]]:
+        """Очередной результат; замена исполнителей, отработавших лимит"""
+        while True:
+            try:
+                index, result, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [pid for pid, process in self._processes.items()
+                        if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Исполнитель извлечения аварийно завершился (pid {dead[0]})")
+                continue
+
+            if index == _RECYCLE:
+                self._recycle(result)
+                continue
+            return index, result, error
+
+    def imap(self, documents: Iterable[Tuple[str, Dict]]) -> Iterator[Dict]:
+        """
+        Извлечение по документам (text, source_info), результаты в порядке документов
+
+        Результат документа - словарь extract_from_text; при ошибке -
+        {'error': сообщение}.
+        """
+        if not self.parallel:
+            for text, source_info in documents:
+                yield self._extract_local(text, source_info)
+            return
+
+        self.start()
+        documents = iter(documents)
+        pending: Dict[int, Dict] = {}
+        submitted = 0
+        next_index = 0
+        exhausted = False
+
+        while not exhausted or next_index < submitted:
+            # Подача документов, пока не заполнена очередь
+            while not exhausted and submitted - next_index - len(pending) < self.queue_size:
+                try:
+                    text, source_info = next(documents)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self._tasks.put((submitted, text, source_info))
+                submitted += 1
+
+            if next_index >= submitted:
+                continue
+
+            index, result, error = self._next_result()
+            pending[index] = {'error': error} if error is not None else result
+
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+
+    def map(self, documents: Iterable[Tuple[str, Dict]]) -> List[Dict]:
+        return list(self.imap(documents))
+
+    def _extract_local(self, text: str, source_info: Dict) -> Dict:
+        try:
+            return self.processor.extract_from_text(text, source_info)
+        except Exception as e:
+            return {'error': str(e)}
+
+    def close(self):
+        """Остановка исполнителей"""
+        if not self._processes:
+            return
+
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+        _processors.pop(self.pool_id, None)
+        gc.unfreeze()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_documents(paths: List[str], stream: IO[str] = None,
+                   window_chars: int = DEFAULT_WINDOW_CHARS) -> Iterator[Tuple[str, Dict]]:
+    """
+    Документы из текстовых файлов или из JSON Lines
+
+    Файлы читаются через mmap с определением кодировки; файл длиннее
+    window_chars передается частями по границам предложений, у каждой
+    части в source_info есть номер part.
+    """
+    for path in paths:
+        source_info = {'id': path, 'source_file': os.path.basename(path)}
+        with DocumentReader(path) as reader:
+            windows = reader.iter_windows(window_chars)
+            first = next(windows, '')
+            second = next(windows, None)
+            if second is None:
+                yield first, source_info
+                continue
+            for part, window in enumerate(itertools.chain((first, second), windows)):
+                yield window, dict(source_info, part=part)
+
+    if stream is None:
+        return
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            document = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Строка {line_number} пропущена: {e}", file=sys.stderr)
+            continue
+        source_info = dict(document.get('source_info') or {})
+        source_info.setdefault('id', document.get('id', line_number))
+        yield document.get('text', ''), source_info
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Пакетное извлечение знаний из текстов')
+    parser.add_argument('files', nargs='*', help='Текстовые файлы (без них - JSON Lines из stdin)')
+    parser.add_argument('--output', default=None, help='Результаты в JSON Lines (по умолчанию stdout)')
+    parser.add_argument('--language', default='ru', choices=['ru', 'en'])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Количество процессов (по умолчанию по числу ядер)')
+    parser.add_argument('--max-documents', type=int, default=500,
+                        help='Документов на исполнитель до его замены')
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help='Документов в работе одновременно')
+    parser.add_argument('--window-chars', type=int, default=DEFAULT_WINDOW_CHARS,
+                        help='Длинные файлы передаются частями не длиннее этого числа символов')
+    parser.add_argument('--doc-cache', default=None,
+                        help='Каталог кэша разобранных документов (повторные запуски не разбирают тексты заново)')
+    parser.add_argument('--doc-cache-mb', type=int, default=512, help='Размер кэша документов, МБ')
+    parser.add_argument('--tiered', action='store_true',
+                        help='Полный конвейер spaCy только для предложений-кандидатов')
+    args = parser.parse_args(argv)
+
+    from core.text_processor_spacy import TextProcessor
+    doc_cache = None
+    if args.doc_cache:
+        from core.doc_cache import DocCache
+        doc_cache = DocCache(args.doc_cache, args.doc_cache_mb * 1024 * 1024)
+    processor = TextProcessor(args.language, tiered=args.tiered, doc_cache=doc_cache)
+
+    documents = read_documents(args.files, None if args.files else sys.stdin, args.window_chars)
+    output_stream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+
+    processed = 0
+    errors = 0
+    try:
+        with ExtractionPool(processor, workers=args.workers,
+                            max_documents=args.max_documents, queue_size=args.queue_size) as pool:
+            # Идентификатор документа нужен и в выходной строке
+            ids = collections.deque()
+
+            def tracked():
+                for text, source_info in documents:
+                    ids.append((source_info.get('id'), source_info.get('part')))
+                    yield text, source_info
+
+            for result in pool.imap(tracked()):
+                document_id, part = ids.popleft()
+                result = dict(result, id=document_id)
+                if part is not None:
+                    result['part'] = part
+                output_stream.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+                processed += 1
+                if 'error' in result:
+                    errors += 1
+    finally:
+        if args.output:
+            output_stream.close()
+
+    print(f"Обработано документов: {processed}, ошибок: {errors}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import functools
+import keyword
+import re
+from typing import List, Dict, Optional, Union, Callable
+
+from core.agenda import Agenda
+from core.metrics import metrics
+
+
+@functools.lru_cache(maxsize=65536)
+def _compile_expression(expr: str):
+    """
+    Компиляция выражения с кэшем
+
+    После подстановки фактов текст условия часто повторяется (между
+    проходами вывода и между случаями пакетного вывода), поэтому разбор
+    выполняется один раз на уникальный текст.
+    """
+    # eval() для строки отбрасывает начальные пробелы и табуляции, compile() - нет
+    return compile(expr.lstrip(' \t'), '<rule>', 'eval')
+
+
+# Служебные слова условий, которые не являются переменными
+_NON_VARIABLES = frozenset(keyword.kwlist) | {'и', 'или', 'не'}
+
+
+class CompiledRules:
+    """Правила с индексом: переменная -> индексы зависящих от нее правил"""
+
+    __slots__ = ('rules', 'dependents')
+
+    def __init__(self, rules: List, dependents: Dict[str, List[int]]):
+        self.rules = rules
+        self.dependents = dependents
+
+
+class InferenceEngine:
+    """Машина логического вывода по продукционным правилам"""
+
+    @staticmethod
+    def compile_rules(rules: List) -> CompiledRules:
+        """Подготовка правил к многократному выводу"""
+        dependents = {}
+        for index, rule in enumerate(rules):
+            for token in InferenceEngine.rule_variables(rule):
+                dependents.setdefault(token, []).append(index)
+        return CompiledRules(list(rules), dependents)
+
+    @metrics.timed('inference.forward_chaining')
+    def forward_chaining(self, initial_facts: List, rules: Union[List, CompiledRules],
+                         strategy: Union[str, Callable] = 'priority',
+                         initial_activations: Optional[List[int]] = None) -> Dict:
+        """
+        Прямой вывод с агендой
+
+        Активации правил хранятся в куче, упорядоченной стратегией
+        разрешения конфликтов (см. core.agenda.STRATEGIES). После
+        появления нового факта перепроверяются только правила, в условии
+        или действии которых встречается его переменная.
+
+        rules может быть результатом compile_rules, если один набор
+        правил применяется ко многим наборам фактов. initial_activations -
+        заранее найденные (например, векторно) индексы правил, условия
+        которых выполнены на начальных фактах; тогда первый проход по всем
+        правилам пропускается.
+        """
+        if not isinstance(rules, CompiledRules):
+            rules = self.compile_rules(rules)
+        dependents = rules.dependents
+        rules = rules.rules
+
+        # Создаем рабочую память
+        working_memory = {}
+        for fact in initial_facts:
+            working_memory[fact['variable']] = fact['value']
+
+        applied_rules = []
+        new_facts = []
+
+        agenda = Agenda(strategy)
+        # Правила, которые уже не могут дать новый факт
+        retired = set()
+
+        iterations = 0
+        rules_checked = 0
+
+        if initial_activations is not None:
+            for index in initial_activations:
+                agenda.push(rules[index], index)
+        else:
+            for index, rule in enumerate(rules):
+                rules_checked += 1
+                if self.check_rule_condition(rule['condition'], working_memory):
+                    agenda.push(rule, index)
+
+        # Цикл вывода: на каждом шаге срабатывает одна активация
+        while agenda:
+            activation = agenda.pop()
+            rule = activation.rule
+            iterations += 1
+
+            # Извлекаем действие
+            action_result = self.execute_rule_action(rule['action'], working_memory)
+            if not action_result:
+                # Значение может вычислиться позже, когда появятся нужные факты
+                continue
+
+            variable, value = action_result
+            retired.add(activation.index)
+            if variable in working_memory:
+                continue
+
+            # Добавляем новый факт
+            working_memory[variable] = value
+            new_facts.append({
+                'variable': variable,
+                'value': value,
+                'rule': rule['name']
+            })
+            applied_rules.append(rule['name'])
+
+            # Обновляем агенду для правил, зависящих от новой переменной
+            for index in dependents.get(variable, ()):
+                if index in retired:
+                    continue
+                rules_checked += 1
+                if self.check_rule_condition(rules[index]['condition'], working_memory):
+                    agenda.push(rules[index], index)
+                else:
+                    agenda.remove(index)
+
+        if metrics.enabled:
+            metrics.increment('inference.iterations', iterations)
+            metrics.increment('inference.rules_checked', rules_checked)
+            metrics.increment('inference.rules_fired', len(applied_rules))
+
+        return {
+            'final_facts': working_memory,
+            'applied_rules': applied_rules,
+            'new_facts': new_facts
+        }
+
+    @staticmethod
+    def action_target(action: str) -> Optional[str]:
+        """Переменная, которой действие присваивает значение"""
+        match = re.match(r'([\w]+)\s*=\s*(.+)', action or '')
+        return match.group(1) if match else None
+
+    @staticmethod
+    def read_variables(rule: Dict) -> set:
+        """Переменные, которые читают условие и выражение значения действия"""
+        text = rule.get('condition') or ''
+        match = re.match(r'([\w]+)\s*=\s*(.+)', rule.get('action') or '')
+        if match:
+            text += ' ' + match.group(2)
+
+        # Строковые литералы и числа переменными не являются
+        text = re.sub(r'"[^"]*"|\'[^\']*\'', ' ', text)
+        return {name for name in re.findall(r'\b[^\W\d]\w*', text)
+                if name not in _NON_VARIABLES}
+
+    @staticmethod
+    def rule_variables(rule: Dict) -> set:
+        """Имена, упоминаемые в условии и действии правила"""
+        return set(re.findall(r'\w+', f"{rule['condition']} {rule['action']}"))
+
+    def check_rule_condition(self, condition: str, facts: Dict) -> bool:
+        """Проверка условия правила"""
+        # Простая проверка для демонстрации, нужен полноценный парсер условий
+
+        try:
+            # Заменяем переменные на их значения
+            expr = condition
+            for var, value in facts.items():
+                expr = expr.replace(var, str(value))
+
+            # Вычисляем выражение
+            return eval(_compile_expression(expr))
+        except:
+            return False
+
+    def execute_rule_action(self, action: str, facts: Dict) -> Optional[tuple]:
+        """Выполнение действия правила"""
+        # Простой парсер для действий вида "переменная = значение"
+        match = re.match(r'([\w]+)\s*=\s*(.+)', action)
+        if match:
+            variable = match.group(1)
+            value_expr = match.group(2)
+
+            try:
+                # Заменяем переменные в выражении значения
+                for var, val in facts.items():
+                    value_expr = value_expr.replace(var, str(val))
+
+                # Вычисляем значение
+                value = eval(_compile_expression(value_expr))
+                return (variable, value)
+            except:
+                return None
+
+        return None
+
+    @metrics.timed('inference.backward_chaining')
+    def backward_chaining(self, goal: str, rules: List) -> List[Dict]:
+        """
+        Поиск правил, выводящих цель
+
+        Returns:
+            Список правил с разобранными условиями для доказательства
+        """
+        relevant_rules = []
+        for rule in rules:
+            # Простая проверка: содержится ли цель в действии
+            if goal.lower() in rule['action'].lower():
+                relevant_rules.append({
+                    'rule': rule,
+                    'conditions': self.extract_conditions(rule['condition'])
+                })
+
+        if metrics.enabled:
+            metrics.increment('inference.rules_checked', len(rules))
+
+        return relevant_rules
+
+    def extract_conditions(self, condition_text: str) -> List[str]:
+        """Извлечение условий из текста условия"""
+        # Простой парсер для демонстрации
+        conditions = []
+
+        # Разбиваем по "и", "или"
+        parts = re.split(r'\s+и\s+|\s+или\s+', condition_text, flags=re.IGNORECASE)
+
+        for part in parts:
+            part = part.strip()
+            if part:
+                conditions.append(part)
+
+        return conditions
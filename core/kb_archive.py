@@ -0,0 +1,210 @@
+"""
+Компактный формат экспорта базы знаний
+
+Файл: заголовок, схема (JSON с именами разделов и столбцов) и кадры.
+Кадр - пачка строк одного раздела, разложенная по столбцам, сериализованная
+marshal и сжатая zlib, с длиной и crc32 в заголовке кадра. Последний кадр
+содержит число строк и общую контрольную сумму: обрезанный файл
+обнаруживается при чтении.
+
+Запись и чтение идут потоком, пачками по batch_rows строк, поэтому
+размер выгружаемой базы знаний не ограничен памятью.
+"""
+import json
+import marshal
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+
+class ArchiveError(Exception):
+    """Архив поврежден, обрезан или записан другой версией формата"""
+
+
+MAGIC = b'KBAR'
+FORMAT_VERSION = 1
+
+# magic, версия формата, версия marshal, ревизия данных, длина схемы
+_HEADER = struct.Struct('<4sHHQI')
+# номер раздела, число строк, длина данных, crc32 данных
+_FRAME = struct.Struct('<BIII')
+# Номер раздела завершающего кадра
+_END = 0xFF
+
+
+class ArchiveWriter:
+    """Потоковая запись архива"""
+
+    def __init__(self, path, sections: Dict[str, Sequence[str]], data_version: int = 0,
+                 metadata: Dict = None, level: int = 3, batch_rows: int = 10000):
+        """
+        Args:
+            sections: Раздел -> имена столбцов; строки разделов передаются
+                в write_rows кортежами в этом порядке
+            metadata: Дополнительные сведения для схемы (дата экспорта и т.п.)
+            data_version: Ревизия данных; можно изменить до close()
+        """
+        self.path = Path(path)
+        self.sections = {name: list(columns) for name, columns in sections.items()}
+        self._index = {name: index for index, name in enumerate(self.sections)}
+        self.level = level
+        self.batch_rows = batch_rows
+
+        self._pending: Dict[str, List[Sequence]] = {name: [] for name in self.sections}
+        self._current = None  # раздел последнего вызова write_rows
+        self._rows = 0
+
+        schema = json.dumps({'sections': self.sections, 'metadata': metadata or {}},
+                            ensure_ascii=False).encode('utf-8')
+        self.data_version = data_version
+        self._schema_length = len(schema)
+        self._file = open(self.path, 'wb')
+        self._write_header()
+        self._file.write(schema)
+        self._checksum = zlib.crc32(schema)
+
+    def _write_header(self):
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, marshal.version,
+                                      self.data_version, self._schema_length))
+
+    def write_rows(self, section: str, rows: Iterable[Sequence]):
+        """
+        Добавление строк раздела (кортежей значений в порядке столбцов)
+
+        Кадры пишутся в порядке вызовов: строки предыдущего раздела
+        сбрасываются, поэтому при чтении разделы идут в том же порядке.
+        """
+        if self._current is not None and self._current != section:
+            self._flush(self._current)
+        self._current = section
+        pending = self._pending[section]
+        for row in rows:
+            pending.append(row)
+            if len(pending) >= self.batch_rows:
+                self._flush(section)
+                pending = self._pending[section]
+
+    def _flush(self, section: str):
+        rows = self._pending[section]
+        if not rows:
+            return
+        self._pending[section] = []
+
+        columns = tuple(zip(*rows))
+        payload = zlib.compress(marshal.dumps(columns), self.level)
+        crc = zlib.crc32(payload)
+        self._file.write(_FRAME.pack(self._index[section], len(rows), len(payload), crc))
+        self._file.write(payload)
+        self._rows += len(rows)
+        self._checksum = zlib.crc32(payload, self._checksum)
+
+    def close(self):
+        """Запись оставшихся строк и завершающего кадра"""
+        if self._file.closed:
+            return
+        for section in self.sections:
+            self._flush(section)
+        self._file.write(_FRAME.pack(_END, self._rows, 0, self._checksum))
+
+        # Ревизия могла быть уточнена во время записи
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+
+    def abort(self):
+        """Закрытие без завершающего кадра: такой архив не читается"""
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ArchiveReader:
+    """Потоковое чтение архива"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._read_header()
+        except Exception:
+            self._file.close()
+            raise
+
+    def _read(self, size: int) -> bytes:
+        data = self._file.read(size)
+        if len(data) != size:
+            raise ArchiveError(f"Архив обрезан: {self.path}")
+        return data
+
+    def _read_header(self):
+        magic, version, marshal_version, data_version, schema_length = \
+            _HEADER.unpack(self._read(_HEADER.size))
+
+        if magic != MAGIC:
+            raise ArchiveError(f"Файл не является архивом базы знаний: {self.path}")
+        if version != FORMAT_VERSION or marshal_version > marshal.version:
+            raise ArchiveError(f"Неподдерживаемая версия архива: {version}")
+
+        schema_data = self._read(schema_length)
+        try:
+            schema = json.loads(schema_data.decode('utf-8'))
+        except ValueError:
+            raise ArchiveError(f"Схема архива повреждена: {self.path}")
+
+        self.data_version = data_version
+        self.sections: Dict[str, List[str]] = schema['sections']
+        self.metadata: Dict = schema.get('metadata') or {}
+        self._names = list(self.sections)
+        self._checksum = zlib.crc32(schema_data)
+
+    def iter_batches(self) -> Iterator[Tuple[str, List[Dict]]]:
+        """Пачки (раздел, строки-словари) в порядке записи"""
+        rows_read = 0
+        while True:
+            index, rows, length, crc = _FRAME.unpack(self._read(_FRAME.size))
+
+            if index == _END:
+                if rows != rows_read or crc != self._checksum:
+                    raise ArchiveError(f"Контрольная сумма архива не совпадает: {self.path}")
+                return
+
+            payload = self._read(length)
+            if zlib.crc32(payload) != crc or index >= len(self._names):
+                raise ArchiveError(f"Кадр архива поврежден: {self.path}")
+            self._checksum = zlib.crc32(payload, self._checksum)
+
+            try:
+                columns = marshal.loads(zlib.decompress(payload))
+            except (ValueError, EOFError, TypeError, zlib.error):
+                raise ArchiveError(f"Кадр архива поврежден: {self.path}")
+
+            section = self._names[index]
+            names = self.sections[section]
+            rows_read += rows
+            yield section, [dict(zip(names, values)) for values in zip(*columns)]
+
+    def read_all(self) -> Dict[str, List[Dict]]:
+        """Все строки по разделам (для небольших архивов)"""
+        data = {section: [] for section in self.sections}
+        for section, rows in self.iter_batches():
+            data[section].extend(rows)
+        return data
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,340 @@
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+from typing import List, Dict, Optional, Iterable
+
+from core.agenda import rule_priority
+from core.tokenizer import rule_signatures, jaccard, similarity_type
+
+
+class SnapshotError(Exception):
+    """Снимок поврежден, устарел или записан другой версией формата"""
+
+
+class KnowledgeBaseSnapshot:
+    """
+    Бинарный снимок скомпилированной базы знаний.
+
+    Файл состоит из заголовка, таблицы секций и самих секций. Секции
+    сериализованы marshal и декодируются лениво при первом обращении,
+    поэтому открытие снимка сводится к mmap и разбору заголовка.
+    Снимок не обращается к SQLite: правила уже отсортированы по приоритету,
+    теги разобраны, множества токенов и индексы посчитаны заранее.
+    """
+
+    MAGIC = b'KBSN'
+    FORMAT_VERSION = 2
+
+    # magic, версия формата, версия marshal, ревизия данных, число секций
+    _HEADER = struct.Struct('<4sHHQI')
+    # имя секции, смещение, длина, crc32
+    _SECTION = struct.Struct('<16sQQI')
+
+    RULE_FIELDS = ('id', 'name', 'condition', 'action', 'rule_type', 'priority',
+                   'confidence', 'source_file', 'author', 'tags', 'agent_id',
+                   'domain_id', 'created_at')
+    FACT_FIELDS = ('id', 'variable_name', 'value', 'confidence', 'source_file',
+                   'author', 'is_derived', 'agent_id', 'domain_id', 'created_at')
+
+    def __init__(self, path):
+        """Открытие снимка с диска"""
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f"Пустой файл снимка: {self.path}")
+
+        self._sections = {}
+        self._cache = {}
+        self._read_header()
+
+    def _read_header(self):
+        """Разбор заголовка и таблицы секций"""
+        if len(self._map) < self._HEADER.size:
+            self.close()
+            raise SnapshotError(f"Файл снимка обрезан: {self.path}")
+
+        magic, version, marshal_version, revision, count = \
+            self._HEADER.unpack_from(self._map, 0)
+
+        if magic != self.MAGIC:
+            self.close()
+            raise SnapshotError(f"Файл не является снимком базы знаний: {self.path}")
+        if version != self.FORMAT_VERSION or marshal_version != marshal.version:
+            self.close()
+            raise SnapshotError(f"Неподдерживаемая версия снимка: {version}")
+
+        self.revision = revision
+
+        offset = self._HEADER.size
+        for _ in range(count):
+            name, start, length, crc = self._SECTION.unpack_from(self._map, offset)
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (start, length, crc)
+            offset += self._SECTION.size
+
+    def _section(self, name: str):
+        """Ленивое декодирование секции с проверкой контрольной суммы"""
+        if name not in self._cache:
+            if name not in self._sections:
+                raise SnapshotError(f"В снимке нет секции '{name}'")
+
+            start, length, crc = self._sections[name]
+            payload = self._map[start:start + length]
+            if zlib.crc32(payload) != crc:
+                raise SnapshotError(f"Секция '{name}' повреждена")
+
+            self._cache[name] = marshal.loads(payload)
+
+        return self._cache[name]
+
+    def close(self):
+        """Закрытие отображения файла"""
+        self._cache.clear()
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # Построение снимка
+
+    @classmethod
+    def build(cls, path, revision: int, domains: List[Dict], agents: List[Dict],
+              rules: List[Dict], facts: List[Dict],
+              signatures: Dict[str, tuple] = None) -> 'KnowledgeBaseSnapshot':
+        """
+        Компиляция базы знаний и запись снимка на диск
+
+        signatures - сохраненные сигнатуры правил (ID -> условие, действие,
+        основы условия, основы действия); недостающие считаются по тексту
+        """
+        # Порядок тот же, что у get_rules_by_agent: приоритет, затем дата
+        rules = sorted(rules, key=lambda r: r.get('created_at') or '', reverse=True)
+        rules.sort(key=rule_priority, reverse=True)
+
+        rule_rows = tuple(
+            tuple(cls._plain(rule.get(field)) for field in cls.RULE_FIELDS)
+            for rule in rules
+        )
+        fact_rows = tuple(
+            tuple(cls._plain(fact.get(field)) for field in cls.FACT_FIELDS)
+            for fact in facts
+        )
+
+        signatures = signatures or {}
+        tokens = tuple(signatures.get(rule['id']) or cls.rule_tokens(rule) for rule in rules)
+
+        sections = {
+            'domains': tuple(dict(domain) for domain in domains),
+            'agents': tuple(dict(agent) for agent in agents),
+            'rules': rule_rows,
+            'facts': fact_rows,
+            'tokens': tokens,
+            'index': cls._build_indexes(rules, facts),
+        }
+
+        cls._write(path, revision, sections)
+        return cls(path)
+
+    @classmethod
+    def _build_indexes(cls, rules: List[Dict], facts: List[Dict]) -> Dict:
+        """Индексы по позициям правил и фактов"""
+        index = {
+            'rules_by_id': {},
+            'rules_by_agent': {},
+            'rules_by_domain': {},
+            'rules_by_target': {},
+            'facts_by_agent': {},
+            'facts_by_variable': {},
+        }
+
+        for pos, rule in enumerate(rules):
+            index['rules_by_id'][rule['id']] = pos
+            cls._append(index['rules_by_agent'], rule.get('agent_id'), pos)
+            cls._append(index['rules_by_domain'], rule.get('domain_id'), pos)
+            cls._append(index['rules_by_target'], cls.action_target(rule['action']), pos)
+
+        for pos, fact in enumerate(facts):
+            cls._append(index['facts_by_agent'], fact.get('agent_id'), pos)
+            cls._append(index['facts_by_variable'], fact.get('variable_name'), pos)
+
+        return index
+
+    @staticmethod
+    def _append(mapping: Dict, key, pos: int):
+        if key is not None:
+            mapping.setdefault(key, []).append(pos)
+
+    @classmethod
+    def _write(cls, path, revision: int, sections: Dict):
+        """Атомарная запись файла снимка"""
+        payloads = [(name, marshal.dumps(value)) for name, value in sections.items()]
+
+        offset = cls._HEADER.size + cls._SECTION.size * len(payloads)
+        table = []
+        for name, payload in payloads:
+            table.append(cls._SECTION.pack(name.encode('ascii'), offset,
+                                           len(payload), zlib.crc32(payload)))
+            offset += len(payload)
+
+        # Свой временный файл у каждой записи: снимок одной БД могут
+        # одновременно перестраивать несколько процессов
+        path = Path(path)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(cls._HEADER.pack(cls.MAGIC, cls.FORMAT_VERSION, marshal.version,
+                                         revision, len(payloads)))
+                f.writelines(table)
+                for _, payload in payloads:
+                    f.write(payload)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _plain(value):
+        """Приведение значения к типам, которые понимает marshal"""
+        if isinstance(value, list):
+            return tuple(value)
+        return value
+
+    @staticmethod
+    def rule_tokens(rule: Dict) -> tuple:
+        """Сигнатуры правила: токены условия и действия, затем их основы"""
+        signatures = rule_signatures(rule)
+        return (frozenset(signatures['condition_tokens']), frozenset(signatures['action_tokens']),
+                frozenset(signatures['condition_lemmas']), frozenset(signatures['action_lemmas']))
+
+    @staticmethod
+    def action_target(action: str) -> Optional[str]:
+        """Переменная, которой действие присваивает значение"""
+        if not action or '=' not in action:
+            return None
+        target = action.split('=', 1)[0].strip()
+        return target or None
+
+    # Доступ к данным
+
+    def _rule(self, pos: int) -> Dict:
+        rule = dict(zip(self.RULE_FIELDS, self._section('rules')[pos]))
+        rule['tags'] = list(rule['tags'] or [])
+        return rule
+
+    def _fact(self, pos: int) -> Dict:
+        return dict(zip(self.FACT_FIELDS, self._section('facts')[pos]))
+
+    def _rules_at(self, positions: Iterable[int]) -> List[Dict]:
+        return [self._rule(pos) for pos in positions]
+
+    def _facts_at(self, positions: Iterable[int]) -> List[Dict]:
+        return [self._fact(pos) for pos in positions]
+
+    @property
+    def rules(self) -> List[Dict]:
+        """Все правила в порядке убывания приоритета"""
+        return self._rules_at(range(len(self._section('rules'))))
+
+    @property
+    def facts(self) -> List[Dict]:
+        """Все факты"""
+        return self._facts_at(range(len(self._section('facts'))))
+
+    @property
+    def domains(self) -> List[Dict]:
+        return [dict(domain) for domain in self._section('domains')]
+
+    @property
+    def agents(self) -> List[Dict]:
+        return [dict(agent) for agent in self._section('agents')]
+
+    def get_rule(self, rule_id: str) -> Optional[Dict]:
+        pos = self._section('index')['rules_by_id'].get(rule_id)
+        return self._rule(pos) if pos is not None else None
+
+    def get_rules_by_agent(self, agent_id: str) -> List[Dict]:
+        return self._rules_at(self._section('index')['rules_by_agent'].get(agent_id, ()))
+
+    def get_rules_by_domain(self, domain_id: str) -> List[Dict]:
+        return self._rules_at(self._section('index')['rules_by_domain'].get(domain_id, ()))
+
+    def get_rules_by_target(self, variable: str) -> List[Dict]:
+        """Правила, действие которых присваивает значение переменной"""
+        return self._rules_at(self._section('index')['rules_by_target'].get(variable, ()))
+
+    def get_facts_by_agent(self, agent_id: str) -> List[Dict]:
+        return self._facts_at(self._section('index')['facts_by_agent'].get(agent_id, ()))
+
+    def get_facts_by_variable(self, variable_name: str) -> List[Dict]:
+        return self._facts_at(self._section('index')['facts_by_variable'].get(variable_name, ()))
+
+    # Анализ правил по предвычисленным токенам
+
+    def _positions(self, agent_id: str = None) -> List[int]:
+        if agent_id:
+            return list(self._section('index')['rules_by_agent'].get(agent_id, ()))
+        return list(range(len(self._section('rules'))))
+
+    def find_similar_rules(self, agent_id: str = None, threshold: float = 0.7,
+                           lemmas: bool = False) -> List[Dict]:
+        """Поиск схожих правил (семантика RuleRepository.find_similar_rules)"""
+        tokens = self._section('tokens')
+        offset = 2 if lemmas else 0
+        positions = self._positions(agent_id)
+        similar_pairs = []
+
+        for i in range(len(positions)):
+            cond1, act1 = tokens[positions[i]][offset:offset + 2]
+            for j in range(i + 1, len(positions)):
+                cond2, act2 = tokens[positions[j]][offset:offset + 2]
+                similarity = jaccard(cond1, cond2)
+
+                if similarity >= threshold:
+                    similar_pairs.append({
+                        'rule1': self._rule(positions[i]),
+                        'rule2': self._rule(positions[j]),
+                        'similarity': similarity,
+                        'type': similarity_type(similarity, jaccard(act1, act2))
+                    })
+
+        return similar_pairs
+
+    def find_conflicting_rules(self, agent_id: str = None) -> List[Dict]:
+        """Поиск конфликтных правил (семантика RuleRepository.find_conflicting_rules)"""
+        tokens = self._section('tokens')
+        rows = self._section('rules')
+        action_col = self.RULE_FIELDS.index('action')
+        positions = self._positions(agent_id)
+        conflicting_pairs = []
+
+        for i in range(len(positions)):
+            cond1 = tokens[positions[i]][0]
+            for j in range(i + 1, len(positions)):
+                condition_sim = jaccard(cond1, tokens[positions[j]][0])
+
+                if (condition_sim > 0.8 and
+                        rows[positions[i]][action_col] != rows[positions[j]][action_col]):
+                    conflicting_pairs.append({
+                        'rule1': self._rule(positions[i]),
+                        'rule2': self._rule(positions[j]),
+                        'condition_similarity': condition_sim,
+                        'conflict_type': 'different_actions'
+                    })
+
+        return conflicting_pairs
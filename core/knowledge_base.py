@@ -1,5 +1,7 @@
 from typing import List, Dict, Set
 
+from core.tokenizer import jaccard, similarity_type, token_signature
+
 
 class KnowledgeBase:
     """База знаний для хранения и управления правилами и фактами"""
@@ -11,6 +13,8 @@ class KnowledgeBase:
         self.variables: Set[str] = set()
         self.agents: Dict[str, Dict] = {}
         self.domains: Dict[str, Dict] = {}
+        # Сигнатуры токенов условия и действия по ID правила
+        self.signatures: Dict[str, tuple] = {}
 
     def add_rule(self, rule: Dict) -> str:
         """Добавление правила в базу знаний"""
@@ -27,6 +31,8 @@ class KnowledgeBase:
                 return existing_rule['id']
 
         self.rules[rule_id] = rule
+        self.signatures[rule_id] = (frozenset(token_signature(rule['condition'])),
+                                    frozenset(token_signature(rule['action'])))
 
         # Обновляем статистику агента и домена
         if rule.get('agent_id'):
@@ -144,17 +150,17 @@ class KnowledgeBase:
         similar_pairs = []
 
         for i in range(len(rules)):
+            condition1, action1 = self._signature(rules[i])
             for j in range(i + 1, len(rules)):
-                similarity = self._calculate_similarity(
-                    rules[i]['condition'], rules[j]['condition']
-                )
+                condition2, action2 = self._signature(rules[j])
+                similarity = jaccard(condition1, condition2)
 
                 if similarity >= threshold:
                     similar_pairs.append({
                         'rule1': rules[i],
                         'rule2': rules[j],
                         'similarity': similarity,
-                        'type': self._determine_similarity_type(rules[i], rules[j])
+                        'type': similarity_type(similarity, jaccard(action1, action2))
                     })
 
         return similar_pairs
@@ -166,6 +172,7 @@ class KnowledgeBase:
         else:
             rules = list(self.rules.values())
 
+        conditions = [self._signature(rule)[0] for rule in rules]
         conflicting_pairs = []
 
         for i in range(len(rules)):
@@ -174,9 +181,7 @@ class KnowledgeBase:
                 rule2 = rules[j]
 
                 # Проверяем схожесть условий
-                condition_sim = self._calculate_similarity(
-                    rule1['condition'], rule2['condition']
-                )
+                condition_sim = jaccard(conditions[i], conditions[j])
 
                 # Если условия схожи, но действия разные - конфликт
                 if condition_sim > 0.8 and rule1['action'] != rule2['action']:
@@ -189,40 +194,17 @@ class KnowledgeBase:
 
         return conflicting_pairs
 
-    def _calculate_similarity(self, text1: str, text2: str) -> float:
-        """Вычисление схожести текстов"""
-        if not text1 or not text2:
-            return 0.0
-
-        text1 = text1.lower()
-        text2 = text2.lower()
-
-        # Разбиваем на слова
-        import re
-        words1 = set(re.findall(r'\b\w+\b', text1))
-        words2 = set(re.findall(r'\b\w+\b', text2))
-
-        if not words1 or not words2:
-            return 0.0
+    def _signature(self, rule: Dict) -> tuple:
+        """Сигнатуры (условие, действие), посчитанные при добавлении правила"""
+        signature = self.signatures.get(rule['id'])
+        if signature is None:
+            signature = (frozenset(token_signature(rule['condition'])),
+                         frozenset(token_signature(rule['action'])))
+        return signature
 
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
-
-        return len(intersection) / len(union)
-
-    def _determine_similarity_type(self, rule1: Dict, rule2: Dict) -> str:
-        """Определение типа схожести"""
-        cond_sim = self._calculate_similarity(rule1['condition'], rule2['condition'])
-        act_sim = self._calculate_similarity(rule1['action'], rule2['action'])
-
-        if cond_sim > 0.8 and act_sim > 0.8:
-            return 'identical'
-        elif cond_sim > 0.8:
-            return 'same_condition'
-        elif act_sim > 0.8:
-            return 'same_action'
-        else:
-            return 'partial'
+    def _calculate_similarity(self, text1: str, text2: str) -> float:
+        """Вычисление схожести текстов (коэффициент Жаккара по токенам)"""
+        return jaccard(frozenset(token_signature(text1)), frozenset(token_signature(text2)))
 
     def get_statistics(self) -> Dict:
         """Получение статистики"""
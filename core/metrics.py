@@ -0,0 +1,204 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Timing:
+    """Гистограмма задержек одной операции"""
+
+    __slots__ = ('count', 'total', 'max', 'rows', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds: float, rows: Optional[int]):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if rows:
+            self.rows += rows
+
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_s': self.total / self.count if self.count else 0.0,
+            'max_s': self.max,
+            'rows': self.rows,
+            'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], self.buckets)),
+        }
+
+
+class Metrics:
+    """
+    Реестр метрик горячих путей
+
+    По умолчанию сбор выключен: обертки проверяют один флаг и сразу
+    вызывают исходную функцию. Включается вызовом enable() или
+    переменной окружения KB_METRICS=1.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._timings: Dict[str, _Timing] = {}
+        self._counters: Dict[str, float] = {}
+        self.started_at = datetime.now().isoformat()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+            self.started_at = datetime.now().isoformat()
+
+    # Запись
+
+    def observe(self, name: str, seconds: float, rows: Optional[int] = None):
+        """Запись длительности операции"""
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = _Timing()
+            timing.observe(seconds, rows)
+
+    def increment(self, name: str, value: float = 1):
+        """Увеличение счетчика"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name: str):
+        """Замер блока кода"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name: str, count_rows: bool = False):
+        """Декоратор замера функции"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                result = func(*args, **kwargs)
+                self.observe(name, time.perf_counter() - start,
+                             _rows(result) if count_rows else None)
+                return result
+            return wrapper
+        return decorator
+
+    # Чтение и выгрузка
+
+    def snapshot(self) -> Dict:
+        """Текущие значения всех метрик"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'started_at': self.started_at,
+                'timings': {name: t.to_dict() for name, t in sorted(self._timings.items())},
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Выгрузка в текстовом формате Prometheus"""
+        data = self.snapshot()
+        lines = [
+            '# HELP kb_operation_duration_seconds Operation latency',
+            '# TYPE kb_operation_duration_seconds histogram',
+        ]
+        for name, timing in data['timings'].items():
+            label = _label(name)
+            cumulative = 0
+            for bound, count in timing['buckets'].items():
+                cumulative += count
+                lines.append(f'kb_operation_duration_seconds_bucket{{operation="{label}",le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'kb_operation_duration_seconds_sum{{operation="{label}"}} {timing["total_s"]}')
+            lines.append(f'kb_operation_duration_seconds_count{{operation="{label}"}} {timing["count"]}')
+
+        lines.append('# HELP kb_operation_rows_total Rows returned by operation')
+        lines.append('# TYPE kb_operation_rows_total counter')
+        for name, timing in data['timings'].items():
+            lines.append(f'kb_operation_rows_total{{operation="{_label(name)}"}} {timing["rows"]}')
+
+        for name, value in data['counters'].items():
+            metric = 'kb_' + re.sub(r'[^a-zA-Z0-9_]', '_', name) + '_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str, fmt: str = None) -> bool:
+        """Сохранение метрик в файл (json или prometheus, по расширению)"""
+        if fmt is None:
+            fmt = 'json' if str(path).endswith('.json') else 'prometheus'
+
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.to_json() if fmt == 'json' else self.to_prometheus())
+            return True
+        except OSError as e:
+            print(f"Ошибка сохранения метрик: {e}")
+            return False
+
+
+def _rows(result) -> int:
+    """Количество строк в результате метода репозитория"""
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, dict):
+        return 1
+    return 0
+
+
+def _label(name: str) -> str:
+    return name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+metrics = Metrics(enabled=os.environ.get('KB_METRICS', '') not in ('', '0'))
+
+
+def instrument_repository(cls):
+    """Декоратор класса: замер всех публичных методов репозитория"""
+    for attr, value in list(vars(cls).items()):
+        if callable(value) and not attr.startswith('_'):
+            setattr(cls, attr, metrics.timed(f"repository.{cls.__name__}.{attr}",
+                                             count_rows=True)(value))
+    return cls
@@ -3,6 +3,8 @@ import uuid
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from core.metrics import metrics
+
 
 class TextProcessor:
     """Обработчик текста для извлечения знаний"""
@@ -85,6 +87,7 @@ class TextProcessor:
             }
         }
 
+    @metrics.timed('text_processor.segmentation')
     def _split_sentences(self, text: str) -> List[str]:
         """Разбиение текста на предложения"""
         if not text:
@@ -102,6 +105,7 @@ class TextProcessor:
 
         return sentences
 
+    @metrics.timed('text_processor.regex')
     def _extract_rule(self, sentence: str, source_info: Dict) -> Optional[Dict]:
         """Извлечение правила из предложения"""
         for pattern, rule_type in self.rule_patterns:
@@ -132,6 +136,7 @@ class TextProcessor:
 
         return None
 
+    @metrics.timed('text_processor.regex')
     def _extract_fact(self, sentence: str, source_info: Dict) -> Optional[Dict]:
         """Извлечение факта из предложения"""
         for pattern, confidence in self.fact_patterns:
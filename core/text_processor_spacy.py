@@ -5,16 +5,26 @@ from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from spacy.matcher import Matcher
 from spacy.language import Language
+from spacy.tokens import Doc
+
+from core.metrics import metrics
 
 
 class TextProcessor:
     """Обработчик текста для извлечения знаний с использованием spaCy"""
 
-    def __init__(self, language: str = 'ru'):
+    def __init__(self, language: str = 'ru', tiered: bool = False, doc_cache=None):
+        """
+        doc_cache - DocCache: разобранные тексты сохраняются на диске, и
+        повторный анализ того же текста не запускает конвейер spaCy
+        """
         self.language = language
+        self.tiered = tiered
+        self.doc_cache = doc_cache
         self._init_spacy_model()
         self._init_patterns()
         self._init_matchers()
+        self._fast_nlp = None
 
     def _init_spacy_model(self):
         """Инициализация модели spaCy"""
@@ -128,18 +138,48 @@ class TextProcessor:
         self.matcher.add("ACTION", action_patterns)
         self.matcher.add("DEFINITION", definition_patterns)
 
-    def extract_from_text(self, text: str, source_info: Dict) -> Dict[str, List]:
+        # Слова, без которых ни один паттерн матчера не сработает
+        self.marker_words = frozenset(
+            token['LOWER']
+            for patterns in (condition_patterns, action_patterns, definition_patterns)
+            for pattern in patterns for token in pattern if 'LOWER' in token
+        )
+
+    def _parse(self, text: str) -> Doc:
+        """Разбор текста полным конвейером (через кэш, если он задан)"""
+        if self.doc_cache is not None:
+            return self.doc_cache.parse(self.nlp, text)
+        return self.nlp(text)
+
+    def _get_fast_nlp(self) -> Language:
+        """Токенизатор и разбиение на предложения без тяжелых компонентов"""
+        if self._fast_nlp is None:
+            self._fast_nlp = spacy.blank(self.language)
+            self._fast_nlp.add_pipe('sentencizer')
+        return self._fast_nlp
+
+    def extract_from_text(self, text: str, source_info: Dict,
+                          tiered: bool = None) -> Dict[str, List]:
         """
         Извлечение правил и фактов из текста с использованием spaCy
+
+        tiered - каскадный режим (см. _extract_tiered); по умолчанию
+        берется из конструктора
         """
         # Очищаем текст
         text = self._clean_text(text)
-        
-        # Обрабатываем текст с помощью spaCy
-        doc = self.nlp(text)
-        
-        # Разбиваем на предложения через spaCy
-        sentences = list(doc.sents)
+
+        if tiered is None:
+            tiered = self.tiered
+        if tiered:
+            return self._extract_tiered(text, source_info)
+        
+        with metrics.timer('text_processor_spacy.segmentation'):
+            # Обрабатываем текст с помощью spaCy
+            doc = self._parse(text)
+
+            # Разбиваем на предложения через spaCy
+            sentences = list(doc.sents)
         
         rules = []
         facts = []
@@ -176,6 +216,94 @@ class TextProcessor:
             }
         }
 
+    def classify_sentence(self, sentence) -> str:
+        """
+        Уровень обработки предложения по быстрой токенизации
+
+        'parser' - есть слово из паттернов матчера, нужен полный конвейер;
+        'regex' - срабатывает только регулярное выражение;
+        'skipped' - извлекать нечего.
+        """
+        if any(token.lower_ in self.marker_words for token in sentence):
+            return 'parser'
+
+        sent_text = sentence.text.strip()
+        for pattern, _ in self.rule_patterns + self.fact_patterns:
+            if re.search(pattern, sent_text, re.IGNORECASE | re.DOTALL):
+                return 'regex'
+        return 'skipped'
+
+    def _extract_tiered(self, text: str, source_info: Dict) -> Dict[str, List]:
+        """
+        Каскадное извлечение
+
+        Текст делится на предложения быстрым конвейером (токенизатор и
+        sentencizer). Тегер, парсер и NER через nlp.pipe получают только
+        предложения со словами-маркерами матчера: без них spaCy-методы
+        извлечения ничего не находят. Предложения, где срабатывает лишь
+        регулярное выражение, обрабатываются им, остальные пропускаются.
+        Границы предложений определяет sentencizer, а не парсер, поэтому
+        они могут немного отличаться от обычного режима.
+        """
+        with metrics.timer('text_processor_spacy.segmentation'):
+            sentences = list(self._get_fast_nlp()(text).sents)
+
+        with metrics.timer('text_processor_spacy.classification'):
+            tiers = [self.classify_sentence(sentence) for sentence in sentences]
+
+        counts = {'parser': 0, 'regex': 0, 'skipped': 0}
+        for tier in tiers:
+            counts[tier] += 1
+        if metrics.enabled:
+            for tier, count in counts.items():
+                metrics.increment(f'text_processor_spacy.tier.{tier}', count)
+
+        # Полный конвейер только для кандидатов, одним пакетом
+        candidates = [sentence.text.strip() for sentence, tier in zip(sentences, tiers)
+                      if tier == 'parser']
+        with metrics.timer('text_processor_spacy.parser'):
+            parsed = iter(list(self.nlp.pipe(candidates)))
+
+        rules = []
+        facts = []
+        entities = 0
+
+        for sentence, tier in zip(sentences, tiers):
+            if tier == 'skipped':
+                continue
+            sent_text = sentence.text.strip()
+
+            rule = None
+            fact = None
+            if tier == 'parser':
+                doc = next(parsed)
+                entities += len(doc.ents)
+                rule = self._extract_rule_spacy(doc, source_info)
+                fact = self._extract_fact_spacy(doc, source_info)
+
+            if not rule:
+                rule = self._extract_rule_regex(sent_text, source_info)
+            if rule:
+                rules.append(rule)
+
+            if not fact:
+                fact = self._extract_fact_regex(sent_text, source_info)
+            if fact:
+                facts.append(fact)
+
+        return {
+            'rules': rules,
+            'facts': facts,
+            'statistics': {
+                'sentences': len(sentences),
+                'rules_found': len(rules),
+                'facts_found': len(facts),
+                'entities': entities,
+                'tiers': counts
+            }
+        }
+
+    @metrics.timed('text_processor_spacy.matcher')
     def _extract_rule_spacy(self, sentence, source_info: Dict) -> Optional[Dict]:
         """Извлечение правила с использованием spaCy"""
         matches = self.matcher(sentence)
@@ -243,6 +371,7 @@ class TextProcessor:
             'linguistic_features': self._extract_linguistic_features(sentence)
         }
 
+    @metrics.timed('text_processor_spacy.regex')
     def _extract_rule_regex(self, sentence: str, source_info: Dict) -> Optional[Dict]:
         """Извлечение правила с использованием регулярных выражений"""
         for pattern, rule_type in self.rule_patterns:
@@ -272,6 +401,7 @@ class TextProcessor:
         
         return None
 
+    @metrics.timed('text_processor_spacy.matcher')
     def _extract_fact_spacy(self, sentence, source_info: Dict) -> Optional[Dict]:
         """Извлечение факта с использованием spaCy"""
         # Извлекаем именованные сущности
@@ -325,6 +455,7 @@ class TextProcessor:
         
         return None
 
+    @metrics.timed('text_processor_spacy.regex')
     def _extract_fact_regex(self, sentence: str, source_info: Dict) -> Optional[Dict]:
         """Извлечение факта с использованием регулярных выражений"""
         for pattern, confidence in self.fact_patterns:
@@ -378,6 +509,7 @@ class TextProcessor:
         
         return "conditional"
 
+    @metrics.timed('text_processor_spacy.confidence')
     def _calculate_confidence(self, text: str) -> float:
         """Расчет уверенности в извлеченном правиле"""
         doc = self.nlp(text)
@@ -400,6 +532,7 @@ class TextProcessor:
         
         return min(max(confidence, 0.1), 1.0)
 
+    @metrics.timed('text_processor_spacy.confidence')
     def _calculate_fact_confidence(self, sentence, variable: str, value: str) -> float:
         """Расчет уверенности в извлеченном факте"""
         confidence = 0.5
@@ -472,7 +605,7 @@ class TextProcessor:
 
     def analyze_text_structure(self, text: str) -> Dict:
         """Анализ структуры текста с использованием spaCy"""
-        doc = self.nlp(text)
+        doc = self._parse(text)
         sentences = list(doc.sents)
         
         # Подсчет потенциальных правил и фактов
@@ -544,7 +677,7 @@ class TextProcessor:
 
     def extract_key_concepts(self, text: str) -> List[Dict]:
         """Извлечение ключевых концепций из текста"""
-        doc = self.nlp(text)
+        doc = self._parse(text)
         
         concepts = []
         
@@ -559,7 +692,7 @@ class TextProcessor:
             })
         
         # Извлекаем существительные и прилагательные
-        for chunk in doc.noun_chunks:
+        for chunk in self._noun_phrases(doc):
             if len(chunk.text.split()) > 1:  # Игнорируем одиночные слова
                 concepts.append({
                     'text': chunk.text,
@@ -580,9 +713,30 @@ class TextProcessor:
         
         return unique_concepts
 
+    @staticmethod
+    def _noun_phrases(doc) -> List:
+        """
+        Именные группы: doc.noun_chunks, а для языков без них (в spaCy
+        нет noun_chunks для русского) - существительное с зависимыми
+        определениями слева
+        """
+        try:
+            return list(doc.noun_chunks)
+        except (NotImplementedError, ValueError):
+            pass
+
+        phrases = []
+        for token in doc:
+            if token.pos_ in ('NOUN', 'PROPN'):
+                modifiers = [child.i for child in token.lefts
+                             if child.dep_ in ('amod', 'compound', 'flat', 'det', 'nummod')]
+                if modifiers:
+                    phrases.append(doc[min(modifiers):token.i + 1])
+        return phrases
+
     def extract_relationships(self, text: str) -> List[Dict]:
         """Извлечение отношений между сущностями"""
-        doc = self.nlp(text)
+        doc = self._parse(text)
         relationships = []
         
         # Ищем глаголы и их субъекты/объекты
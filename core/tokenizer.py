@@ -0,0 +1,147 @@
+"""
+Единая нормализация текста правил для сравнения и поиска
+
+Токены - слова, операторы (>=, == и т.п.) и отдельные знаки в нижнем
+регистре. Сигнатура текста - отсортированные уникальные 32-битные хеши
+токенов (или их основ); она хранится вместе с правилом и сравнивается
+без повторной токенизации.
+"""
+import functools
+import hashlib
+import re
+import sys
+import zlib
+from array import array
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+try:
+    from nltk.stem.snowball import SnowballStemmer
+except ImportError:
+    SnowballStemmer = None
+
+
+# Слова, операторы сравнения и присваивания, прочие знаки по одному
+TOKEN_PATTERN = re.compile(r'\w+|[<>=!]+|[^\w\s]')
+_QUOTES = re.compile(r'["\'«»“”„]')
+_TRAILING_PUNCTUATION = re.compile(r'[\s.,;!?]+$')
+_CYRILLIC = re.compile(r'[а-яё]')
+
+_stemmers: Dict[str, object] = {}
+
+
+def tokenize(text: str) -> List[str]:
+    """Токены текста в нижнем регистре"""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def _stemmer(language: str):
+    if language not in _stemmers:
+        _stemmers[language] = SnowballStemmer(language) if SnowballStemmer else None
+    return _stemmers[language]
+
+
+# Словарь правил невелик, а стемминг медленный: основы кэшируются
+@functools.lru_cache(maxsize=65536)
+def lemma(token: str) -> str:
+    """Основа слова (стеммер Snowball); без NLTK - само слово"""
+    if not token[0].isalpha():
+        return token
+    stemmer = _stemmer('russian' if _CYRILLIC.search(token) else 'english')
+    return stemmer.stem(token) if stemmer else token
+
+
+def _hashes(tokens: Iterable[str]) -> Tuple[int, ...]:
+    return tuple(sorted({zlib.crc32(token.encode('utf-8')) for token in tokens}))
+
+
+def token_signature(text: str) -> Tuple[int, ...]:
+    """Хеши токенов текста"""
+    return _hashes(tokenize(text))
+
+
+def lemma_signature(text: str) -> Tuple[int, ...]:
+    """Хеши основ слов текста"""
+    return _hashes(lemma(token) for token in tokenize(text))
+
+
+def rule_signatures(rule: Dict) -> Dict[str, Tuple[int, ...]]:
+    """Сигнатуры условия и действия правила"""
+    condition = rule.get('condition') or ''
+    action = rule.get('action') or ''
+    return {
+        'condition_tokens': token_signature(condition),
+        'action_tokens': token_signature(action),
+        'condition_lemmas': lemma_signature(condition),
+        'action_lemmas': lemma_signature(action),
+    }
+
+
+def pack_signature(signature: Iterable[int]) -> bytes:
+    """Сигнатура для столбца BLOB: массив uint32 little-endian"""
+    values = array('I', signature)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_signature(data: bytes) -> FrozenSet[int]:
+    if not data:
+        return frozenset()
+    values = array('I')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return frozenset(values)
+
+
+def jaccard(signature1: FrozenSet[int], signature2: FrozenSet[int]) -> float:
+    """Коэффициент Жаккара двух сигнатур"""
+    if not signature1 or not signature2:
+        return 0.0
+    return len(signature1 & signature2) / len(signature1 | signature2)
+
+
+def similarity_type(condition_sim: float, action_sim: float) -> str:
+    """Тип схожести правил по сходству условий и действий"""
+    if condition_sim > 0.8 and action_sim > 0.8:
+        return 'identical'
+    elif condition_sim > 0.8:
+        return 'same_condition'
+    elif action_sim > 0.8:
+        return 'same_action'
+    else:
+        return 'partial'
+
+
+def normalize_text(text: str) -> str:
+    """
+    Каноническая запись текста правила
+
+    Регистр, пробелы, вид кавычек и завершающая пунктуация не различаются;
+    операторы и скобки сохраняются.
+    """
+    if not text:
+        return ''
+    text = _TRAILING_PUNCTUATION.sub('', _QUOTES.sub('"', str(text)))
+    return ' '.join(tokenize(text))
+
+
+def rule_fingerprint(rule: Dict) -> str:
+    """Отпечаток правила: хеш агента и канонических условия и действия"""
+    canonical = '\x1f'.join((str(rule.get('agent_id') or ''),
+                             normalize_text(rule.get('condition')),
+                             normalize_text(rule.get('action'))))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def concept_key(text: str) -> str:
+    """
+    Ключ концепции: основы слов через пробел
+
+    Формы одного слова ("температура", "температуры") и пунктуация не
+    различаются; концепция упоминается в тексте, если ее ключ - часть
+    ключа текста по границам слов.
+    """
+    return ' '.join(lemma(token) for token in tokenize(text) if token[0].isalnum())
@@ -0,0 +1,277 @@
+import re
+import uuid
+from typing import List, Dict, Optional, Union, Callable, Iterable
+
+from core.agenda import Agenda
+from core.inference_engine import InferenceEngine
+from core.metrics import metrics
+
+
+class TruthMaintenanceSystem:
+    """
+    Инкрементальный прямой вывод с поддержкой истинности
+
+    Каждый выведенный факт хранит обоснование: правило и переменные,
+    значения которых были известны при его срабатывании. При изменении
+    фактов снимаются только выводы, транзитивно опирающиеся на
+    изменившиеся переменные, после чего агенда перепроверяет лишь
+    правила, зависящие от этих переменных.
+
+    Рабочая память, как и в InferenceEngine, хранит одно значение
+    на переменную.
+    """
+
+    def __init__(self, rules: List[Dict], strategy: Union[str, Callable] = 'priority',
+                 engine: InferenceEngine = None):
+        self.engine = engine or InferenceEngine()
+        self.strategy = strategy
+
+        self.facts: Dict[str, Dict] = {}  # переменная -> факт
+        self.values: Dict = {}  # рабочая память: переменная -> значение
+
+        self._rules: List[Dict] = []
+        self._rule_index: Dict[str, int] = {}  # ID правила -> индекс
+        self._dependents: Dict[str, set] = {}  # переменная -> индексы правил
+        self._producers: Dict[str, set] = {}  # переменная -> правила, выводящие ее
+        self._consequents: Dict[str, set] = {}  # переменная -> выводы, опирающиеся на нее
+        self._justifies: Dict[int, str] = {}  # индекс правила -> выведенная переменная
+
+        for rule in rules:
+            self._add_rule(rule)
+
+    # Правила
+
+    def _add_rule(self, rule: Dict) -> int:
+        index = self._rule_index.get(rule['id'])
+        if index is not None:
+            return index
+
+        index = len(self._rules)
+        self._rules.append(rule)
+        self._rule_index[rule['id']] = index
+
+        for variable in InferenceEngine.rule_variables(rule):
+            self._dependents.setdefault(variable, set()).add(index)
+
+        match = re.match(r'([\w]+)\s*=', rule['action'])
+        if match:
+            self._producers.setdefault(match.group(1), set()).add(index)
+
+        return index
+
+    # Загрузка сохраненного состояния
+
+    def load(self, base_facts: Iterable[Dict], derived_facts: Iterable[Dict]) -> List[str]:
+        """
+        Восстановление рабочей памяти без перевычисления
+
+        Args:
+            base_facts: Исходные факты {'id', 'variable', 'value'}
+            derived_facts: Выведенные факты с обоснованием
+                {'id', 'variable', 'value', 'rule_id', 'supports'}
+
+        Returns:
+            Переменные выводов, обоснование которых больше не действительно
+            (правило удалено или опоры отсутствуют). Их следует передать
+            в update(retract=...).
+        """
+        for fact in base_facts:
+            self._insert(fact['id'], fact['variable'], fact['value'])
+
+        derived_facts = list(derived_facts)
+        for fact in derived_facts:
+            index = self._rule_index.get(fact.get('rule_id'))
+            self._insert(fact['id'], fact['variable'], fact['value'], derived=True,
+                         rule_index=index, supports=fact.get('supports', []))
+
+        invalid = []
+        for fact in derived_facts:
+            stored = self.facts.get(fact['variable'])
+            if stored is None or stored['id'] != fact['id']:
+                continue
+            if stored['rule_index'] is None or any(
+                    support not in self.facts for support in stored['supports']):
+                invalid.append(fact['variable'])
+
+        return invalid
+
+    # Изменение фактов
+
+    @metrics.timed('inference.truth_maintenance.update')
+    def update(self, assert_facts: Iterable[Dict] = (), retract: Iterable[str] = (),
+               new_rules: Iterable[Dict] = ()) -> Dict:
+        """
+        Применение изменений и перевывод затронутых фактов
+
+        Args:
+            assert_facts: Новые или измененные исходные факты {'id', 'variable', 'value'}
+            retract: Переменные, факты которых нужно снять
+            new_rules: Правила, добавленные с прошлого вывода
+
+        Returns:
+            {'added': [...], 'removed': [...]} - выведенные факты, которые
+            появились и которые были сняты
+        """
+        removed: Dict[str, Dict] = {}
+        changed = set()
+        seeds = set()
+
+        for rule in new_rules:
+            seeds.add(self._add_rule(rule))
+
+        for variable in retract:
+            if variable in self.facts:
+                removed[variable] = self._remove(variable)
+                changed.add(variable)
+
+        for fact in assert_facts:
+            variable = fact['variable']
+            if variable in self.facts:
+                removed[variable] = self._remove(variable)
+            self._insert(fact['id'], variable, fact['value'])
+            changed.add(variable)
+
+        # Снимаем выводы, транзитивно опирающиеся на изменившиеся факты
+        queue = list(changed)
+        while queue:
+            for consequent in list(self._consequents.get(queue.pop(), ())):
+                if consequent in self.facts:
+                    removed[consequent] = self._remove(consequent)
+                    changed.add(consequent)
+                    queue.append(consequent)
+
+        for variable in changed:
+            seeds.update(self._dependents.get(variable, ()))
+            if variable not in self.facts:
+                seeds.update(self._producers.get(variable, ()))
+
+        added = self._propagate(seeds)
+
+        # Вывод, снятый и полученный заново с тем же обоснованием, не считается изменением
+        for variable in list(added):
+            old = removed.get(variable)
+            new = added[variable]
+            if (old is not None and old['rule_index'] == new['rule_index']
+                    and str(old['value']) == str(new['value'])
+                    and old['supports'] == new['supports']):
+                new['id'] = old['id']
+                del added[variable]
+                del removed[variable]
+
+        return {
+            'added': [self._public(fact) for fact in added.values()],
+            'removed': [self._public(fact) for fact in removed.values() if fact['derived']]
+        }
+
+    def _propagate(self, seeds: Iterable[int]) -> Dict[str, Dict]:
+        """Цикл агенды, начиная с правил seeds"""
+        agenda = Agenda(self.strategy)
+        added = {}
+
+        def check(index: int):
+            rule = self._rules[index]
+            if index in self._justifies:
+                return
+            if self.engine.check_rule_condition(rule['condition'], self.values):
+                agenda.push(rule, index)
+            else:
+                agenda.remove(index)
+
+        for index in sorted(seeds):
+            check(index)
+
+        while agenda:
+            activation = agenda.pop()
+            rule = activation.rule
+
+            action_result = self.engine.execute_rule_action(rule['action'], self.values)
+            if not action_result:
+                continue
+
+            variable, value = action_result
+            if variable in self.facts:
+                continue
+
+            supports = sorted(v for v in InferenceEngine.rule_variables(rule)
+                              if v in self.facts)
+            added[variable] = self._insert(str(uuid.uuid4()), variable, value, derived=True,
+                                           rule_index=activation.index, supports=supports)
+
+            for index in self._dependents.get(variable, ()):
+                check(index)
+
+        return added
+
+    # Рабочая память
+
+    def _insert(self, fact_id: str, variable: str, value, derived: bool = False,
+                rule_index: Optional[int] = None, supports: List[str] = ()) -> Dict:
+        fact = {
+            'id': fact_id,
+            'variable': variable,
+            'value': value,
+            'derived': derived,
+            'rule_index': rule_index,
+            'supports': list(supports),
+        }
+        self.facts[variable] = fact
+        self.values[variable] = value
+
+        if rule_index is not None:
+            self._justifies[rule_index] = variable
+        for support in fact['supports']:
+            self._consequents.setdefault(support, set()).add(variable)
+
+        return fact
+
+    def _remove(self, variable: str) -> Dict:
+        fact = self.facts.pop(variable)
+        del self.values[variable]
+
+        if fact['rule_index'] is not None and self._justifies.get(fact['rule_index']) == variable:
+            del self._justifies[fact['rule_index']]
+        for support in fact['supports']:
+            consequents = self._consequents.get(support)
+            if consequents:
+                consequents.discard(variable)
+
+        return fact
+
+    def _public(self, fact: Dict) -> Dict:
+        """Факт с обоснованием для сохранения и отчетов"""
+        rule = self._rules[fact['rule_index']] if fact['rule_index'] is not None else None
+        return {
+            'id': fact['id'],
+            'variable': fact['variable'],
+            'value': fact['value'],
+            'rule_id': rule['id'] if rule else None,
+            'rule': rule['name'] if rule else None,
+            'confidence': rule.get('confidence', 1.0) if rule else 1.0,
+            'supports': [{'variable': support, 'fact_id': self.facts[support]['id']}
+                         for support in fact['supports'] if support in self.facts],
+        }
+
+    def explain(self, variable: str) -> List[str]:
+        """Цепочка обоснований факта"""
+        lines = []
+
+        def walk(var: str, depth: int, seen: set):
+            fact = self.facts.get(var)
+            indent = "  " * depth
+            if fact is None:
+                lines.append(f"{indent}{var}: неизвестно")
+                return
+            if not fact['derived']:
+                lines.append(f"{indent}{var} = {fact['value']} (исходный факт)")
+                return
+
+            rule = self._rules[fact['rule_index']] if fact['rule_index'] is not None else None
+            lines.append(f"{indent}{var} = {fact['value']} "
+                         f"(правило: {rule['name'] if rule else 'удалено'})")
+            if var in seen:
+                return
+            for support in fact['supports']:
+                walk(support, depth + 1, seen | {var})
+
+        walk(variable, 0, set())
+        return lines
@@ -0,0 +1,353 @@
+import ast
+import builtins
+import operator
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from core import inference_engine
+from core.inference_engine import InferenceEngine
+from core.metrics import metrics
+
+
+# Цифры литерала Python: подчеркивание только между цифрами
+_DIGITS = r'\d(?:_?\d)*'
+
+# Текст значения, который после подстановки в условие читается как число.
+# Те же правила, что у литералов Python: целое с ведущим нулем ("007")
+# - синтаксическая ошибка, а в дробной части и перед экспонентой нули допустимы
+_NUMBER = re.compile(
+    rf'\s*[+-]?((?:{_DIGITS})?\.{_DIGITS}|{_DIGITS}\.|{_DIGITS}(?=[eE])|[1-9](?:_?\d)*|0(?:_?0)*)'
+    rf'([eE][+-]?{_DIGITS})?\s*'
+)
+
+# Имена, которые eval в InferenceEngine.check_rule_condition находит и без
+# фактов (локальные переменные метода, глобальные имена модуля, builtins).
+# Условия с такими переменными вычисляются только скалярно.
+_RESERVED_NAMES = (set(dir(builtins)) | set(vars(inference_engine))
+                   | {'self', 'condition', 'facts', 'expr', 'var', 'value'})
+
+_COMPARISONS = {
+    ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+
+_ARITHMETIC = {
+    ast.Add: operator.add, ast.Sub: operator.sub,
+    ast.Mult: operator.mul, ast.Div: operator.truediv,
+}
+
+
+# Символы, из которых состоит подставленный текст числа
+_NUMBER_CHARS = frozenset('0123456789._eE+- ')
+
+
+def parse_number(value) -> Optional[float]:
+    """Число, которым станет значение факта после подстановки, или None"""
+    if isinstance(value, bool):
+        return None
+    text = str(value)
+    match = _NUMBER.fullmatch(text)
+    if not match:
+        return None
+    digits = match.group(1).replace('_', '')
+    # Целые, которые float64 не представляет точно, вычисляются скалярно
+    if '.' not in digits and not match.group(2) and len(digits.lstrip('0')) > 15:
+        return None
+    return float(text.replace('_', ''))
+
+
+class ArrayPredicate:
+    """
+    Условие, скомпилированное в операции над столбцами
+
+    Вычисление возвращает пару массивов (значение, ошибка). Ошибка
+    отмечает строки, где скалярный eval выбросил бы исключение
+    (переменной нет, деление на ноль) - с учетом сокращенного
+    вычисления and/or, как в Python. Такие строки дают False.
+    """
+
+    __slots__ = ('condition', 'names', '_evaluate')
+
+    def __init__(self, condition: str, names: frozenset, evaluate: Callable):
+        self.condition = condition
+        self.names = names
+        self._evaluate = evaluate
+
+    def __call__(self, columns: Dict[str, Tuple], size: int):
+        value, error = self._evaluate(columns)
+        result = np.broadcast_to(np.asarray(value, dtype=bool), size)
+        error = np.broadcast_to(np.asarray(error, dtype=bool), size)
+        return result & ~error
+
+
+def compile_condition(condition: str) -> Optional[ArrayPredicate]:
+    """
+    Компиляция условия в операции над массивами
+
+    Поддерживаются числа, переменные, + - * /, сравнения (в том числе
+    цепочки), and, or, not. Для остальных условий возвращается None.
+    """
+    if np is None:
+        return None
+
+    try:
+        tree = ast.parse(condition.strip(), mode='eval')
+    except (SyntaxError, ValueError):
+        return None
+
+    names = set()
+    try:
+        evaluate = _compile_node(tree.body, names)
+    except _Unsupported:
+        return None
+
+    if names & _RESERVED_NAMES:
+        return None
+
+    return ArrayPredicate(condition, frozenset(names), evaluate)
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _compile_node(node, names: set) -> Callable:
+    """Узел AST -> функция columns -> (значение, ошибка)"""
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, (bool, int, float)):
+            value = float(node.value)
+            return lambda columns: (value, False)
+        raise _Unsupported
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        names.add(name)
+
+        def column(columns):
+            values, present = columns[name]
+            return values, ~present
+        return column
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand, names)
+        if isinstance(node.op, ast.Not):
+            def negate(columns):
+                value, error = operand(columns)
+                return np.logical_not(value), error
+            return negate
+        if isinstance(node.op, (ast.USub, ast.UAdd)):
+            sign = -1.0 if isinstance(node.op, ast.USub) else 1.0
+
+            def signed(columns):
+                value, error = operand(columns)
+                return np.multiply(value, sign), error
+            return signed
+        raise _Unsupported
+
+    if isinstance(node, ast.BinOp):
+        op = _ARITHMETIC.get(type(node.op))
+        if op is None:
+            raise _Unsupported
+        left = _compile_node(node.left, names)
+        right = _compile_node(node.right, names)
+        division = isinstance(node.op, ast.Div)
+
+        def arithmetic(columns):
+            left_value, left_error = left(columns)
+            right_value, right_error = right(columns)
+            error = left_error | right_error
+            right_value = np.asarray(right_value, dtype=float)
+            if division:
+                zero = right_value == 0
+                error = error | zero
+                right_value = np.where(zero, 1.0, right_value)
+            with np.errstate(all='ignore'):
+                return op(np.asarray(left_value, dtype=float), right_value), error
+        return arithmetic
+
+    if isinstance(node, ast.Compare):
+        operands = [_compile_node(node.left, names)] + \
+                   [_compile_node(comparator, names) for comparator in node.comparators]
+        ops = []
+        for op in node.ops:
+            if type(op) not in _COMPARISONS:
+                raise _Unsupported
+            ops.append(_COMPARISONS[type(op)])
+
+        def compare(columns):
+            left_value, error = operands[0](columns)
+            result = True
+            # a < b < c: следующий операнд вычисляется, только пока цепочка истинна
+            for op, right in zip(ops, operands[1:]):
+                right_value, right_error = right(columns)
+                error = error | (result & ~error & right_error)
+                result = result & op(left_value, right_value)
+                left_value = right_value
+            return result, error
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile_node(value, names) for value in node.values]
+        conjunction = isinstance(node.op, ast.And)
+
+        def boolean(columns):
+            # Как в Python, результат - значение последнего вычисленного операнда
+            result, error = values[0](columns)
+            for value in values[1:]:
+                truthy = np.asarray(result) != 0
+                needed = truthy if conjunction else ~truthy
+                next_value, next_error = value(columns)
+                error = error | (needed & ~error & next_error)
+                result = np.where(needed, next_value, result)
+            return result, error
+        return boolean
+
+    raise _Unsupported
+
+
+class ColumnarBatch:
+    """
+    Набор случаев по столбцам: переменная -> (числа, наличие, числовое ли)
+
+    Исходные наборы фактов сохраняются для скалярной проверки строк,
+    которые нельзя вычислить векторно.
+    """
+
+    def __init__(self, cases: List[Dict[str, Any]]):
+        self.cases = cases
+        self.size = len(cases)
+        self._rows: Dict[str, Tuple[List[int], List[Any]]] = {}
+        self._columns: Dict[str, Tuple] = {}
+
+        for row, facts in enumerate(cases):
+            for variable, value in facts.items():
+                rows, values = self._rows.setdefault(variable, ([], []))
+                rows.append(row)
+                values.append(value)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def variables(self):
+        return self._rows.keys()
+
+    def column(self, variable: str) -> Tuple:
+        """(значения float64, есть ли факт, подставляется ли он как число)"""
+        column = self._columns.get(variable)
+        if column is not None:
+            return column
+
+        values = np.zeros(self.size)
+        present = np.zeros(self.size, dtype=bool)
+        numeric = np.zeros(self.size, dtype=bool)
+
+        rows, raw = self._rows.get(variable, ((), ()))
+        if rows:
+            parsed = [parse_number(value) for value in raw]
+            rows = np.asarray(rows)
+            ok = np.array([number is not None for number in parsed])
+            present[rows] = True
+            numeric[rows[ok]] = True
+            values[rows[ok]] = [number for number in parsed if number is not None]
+
+        column = self._columns[variable] = (values, present, numeric)
+        return column
+
+
+class VectorizedConditions:
+    """
+    Проверка условий набора правил сразу по пакету случаев
+
+    Результат совпадает с InferenceEngine.check_rule_condition для
+    каждого случая: условия, которые не удалось скомпилировать,
+    и строки с нечисловыми значениями вычисляются скалярно.
+    """
+
+    def __init__(self, rules: List[Dict], engine: InferenceEngine = None):
+        self.rules = rules
+        self.engine = engine or InferenceEngine()
+        self.predicates = [compile_condition(rule['condition']) for rule in rules]
+
+    @staticmethod
+    def available() -> bool:
+        """Установлен ли NumPy"""
+        return np is not None
+
+    @property
+    def vectorized_count(self) -> int:
+        return sum(1 for predicate in self.predicates if predicate is not None)
+
+    def evaluate(self, index: int, batch: ColumnarBatch):
+        """Маска случаев пакета, в которых выполнено условие правила index"""
+        condition = self.rules[index]['condition']
+        predicate = self.predicates[index]
+
+        if predicate is None or self._substring_conflict(predicate, batch):
+            if metrics.enabled:
+                metrics.increment('inference.vectorized.scalar_rules')
+            return self._scalar(condition, batch, range(batch.size))
+
+        columns = {}
+        fallback = np.zeros(batch.size, dtype=bool)
+        for name in predicate.names:
+            values, present, numeric = batch.column(name)
+            columns[name] = (values, present)
+            fallback |= present & ~numeric
+
+        result = np.array(predicate(columns, batch.size))
+
+        # Строки с нечисловыми значениями переменных условия
+        rows = np.nonzero(fallback)[0]
+        if len(rows):
+            if metrics.enabled:
+                metrics.increment('inference.vectorized.scalar_rows', len(rows))
+            result[rows] = self._scalar(condition, batch, rows)
+
+        return result
+
+    @metrics.timed('inference.vectorized.screen')
+    def screen(self, batch: ColumnarBatch) -> Iterator[Tuple[int, Any]]:
+        """Индексы случаев, подходящих под каждое правило"""
+        for index in range(len(self.rules)):
+            yield index, np.nonzero(self.evaluate(index, batch))[0]
+
+    def initial_matches(self, batch: ColumnarBatch) -> List[List[int]]:
+        """Для каждого случая - индексы правил, условия которых выполнены"""
+        matches = [[] for _ in range(batch.size)]
+        for index, rows in self.screen(batch):
+            for row in rows.tolist():
+                matches[row].append(index)
+        return matches
+
+    def _scalar(self, condition: str, batch: ColumnarBatch, rows):
+        check = self.engine.check_rule_condition
+        return np.array([bool(check(condition, batch.cases[row])) for row in rows], dtype=bool)
+
+    @staticmethod
+    def _substring_conflict(predicate: ArrayPredicate, batch: ColumnarBatch) -> bool:
+        """
+        Может ли замена подстрок в скалярной проверке исказить условие
+
+        check_rule_condition подставляет значения заменой подстрок. Если
+        имя факта входит в условие не целым именем или может оказаться
+        внутри подставленного числа, результат зависит от порядка замен.
+        """
+        condition = predicate.condition
+        for variable in batch.variables:
+            if _NUMBER_CHARS.issuperset(variable):
+                return True
+            if variable not in condition:
+                continue
+            if variable not in predicate.names:
+                return True
+            whole = re.findall(rf'(?<!\w){re.escape(variable)}(?!\w)', condition)
+            if len(whole) != condition.count(variable):
+                return True
+        return False
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    from PyQt5.QtCore import QObject, Qt, pyqtSignal, pyqtSlot
+except ImportError:
+    QObject = None
+
+from core.metrics import metrics
+from database.db_manager import DatabaseManager
+
+
+# Префиксы методов DatabaseManager, которые только читают данные
+READ_PREFIXES = ('get_', 'search_', 'find_')
+
+# Методы с внутренним состоянием менеджера (снимок, кэш вывода):
+# выполняются по одному
+SERIAL_METHODS = frozenset({'get_snapshot', 'build_snapshot', 'update_derived_facts'})
+
+
+class AsyncDatabaseManager:
+    """
+    Неблокирующий фасад над DatabaseManager
+
+    Повторяет API менеджера: каждый метод возвращает корутину,
+        rules = await async_db.get_rules_by_agent(agent_id)
+    а для Qt - объект с сигналами (см. qt_call). Вызовы выполняются
+    в собственном пуле потоков; репозитории открывают соединение SQLite
+    на каждый вызов в том потоке, где он выполняется, поэтому общих
+    соединений между потоками нет.
+
+    Одинаковые чтения, запрошенные одновременно, объединяются в одно
+    обращение к БД. Запись увеличивает поколение: чтение, начатое после
+    нее, не присоединяется к более раннему.
+    """
+
+    def __init__(self, db_manager: DatabaseManager = None, workers: int = 4):
+        self.db_manager = db_manager or DatabaseManager()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kb-db')
+
+        self._lock = threading.Lock()
+        self._serial_lock = threading.Lock()
+        self._inflight: Dict[Tuple, Future] = {}
+        self._generation = 0
+        self._qt_calls = set()  # Ссылки на DatabaseCall до получения результата
+
+    def __getattr__(self, name: str) -> Callable:
+        if name.startswith('_') or not callable(getattr(self.db_manager, name, None)):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            return await asyncio.wrap_future(self.submit(name, *args, **kwargs))
+
+        method.__name__ = name
+        method.__doc__ = getattr(self.db_manager, name).__doc__
+        return method
+
+    def submit(self, name: str, *args, **kwargs) -> Future:
+        """Запуск метода менеджера в пуле; результат - concurrent.futures.Future"""
+        function = getattr(self.db_manager, name)
+
+        if not name.startswith(READ_PREFIXES):
+            with self._lock:
+                self._generation += 1
+            return self.executor.submit(self._execute, name, function, args, kwargs)
+
+        key = self._key(name, args, kwargs)
+        if key is None:
+            return self.executor.submit(self._execute, name, function, args, kwargs)
+
+        with self._lock:
+            key = (self._generation,) + key
+            future = self._inflight.get(key)
+            if future is not None:
+                if metrics.enabled:
+                    metrics.increment('db.async.coalesced')
+                return future
+
+            future = self.executor.submit(self._execute, name, function, args, kwargs)
+            self._inflight[key] = future
+
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _execute(self, name: str, function: Callable, args: tuple, kwargs: dict):
+        if name in SERIAL_METHODS:
+            with self._serial_lock:
+                return function(*args, **kwargs)
+        return function(*args, **kwargs)
+
+    def _forget(self, key: Tuple, future: Future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    @staticmethod
+    def _key(name: str, args: tuple, kwargs: dict) -> Optional[Tuple]:
+        """Ключ объединения запросов; None, если аргументы не сериализуются"""
+        try:
+            return name, json.dumps([args, kwargs], sort_keys=True, default=_reject)
+        except TypeError:
+            return None
+
+    def qt_call(self, name: str, *args, **kwargs) -> 'DatabaseCall':
+        """
+        Вызов для интерфейса Qt без блокировки главного потока
+
+            call = async_db.qt_call('get_statistics')
+            call.finished.connect(self.show_statistics_dialog)
+
+        Результат доставляется через очередь событий в поток, которому
+        принадлежит DatabaseCall (тот, где вызван qt_call).
+        """
+        if QObject is None:
+            raise RuntimeError("PyQt5 не установлен")
+
+        call = DatabaseCall()
+        self._qt_calls.add(call)
+        future = self.submit(name, *args, **kwargs)
+
+        call.delivered.connect(lambda: self._qt_calls.discard(call))
+        future.add_done_callback(call._resolve)
+        return call
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def _reject(value):
+    raise TypeError(type(value).__name__)
+
+
+if QObject is not None:
+    class DatabaseCall(QObject):
+        """
+        Результат фонового вызова DatabaseManager в виде сигналов Qt
+
+        finished и failed испускаются в потоке объекта, поэтому к ним
+        можно подключать любые функции, в том числе lambda.
+        """
+
+        finished = pyqtSignal(object)
+        failed = pyqtSignal(str)
+        delivered = pyqtSignal()
+        _done = pyqtSignal(object)
+
+        def __init__(self):
+            super().__init__()
+            # Очередь событий и для уже завершенного вызова: подписчики
+            # успевают подключиться после возврата из qt_call
+            self._done.connect(self._deliver, Qt.QueuedConnection)
+
+        def _resolve(self, future: Future):
+            # Поток пула: передаем результат в поток объекта через очередь событий
+            self._done.emit(future)
+
+        @pyqtSlot(object)
+        def _deliver(self, future: Future):
+            error = future.exception()
+            if error is not None:
+                self.failed.emit(str(error))
+            else:
+                self.finished.emit(future.result())
+            self.delivered.emit()
+else:
+    DatabaseCall = None
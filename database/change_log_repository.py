@@ -0,0 +1,260 @@
+import json
+import sqlite3
+from typing import Dict, List, Optional, Sequence
+
+from core.metrics import instrument_repository
+from database.import_repository import ImportRepository
+from database.read_snapshot import read_snapshot
+from database.rule_rows import parse_tags
+
+# Таблицы базы знаний, изменения которых попадают в журнал (в порядке внешних ключей)
+CHANGE_TABLES = ('domains', 'agents', 'rules', 'facts')
+
+# Столбцы, изменение которых журналируется; служебные (счетчики доменов,
+# отпечаток правила) не передаются
+LOGGED_COLUMNS = {
+    'domains': ('name', 'description'),
+    'agents': ('name', 'domain_id', 'description'),
+    'rules': ('name', 'condition', 'action', 'rule_type', 'priority', 'confidence',
+              'source_file', 'author', 'tags', 'agent_id', 'domain_id'),
+    'facts': ('variable_name', 'value', 'confidence', 'source_file', 'author',
+              'is_derived', 'agent_id', 'domain_id'),
+}
+
+
+def create_change_log(cursor: sqlite3.Cursor):
+    """
+    Журнал изменений и триггеры, которые его ведут
+
+    Вызывается при инициализации БД. Если журнала еще не было, в него
+    записываются все сохраненные строки, чтобы первая выгрузка изменений
+    содержала базу знаний целиком.
+    """
+    created = cursor.execute('''
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log'
+        ''').fetchone() is None
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id TEXT NOT NULL,
+        op TEXT NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    # Номер, до которого журнал очищен: выгрузка с меньшего номера неполна
+    cursor.execute("INSERT OR IGNORE INTO kb_meta (key, value) VALUES ('change_log_pruned', 0)")
+
+    for table in CHANGE_TABLES:
+        for event, columns, row, op in (('INSERT', '', 'NEW', 'upsert'),
+                                        ('UPDATE', ' OF ' + ', '.join(LOGGED_COLUMNS[table]), 'NEW', 'upsert'),
+                                        ('DELETE', '', 'OLD', 'delete')):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_change_log
+            AFTER {event}{columns} ON {table}
+            BEGIN
+                INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', {row}.id, '{op}');
+            END
+            ''')
+
+        if created:
+            cursor.execute(f'''
+                INSERT INTO change_log (table_name, row_id, op)
+                SELECT '{table}', id, 'upsert' FROM {table} ORDER BY created_at
+                ''')
+
+
+@instrument_repository
+class ChangeLogRepository:
+    """
+    Выгрузка и применение изменений базы знаний по журналу
+
+    Каждая вставка, изменение и удаление домена, агента, правила или
+    факта получает в журнале возрастающий номер. Выгрузка с номера
+    содержит только строки, измененные после него, в их текущем виде,
+    и номер, с которого продолжать в следующий раз.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.import_repository = ImportRepository(db_path)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Создание соединения с БД"""
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row  # Для доступа по имени столбцов
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    @staticmethod
+    def _last_seq(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+        return row[0] if row else 0
+
+    def get_last_seq(self) -> int:
+        """Номер последнего изменения"""
+        try:
+            conn = self._get_connection()
+            seq = self._last_seq(conn)
+            conn.close()
+            return seq
+
+        except sqlite3.Error as e:
+            print(f"Ошибка чтения журнала изменений: {e}")
+            return 0
+
+    def export_changes(self, since_seq: int = 0,
+                       tables: Sequence[str] = CHANGE_TABLES) -> Optional[Dict]:
+        """
+        Изменения после номера since_seq
+
+        Несколько изменений одной строки сводятся к последнему. Строки,
+        которые есть в БД, выгружаются целиком в разделе upserts (в том же
+        виде, что при экспорте в JSON), удаленные - списком ID в deletes.
+
+        Returns:
+            Словарь с since_seq, last_seq, data_version, upserts и deletes;
+            None, если журнал после since_seq уже очищен (нужен полный экспорт)
+        """
+        try:
+            with read_snapshot(self.db_path) as conn:
+                pruned = conn.execute("SELECT value FROM kb_meta WHERE key = 'change_log_pruned'").fetchone()
+                if pruned and since_seq < pruned[0]:
+                    print(f"Журнал изменений очищен до номера {pruned[0]}, нужен полный экспорт")
+                    return None
+
+                last_seq = self._last_seq(conn)
+                changed = {table: {} for table in tables}  # ID -> последняя операция
+                for row in conn.execute('''
+                        SELECT table_name, row_id, op FROM change_log
+                        WHERE seq > ? AND seq <= ? ORDER BY seq
+                        ''', (since_seq, last_seq)):
+                    if row['table_name'] in changed:
+                        changed[row['table_name']][row['row_id']] = row['op']
+
+                upserts = {}
+                deletes = {}
+                for table, operations in changed.items():
+                    rows = self._read_rows(conn, table, [row_id for row_id, op in operations.items()
+                                                         if op == 'upsert'])
+                    # Строка, вставленная и затем удаленная, тоже попадает в deletes
+                    present = {row['id'] for row in rows}
+                    upserts[table] = rows
+                    deletes[table] = [row_id for row_id in operations if row_id not in present]
+
+                return {
+                    'since_seq': since_seq,
+                    'last_seq': last_seq,
+                    'data_version': conn.data_version,
+                    'upserts': upserts,
+                    'deletes': deletes,
+                }
+
+        except sqlite3.Error as e:
+            print(f"Ошибка выгрузки изменений: {e}")
+            return None
+
+    @staticmethod
+    def _read_rows(conn: sqlite3.Connection, table: str, ids: List[str]) -> List[Dict]:
+        rows = []
+        for start in range(0, len(ids), 10000):
+            for row in conn.execute(f'''
+                    SELECT * FROM {table} WHERE id IN (SELECT value FROM json_each(?))
+                    ORDER BY created_at
+                    ''', (json.dumps(ids[start:start + 10000]),)):
+                item = dict(row)
+                rows.append(parse_tags(item) if table == 'rules' else item)
+        return rows
+
+    def _delete_rows(self, cursor: sqlite3.Cursor, deletes: Dict[str, List[str]]) -> Dict[str, int]:
+        """Удаление строк по ID в открытой транзакции, зависимые - раньше"""
+        deleted = {}
+        for table in reversed(CHANGE_TABLES):
+            ids = deletes.get(table) or []
+            if not ids:
+                continue
+            cursor.execute(f'DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))',
+                           (json.dumps(ids),))
+            deleted[table] = cursor.rowcount
+
+        if any(deleted.values()):
+            # Каскадное удаление меняет счетчики нескольких доменов сразу
+            cursor.execute('''
+                UPDATE domains SET
+                    rules_count = (SELECT COUNT(*) FROM rules WHERE rules.domain_id = domains.id),
+                    facts_count = (SELECT COUNT(*) FROM facts WHERE facts.domain_id = domains.id),
+                    agents_count = (SELECT COUNT(*) FROM agents WHERE agents.domain_id = domains.id)
+                ''')
+        return deleted
+
+    def delete_rows(self, deletes: Dict[str, List[str]]) -> Optional[Dict[str, int]]:
+        """Удаление строк из раздела deletes выгрузки изменений"""
+        conn = self._get_connection()
+        try:
+            deleted = self._delete_rows(conn.cursor(), deletes)
+            conn.commit()
+            return deleted
+
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка удаления строк: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def apply_changes(self, changes: Dict, batch_size: int = 10000) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        Применение выгрузки export_changes другой базы знаний
+
+        Удаления и вставки с обновлениями выполняются в одной транзакции;
+        повторное применение той же выгрузки ничего не меняет. Применяемые
+        изменения попадают и в журнал этой БД.
+
+        Returns:
+            Итоги по разделам, как у импорта, с количеством удаленных
+            строк (deleted); None при ошибке
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            deleted = self._delete_rows(cursor, changes.get('deletes') or {})
+            summary = self.import_repository.import_rows(cursor, changes.get('upserts') or {}, batch_size)
+            conn.commit()
+
+            for section, counts in summary.items():
+                counts['deleted'] = deleted.get(section, 0)
+            return summary
+
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка применения изменений: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def prune_change_log(self, before_seq: int) -> int:
+        """
+        Очистка журнала до номера before_seq включительно
+
+        Вызывается, когда все получатели забрали изменения до этого номера.
+
+        Returns:
+            Количество удаленных записей журнала
+        """
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM change_log WHERE seq <= ?', (before_seq,))
+            count = cursor.rowcount
+            cursor.execute('''
+                UPDATE kb_meta SET value = MAX(value, ?) WHERE key = 'change_log_pruned'
+                ''', (before_seq,))
+            conn.commit()
+            conn.close()
+            return count
+
+        except sqlite3.Error as e:
+            print(f"Ошибка очистки журнала изменений: {e}")
+            return 0
@@ -0,0 +1,352 @@
+import json
+import sqlite3
+from typing import Dict, Iterable, List
+
+from core.metrics import instrument_repository
+from core.tokenizer import concept_key
+from database.rule_rows import rules_from_rows
+
+
+def create_concept_index(cursor: sqlite3.Cursor):
+    """
+    Таблицы индекса концепций
+
+    Концепции (именованные сущности и именные группы extract_key_concepts)
+    связаны с правилами и фактами, в тексте которых они упоминаются, и с
+    исходными файлами. Изменение текста правила или факта удаляет его
+    связи триггером (изменение других столбцов их сохраняет), удаление -
+    каскадно.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS concepts (
+        id INTEGER PRIMARY KEY,
+        key TEXT NOT NULL UNIQUE,
+        text TEXT NOT NULL,
+        type TEXT NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS concept_rules (
+        concept_id INTEGER NOT NULL,
+        rule_id TEXT NOT NULL,
+        PRIMARY KEY (concept_id, rule_id),
+        FOREIGN KEY (concept_id) REFERENCES concepts(id) ON DELETE CASCADE,
+        FOREIGN KEY (rule_id) REFERENCES rules(id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS concept_facts (
+        concept_id INTEGER NOT NULL,
+        fact_id TEXT NOT NULL,
+        PRIMARY KEY (concept_id, fact_id),
+        FOREIGN KEY (concept_id) REFERENCES concepts(id) ON DELETE CASCADE,
+        FOREIGN KEY (fact_id) REFERENCES facts(id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS concept_sources (
+        concept_id INTEGER NOT NULL,
+        source_file TEXT NOT NULL,
+        PRIMARY KEY (concept_id, source_file),
+        FOREIGN KEY (concept_id) REFERENCES concepts(id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+
+    # Тройки субъект - глагол - объект из extract_relationships
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS concept_relations (
+        subject_id INTEGER NOT NULL,
+        relation TEXT NOT NULL,
+        object_id INTEGER NOT NULL,
+        source_file TEXT NOT NULL,
+        PRIMARY KEY (subject_id, relation, object_id, source_file),
+        FOREIGN KEY (subject_id) REFERENCES concepts(id) ON DELETE CASCADE,
+        FOREIGN KEY (object_id) REFERENCES concepts(id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_concept_rules_rule ON concept_rules(rule_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_concept_facts_fact ON concept_facts(fact_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_concept_sources_source ON concept_sources(source_file)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_concept_relations_object ON concept_relations(object_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_facts_source ON facts(source_file)')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_rules_text_concepts
+    AFTER UPDATE OF condition, action ON rules
+    WHEN OLD.condition IS NOT NEW.condition OR OLD.action IS NOT NEW.action
+    BEGIN
+        DELETE FROM concept_rules WHERE rule_id = NEW.id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_facts_text_concepts
+    AFTER UPDATE OF variable_name, value ON facts
+    WHEN OLD.variable_name IS NOT NEW.variable_name OR OLD.value IS NOT NEW.value
+    BEGIN
+        DELETE FROM concept_facts WHERE fact_id = NEW.id;
+    END
+    ''')
+
+
+def _mentions(text_key: str, first_words: Dict[str, List[str]]) -> set:
+    """Ключи концепций, которые встречаются в ключе текста"""
+    words = text_key.split()
+    found = set()
+    for index, word in enumerate(words):
+        for key in first_words.get(word, ()):
+            length = key.count(' ') + 1
+            if ' '.join(words[index:index + length]) == key:
+                found.add(key)
+    return found
+
+
+@instrument_repository
+class ConceptRepository:
+    """
+    Индекс концепций: концепция -> правила, факты, исходные файлы
+
+    Запросы по концепции идут по индексам таблиц связей, а не сканированием
+    текста правил через LIKE. Концепция задается текстом в любой форме:
+    поиск идет по ключу concept_key.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Создание соединения с БД"""
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row  # Для доступа по имени столбцов
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def index_concepts(self, concepts: Iterable[Dict], relationships: Iterable[Dict],
+                       rules: Iterable[Dict], facts: Iterable[Dict], source_file: str) -> int:
+        """
+        Сохранение концепций и отношений, извлеченных из текста
+
+        Args:
+            concepts: Результат extract_key_concepts
+            relationships: Результат extract_relationships; субъект и объект
+                добавляются как концепции типа TERM
+            rules, facts: Сохраненные правила и факты этого текста (с id);
+                концепция связывается с теми, в тексте которых упоминается
+            source_file: Исходный файл текста
+
+        Returns:
+            Количество проиндексированных концепций
+        """
+        found = {}  # ключ -> (текст, тип) первого упоминания
+        for concept in concepts:
+            key = concept_key(concept.get('text'))
+            if key and key not in found:
+                found[key] = (concept['text'], concept.get('type') or 'TERM')
+
+        triples = set()
+        for relationship in relationships:
+            subject = concept_key(relationship.get('subject'))
+            obj = concept_key(relationship.get('object'))
+            if not subject or not obj:
+                continue
+            for key, text in ((subject, relationship['subject']), (obj, relationship['object'])):
+                found.setdefault(key, (text, 'TERM'))
+            triples.add((subject, str(relationship.get('relation') or '').lower(), obj))
+
+        if not found:
+            return 0
+
+        first_words: Dict[str, List[str]] = {}
+        for key in found:
+            first_words.setdefault(key.split(' ', 1)[0], []).append(key)
+
+        rule_links = [(key, rule['id']) for rule in rules if rule and rule.get('id')
+                      for key in _mentions(concept_key(f"{rule.get('condition') or ''} "
+                                                       f"{rule.get('action') or ''}"), first_words)]
+        fact_links = [(key, fact['id']) for fact in facts if fact and fact.get('id')
+                      for key in _mentions(concept_key(f"{fact.get('variable_name') or ''} "
+                                                       f"{fact.get('value') or ''}"), first_words)]
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.executemany('''
+                INSERT INTO concepts (key, text, type) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO NOTHING
+                ''', [(key, text, concept_type) for key, (text, concept_type) in found.items()])
+            ids = {row['key']: row['id'] for row in cursor.execute('''
+                SELECT id, key FROM concepts WHERE key IN (SELECT value FROM json_each(?))
+                ''', (json.dumps(list(found)),))}
+
+            cursor.executemany('INSERT OR IGNORE INTO concept_sources (concept_id, source_file) VALUES (?, ?)',
+                               [(concept_id, source_file or '') for concept_id in ids.values()])
+            cursor.executemany('INSERT OR IGNORE INTO concept_rules (concept_id, rule_id) VALUES (?, ?)',
+                               [(ids[key], rule_id) for key, rule_id in rule_links])
+            cursor.executemany('INSERT OR IGNORE INTO concept_facts (concept_id, fact_id) VALUES (?, ?)',
+                               [(ids[key], fact_id) for key, fact_id in fact_links])
+            cursor.executemany('''
+                INSERT OR IGNORE INTO concept_relations (subject_id, relation, object_id, source_file)
+                VALUES (?, ?, ?, ?)
+                ''', [(ids[subject], relation, ids[obj], source_file or '')
+                      for subject, relation, obj in triples])
+
+            conn.commit()
+            conn.close()
+            return len(ids)
+
+        except sqlite3.Error as e:
+            print(f"Ошибка индексации концепций: {e}")
+            return 0
+
+    def find_concepts(self, prefix: str, limit: int = 50) -> List[Dict]:
+        """
+        Концепции, ключ которых начинается с ключа prefix
+
+        Returns:
+            [{'key', 'text', 'type', 'rules', 'facts', 'sources'}] - числа
+            связанных правил, фактов и исходных файлов
+        """
+        key = concept_key(prefix)
+        if not key:
+            return []
+        upper = key[:-1] + chr(ord(key[-1]) + 1)
+
+        try:
+            conn = self._get_connection()
+            rows = conn.execute('''
+                SELECT c.key, c.text, c.type,
+                       (SELECT COUNT(*) FROM concept_rules cr WHERE cr.concept_id = c.id) AS rules,
+                       (SELECT COUNT(*) FROM concept_facts cf WHERE cf.concept_id = c.id) AS facts,
+                       (SELECT COUNT(*) FROM concept_sources cs WHERE cs.concept_id = c.id) AS sources
+                FROM concepts c
+                WHERE c.key >= ? AND c.key < ?
+                ORDER BY c.key
+                LIMIT ?
+                ''', (key, upper, limit)).fetchall()
+            conn.close()
+            return [dict(row) for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска концепций: {e}")
+            return []
+
+    def get_rules_by_concept(self, concept: str, agent_id: str = None) -> List[Dict]:
+        """Правила, в тексте которых упоминается концепция"""
+        query = '''
+            SELECT r.* FROM concepts c
+            JOIN concept_rules cr ON cr.concept_id = c.id
+            JOIN rules r ON r.id = cr.rule_id
+            WHERE c.key = ?
+            '''
+        params = [concept_key(concept)]
+        if agent_id:
+            query += ' AND r.agent_id = ?'
+            params.append(agent_id)
+        query += ' ORDER BY r.priority DESC, r.created_at DESC'
+
+        try:
+            conn = self._get_connection()
+            rows = conn.execute(query, params).fetchall()
+            conn.close()
+            return rules_from_rows(rows)
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения правил по концепции: {e}")
+            return []
+
+    def get_facts_by_concept(self, concept: str, agent_id: str = None) -> List[Dict]:
+        """Факты, в переменной или значении которых упоминается концепция"""
+        query = '''
+            SELECT f.* FROM concepts c
+            JOIN concept_facts cf ON cf.concept_id = c.id
+            JOIN facts f ON f.id = cf.fact_id
+            WHERE c.key = ?
+            '''
+        params = [concept_key(concept)]
+        if agent_id:
+            query += ' AND f.agent_id = ?'
+            params.append(agent_id)
+        query += ' ORDER BY f.confidence DESC, f.created_at DESC'
+
+        try:
+            conn = self._get_connection()
+            rows = conn.execute(query, params).fetchall()
+            conn.close()
+            return [dict(row) for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения фактов по концепции: {e}")
+            return []
+
+    def get_cooccurring_facts(self, concept: str, agent_id: str = None) -> List[Dict]:
+        """
+        Факты из тех же исходных файлов, где встречается концепция
+
+        Факты, которые сами упоминают концепцию (mentions = 1), идут первыми.
+        """
+        query = '''
+            SELECT f.*, EXISTS (
+                SELECT 1 FROM concept_facts cf WHERE cf.concept_id = c.id AND cf.fact_id = f.id
+            ) AS mentions
+            FROM concepts c
+            JOIN concept_sources cs ON cs.concept_id = c.id
+            JOIN facts f ON f.source_file = cs.source_file
+            WHERE c.key = ?
+            '''
+        params = [concept_key(concept)]
+        if agent_id:
+            query += ' AND f.agent_id = ?'
+            params.append(agent_id)
+        query += ' ORDER BY mentions DESC, f.confidence DESC, f.created_at DESC'
+
+        try:
+            conn = self._get_connection()
+            rows = conn.execute(query, params).fetchall()
+            conn.close()
+            return [dict(row) for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения фактов рядом с концепцией: {e}")
+            return []
+
+    def get_concept_relations(self, concept: str) -> List[Dict]:
+        """Отношения, в которых концепция - субъект или объект"""
+        try:
+            conn = self._get_connection()
+            rows = conn.execute('''
+                SELECT s.text AS subject, r.relation, o.text AS object, r.source_file
+                FROM concepts c
+                JOIN concept_relations r ON r.subject_id = c.id OR r.object_id = c.id
+                JOIN concepts s ON s.id = r.subject_id
+                JOIN concepts o ON o.id = r.object_id
+                WHERE c.key = ?
+                ORDER BY r.relation, s.key, o.key
+                ''', (concept_key(concept),)).fetchall()
+            conn.close()
+            return [dict(row) for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения отношений концепции: {e}")
+            return []
+
+    def get_rule_concepts(self, rule_id: str) -> List[Dict]:
+        """Концепции, упоминаемые в правиле"""
+        try:
+            conn = self._get_connection()
+            rows = conn.execute('''
+                SELECT c.key, c.text, c.type FROM concept_rules cr
+                JOIN concepts c ON c.id = cr.concept_id
+                WHERE cr.rule_id = ?
+                ORDER BY c.key
+                ''', (rule_id,)).fetchall()
+            conn.close()
+            return [dict(row) for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения концепций правила: {e}")
+            return []
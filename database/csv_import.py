@@ -0,0 +1,139 @@
+"""
+Чтение выгрузки export_to_csv по схемам столбцов
+
+Типы столбцов каждого раздела заданы заранее, а не угадываются по
+значению: название правила "2024" остается строкой, значение факта -
+всегда строка. Строки раздела читаются пачками и преобразуются по
+столбцам; строки с ошибками пропускаются и попадают в список errors
+с номером строки файла.
+"""
+import ast
+import csv
+import json
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Разделы файла -> разделы импорта
+CSV_SECTIONS = {'DOMAINS': 'domains', 'AGENTS': 'agents', 'RULES': 'rules', 'FACTS': 'facts'}
+
+
+def parse_bool(value: str) -> bool:
+    lowered = value.strip().lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"не логическое значение: {value!r}")
+
+
+def parse_tags(value: str) -> List[str]:
+    """Теги: список JSON или список Python (так их пишет export_to_csv)"""
+    try:
+        tags = json.loads(value)
+    except ValueError:
+        tags = ast.literal_eval(value)
+    if not isinstance(tags, list):
+        raise ValueError(f"теги не являются списком: {value!r}")
+    return tags
+
+
+# Типы столбцов; не указанные столбцы - строки. Пустая ячейка - None
+CSV_SCHEMAS: Dict[str, Dict[str, Callable[[str], object]]] = {
+    'domains': {'rules_count': int, 'facts_count': int, 'agents_count': int},
+    'agents': {},
+    'rules': {'priority': int, 'confidence': float, 'tags': parse_tags},
+    'facts': {'confidence': float, 'is_derived': parse_bool},
+}
+
+
+class CsvImportReader:
+    """
+    Потоковое чтение CSV-выгрузки пачками (раздел, записи)
+
+    Ошибки (неверное число столбцов, значение не того типа) не прерывают
+    чтение: строка пропускается, ошибка добавляется в errors.
+    """
+
+    def __init__(self, input_file: str, schemas: Dict[str, Dict[str, Callable]] = None,
+                 batch_rows: int = 10000):
+        self.input_file = input_file
+        self.schemas = schemas or CSV_SCHEMAS
+        self.batch_rows = batch_rows
+        self.errors: List[Dict] = []
+
+    def _error(self, section: str, line: int, message: str, column: str = None):
+        self.errors.append({'section': section, 'line': line, 'column': column, 'error': message})
+
+    def iter_batches(self) -> Iterator[Tuple[str, List[Dict]]]:
+        with open(self.input_file, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            section: Optional[str] = None
+            headers: List[str] = []
+            lines: List[int] = []
+            rows: List[List[str]] = []
+
+            for row in reader:
+                if not row:  # Пустая строка
+                    continue
+
+                # Заголовок раздела - единственная ячейка в скобках
+                # (теги правила в первом столбце тоже записаны в скобках)
+                if len(row) == 1 and row[0].startswith('[') and row[0].endswith(']'):
+                    if rows:
+                        yield section, self._convert(section, headers, lines, rows)
+                    section = CSV_SECTIONS.get(row[0][1:-1])
+                    headers, lines, rows = [], [], []
+                    continue
+
+                # Сведения об экспорте и неизвестные разделы не импортируются
+                if section is None:
+                    continue
+
+                if not headers:
+                    headers = row
+                    continue
+
+                if len(row) != len(headers):
+                    self._error(section, reader.line_num,
+                                f"ожидалось столбцов: {len(headers)}, получено: {len(row)}")
+                    continue
+
+                lines.append(reader.line_num)
+                rows.append(row)
+                if len(rows) >= self.batch_rows:
+                    yield section, self._convert(section, headers, lines, rows)
+                    lines, rows = [], []
+
+            if rows:
+                yield section, self._convert(section, headers, lines, rows)
+
+    def _convert(self, section: str, headers: List[str], lines: List[int],
+                 rows: List[List[str]]) -> List[Dict]:
+        """Преобразование пачки по столбцам; строки с ошибками отбрасываются"""
+        schema = self.schemas.get(section, {})
+        rejected = set()
+        columns = []
+
+        for header, values in zip(headers, zip(*rows)):
+            converter = schema.get(header)
+            if converter is None:
+                # Строковый столбец: пустая ячейка - пустая строка (значение
+                # факта может быть пустым), а не отсутствующее значение
+                columns.append(list(values))
+                continue
+
+            try:
+                # Обычно весь столбец корректен и преобразуется за один проход
+                columns.append([converter(value) if value != '' else None for value in values])
+            except (ValueError, SyntaxError, TypeError):
+                converted = []
+                for index, value in enumerate(values):
+                    try:
+                        converted.append(converter(value) if value != '' else None)
+                    except (ValueError, SyntaxError, TypeError) as e:
+                        converted.append(None)
+                        rejected.add(index)
+                        self._error(section, lines[index], str(e), header)
+                columns.append(converted)
+
+        return [dict(zip(headers, values)) for index, values in enumerate(zip(*columns))
+                if index not in rejected]
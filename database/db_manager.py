@@ -3,12 +3,26 @@ import sqlite3
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Optional, Sequence, Tuple
 
+from core.kb_archive import ArchiveReader, ArchiveWriter
+from core.metrics import metrics
+from core.truth_maintenance import TruthMaintenanceSystem
+from core.kb_snapshot import KnowledgeBaseSnapshot, SnapshotError
 from database.agent_repository import AgentRepository
+from database.change_log_repository import ChangeLogRepository, create_change_log
+from database.concept_repository import ConceptRepository, create_concept_index
+from database.csv_import import CsvImportReader
+from database.dependency_repository import DependencyRepository
+from database.derivation_repository import DerivationRepository
 from database.domain_repository import DomainRepository
 from database.fact_repository import FactRepository
+from database.import_repository import (ImportRepository, SECTIONS, DOMAIN_COLUMNS, AGENT_COLUMNS,
+                                        RULE_COLUMNS, FACT_COLUMNS)
+from database.read_snapshot import read_snapshot
 from database.rule_repository import RuleRepository
+from database.rule_rows import rules_from_rows
+from database.signature_repository import SignatureRepository, read_rule_signatures
 from database.statistics_repository import StatisticsRepository
 
 
@@ -22,6 +36,8 @@ class DatabaseManager:
             db_path = "knowledge_base.sqlite3"
 
         self.db_path = Path(db_path)
+        self._snapshot = None
+        self._derivations = {}  # agent_id -> (ревизия, TruthMaintenanceSystem)
         self._init_database()
 
         self.agent_repository = AgentRepository(self.db_path)
@@ -29,6 +45,24 @@ class DatabaseManager:
         self.rule_repository = RuleRepository(self.db_path)
         self.fact_repository = FactRepository(self.db_path)
         self.statistics_repository = StatisticsRepository(self.db_path)
+        self.derivation_repository = DerivationRepository(self.db_path)
+        self.dependency_repository = DependencyRepository(self.db_path)
+        self.signature_repository = SignatureRepository(self.db_path)
+        self.import_repository = ImportRepository(self.db_path)
+        self.change_log_repository = ChangeLogRepository(self.db_path)
+        self.concept_repository = ConceptRepository(self.db_path)
+        self.last_import_summary = None  # итоги последнего импорта
+        self.last_import_errors = []  # строки CSV, пропущенные из-за ошибок
+
+        # Индекс зависимостей для правил, сохраненных до его появления
+        if not self.dependency_repository.is_built():
+            self.dependency_repository.rebuild_dependencies()
+
+        # Отпечатки правил, сохраненных до их появления
+        self.rule_repository.fill_fingerprints()
+
+        # Сигнатуры текста для правил, сохраненных или измененных без них
+        self.signature_repository.fill_missing_signatures()
 
     def _get_connection(self) -> sqlite3.Connection:
         """Создание соединения с БД"""
@@ -43,6 +77,9 @@ class DatabaseManager:
         conn = self._get_connection()
         cursor = conn.cursor()
 
+        # WAL: долгие чтения идут по снимку и не блокируют запись
+        cursor.execute('PRAGMA journal_mode = WAL')
+
         # Таблица доменов
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS domains (
@@ -84,6 +121,7 @@ class DatabaseManager:
             agent_id TEXT NOT NULL,
             domain_id TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            fingerprint TEXT,
             FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE,
             FOREIGN KEY (domain_id) REFERENCES domains(id) ON DELETE SET NULL
         )
@@ -110,26 +148,346 @@ class DatabaseManager:
         # Индексы для ускорения поиска
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_rules_agent ON rules(agent_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_rules_domain ON rules(domain_id)')
+
+        # Отпечаток правила (core.tokenizer.rule_fingerprint) в БД,
+        # созданных до его появления; заполняется при запуске
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(rules)')}
+        if 'fingerprint' not in columns:
+            cursor.execute('ALTER TABLE rules ADD COLUMN fingerprint TEXT')
+
+        # Одинаковые правила агента не сохраняются дважды. Дубликаты,
+        # оставшиеся от прежних версий, хранятся без отпечатка
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_rules_fingerprint ON rules(fingerprint)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_facts_agent ON facts(agent_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_facts_variable ON facts(variable_name)')
 
+        # Обоснования выведенных фактов: правило и опорные факты
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fact_justifications (
+            fact_id TEXT PRIMARY KEY,
+            rule_id TEXT,
+            agent_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (fact_id) REFERENCES facts(id) ON DELETE CASCADE,
+            FOREIGN KEY (rule_id) REFERENCES rules(id) ON DELETE SET NULL
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fact_supports (
+            fact_id TEXT NOT NULL,
+            support_fact_id TEXT NOT NULL,
+            support_variable TEXT NOT NULL,
+            PRIMARY KEY (fact_id, support_fact_id),
+            FOREIGN KEY (fact_id) REFERENCES facts(id) ON DELETE CASCADE
+        )
+        ''')
+
+        # Исходные факты и правила, учтенные инкрементальным выводом
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS derivation_inputs (
+            agent_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            variable_name TEXT,
+            PRIMARY KEY (agent_id, kind, item_id),
+            FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS derivation_state (
+            agent_id TEXT PRIMARY KEY,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE
+        )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_justifications_agent ON fact_justifications(agent_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_justifications_rule ON fact_justifications(rule_id)')
+
+        # Граф зависимостей правил: какие переменные правило читает и записывает
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rule_reads (
+            variable TEXT NOT NULL,
+            rule_id TEXT NOT NULL,
+            PRIMARY KEY (variable, rule_id),
+            FOREIGN KEY (rule_id) REFERENCES rules(id) ON DELETE CASCADE
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rule_writes (
+            variable TEXT NOT NULL,
+            rule_id TEXT NOT NULL,
+            PRIMARY KEY (variable, rule_id),
+            FOREIGN KEY (rule_id) REFERENCES rules(id) ON DELETE CASCADE
+        )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rule_reads_rule ON rule_reads(rule_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rule_writes_rule ON rule_writes(rule_id)')
+
+        # Сигнатуры текста правил: хеши токенов и основ слов (core.tokenizer)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rule_signatures (
+            rule_id TEXT PRIMARY KEY,
+            condition_tokens BLOB NOT NULL,
+            action_tokens BLOB NOT NULL,
+            condition_lemmas BLOB NOT NULL,
+            action_lemmas BLOB NOT NULL,
+            FOREIGN KEY (rule_id) REFERENCES rules(id) ON DELETE CASCADE
+        )
+        ''')
+
+        # Изменение текста делает сигнатуры и отпечаток недействительными
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_rules_text_signatures
+        AFTER UPDATE OF condition, action ON rules
+        BEGIN
+            DELETE FROM rule_signatures WHERE rule_id = NEW.id;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_rules_text_fingerprint
+        AFTER UPDATE OF condition, action, agent_id ON rules
+        BEGIN
+            UPDATE rules SET fingerprint = NULL WHERE id = NEW.id;
+        END
+        ''')
+
+        # Ревизия данных: увеличивается при любом изменении базы знаний
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kb_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO kb_meta (key, value) VALUES ('revision', 0)")
+
+        for table in ('domains', 'agents', 'rules', 'facts'):
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_revision
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE kb_meta SET value = value + 1 WHERE key = 'revision';
+                END
+                ''')
+
+        # Индекс концепций: концепция -> правила, факты, исходные файлы
+        create_concept_index(cursor)
+
+        # Журнал изменений для выгрузки разностей (export_changes)
+        create_change_log(cursor)
+
         conn.commit()
         conn.close()
 
         print(f"База данных инициализирована: {self.db_path}")
 
+    def get_data_version(self) -> int:
+        """Текущая ревизия данных базы знаний"""
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT value FROM kb_meta WHERE key = 'revision'").fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+
+    # Бинарный снимок базы знаний
+
+    def get_snapshot_path(self) -> Path:
+        """Путь к файлу снимка рядом с файлом БД"""
+        return self.db_path.with_name(self.db_path.name + '.kbsnap')
+
+    def get_snapshot(self) -> KnowledgeBaseSnapshot:
+        """
+        Получение актуального снимка базы знаний
+
+        Снимок пересобирается, только если ревизия данных изменилась
+        с момента его записи.
+        """
+        revision = self.get_data_version()
+
+        if self._snapshot is not None and self._snapshot.revision == revision:
+            return self._snapshot
+
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+        path = self.get_snapshot_path()
+        if path.exists():
+            try:
+                snapshot = KnowledgeBaseSnapshot(path)
+                if snapshot.revision == revision:
+                    self._snapshot = snapshot
+                    return snapshot
+                snapshot.close()
+            except SnapshotError as e:
+                print(f"Снимок будет пересобран: {e}")
+
+        self._snapshot = self.build_snapshot()
+        return self._snapshot
+
+    def read_snapshot(self):
+        """
+        Соединение только для чтения с согласованным представлением данных
+
+            with db_manager.read_snapshot() as conn:
+                conn.data_version  # ревизия, которую видят все запросы
+        """
+        return read_snapshot(self.db_path)
+
+    @staticmethod
+    def _read_knowledge_base(conn: sqlite3.Connection, rules_order: str = '') -> Dict:
+        """Все записи базы знаний, прочитанные через одно соединение"""
+        rules = rules_from_rows(conn.execute(f'SELECT * FROM rules {rules_order}'))
+
+        return {
+            'domains': [dict(row) for row in conn.execute('SELECT * FROM domains ORDER BY name')],
+            'agents': [dict(row) for row in conn.execute('SELECT * FROM agents ORDER BY name')],
+            'rules': rules,
+            'facts': [dict(row) for row in conn.execute('SELECT * FROM facts ORDER BY created_at DESC')],
+        }
+
+    def build_snapshot(self) -> KnowledgeBaseSnapshot:
+        """Компиляция снимка из согласованного состояния БД"""
+        # Все чтения в одной транзакции, чтобы ревизия соответствовала данным;
+        # запись в это время не блокируется
+        with self.read_snapshot() as conn:
+            revision = conn.data_version
+            data = self._read_knowledge_base(conn)
+            signatures = read_rule_signatures(conn)
+
+        return KnowledgeBaseSnapshot.build(
+            self.get_snapshot_path(), revision,
+            data['domains'], data['agents'], data['rules'], data['facts'], signatures
+        )
+
+    # Инкрементальный вывод
+
+    def update_derived_facts(self, agent_id: str, strategy: str = 'priority') -> Optional[Dict]:
+        """
+        Инкрементальный прямой вывод для агента
+
+        Сохраненные выводы и их обоснования восстанавливаются без
+        перевычисления. Затем учитываются только изменения с прошлого
+        запуска: новые и удаленные исходные факты, новые правила и
+        выводы, правило которых удалено. Результат сохраняется в facts
+        с is_derived = 1 вместе с обоснованием.
+
+        Returns:
+            {'added': [...], 'removed': [...], 'tms': TruthMaintenanceSystem}
+            или None при ошибке
+        """
+        # База не менялась с прошлого запуска - выводить нечего
+        cached = self._derivations.get(agent_id)
+        if cached and cached[0] == self.get_data_version():
+            return {'added': [], 'removed': [], 'tms': cached[1]}
+
+        agent = self.get_agent(agent_id)
+        if not agent:
+            print(f"Агент {agent_id} не найден")
+            return None
+
+        rules = self.get_rules_by_agent(agent_id)
+        # Более поздний факт переопределяет более ранний для той же переменной
+        facts = list(reversed(self.get_facts_by_agent(agent_id)))
+        inputs = self.derivation_repository.get_derivation_inputs(agent_id)
+        justifications = self.derivation_repository.get_justifications(agent_id)
+
+        base_facts = [{'id': fact['id'], 'variable': fact['variable_name'], 'value': fact['value']}
+                      for fact in facts if not fact['is_derived']]
+        derived_facts = [{'id': fact['id'], 'variable': fact['variable_name'], 'value': fact['value'],
+                          'rule_id': justifications[fact['id']]['rule_id'],
+                          'supports': justifications[fact['id']]['supports']}
+                         for fact in facts if fact['id'] in justifications]
+
+        # Первый запуск: обоснования без учтенных исходных данных не восстанавливаются
+        orphan_ids = []
+        if inputs is None:
+            inputs = {'facts': {}, 'rules': set()}
+            orphan_ids = [fact['id'] for fact in derived_facts]
+            derived_facts = []
+
+        known_rules = [rule for rule in rules if rule['id'] in inputs['rules']]
+        new_rules = [rule for rule in rules if rule['id'] not in inputs['rules']]
+        current_rule_ids = {rule['id'] for rule in rules}
+
+        tms = TruthMaintenanceSystem(known_rules, strategy)
+        invalid = tms.load([fact for fact in base_facts if fact['id'] in inputs['facts']],
+                           derived_facts)
+
+        new_facts = [fact for fact in base_facts if fact['id'] not in inputs['facts']]
+        current_fact_ids = {fact['id'] for fact in base_facts}
+        retracted_facts = {fact_id: variable for fact_id, variable in inputs['facts'].items()
+                           if fact_id not in current_fact_ids}
+        retract = invalid + [variable for fact_id, variable in retracted_facts.items()
+                             if tms.facts.get(variable, {}).get('id') == fact_id]
+
+        result = tms.update(assert_facts=new_facts, retract=retract, new_rules=new_rules)
+
+        inputs_added = ([{'kind': 'fact', 'item_id': fact['id'], 'variable_name': fact['variable']}
+                         for fact in new_facts] +
+                        [{'kind': 'rule', 'item_id': rule['id']} for rule in new_rules])
+        inputs_removed = ([{'kind': 'fact', 'item_id': fact_id} for fact_id in retracted_facts] +
+                          [{'kind': 'rule', 'item_id': rule_id} for rule_id in inputs['rules']
+                           if rule_id not in current_rule_ids])
+
+        if not self.derivation_repository.save_derivations(
+                agent_id, agent.get('domain_id'), result['added'],
+                [fact['id'] for fact in result['removed']] + orphan_ids,
+                inputs_added, inputs_removed):
+            return None
+
+        self._derivations[agent_id] = (self.get_data_version(), tms)
+        result['tms'] = tms
+        return result
+
+    def get_fact_provenance(self, fact_id: str) -> Optional[Dict]:
+        return self.derivation_repository.get_fact_provenance(fact_id)
+
+    # Граф зависимостей правил
+
+    def rebuild_rule_dependencies(self) -> int:
+        return self.dependency_repository.rebuild_dependencies()
+
+    def get_rules_reading(self, variable: str, agent_id: str = None) -> List[Dict]:
+        return self.dependency_repository.get_rules_reading(variable, agent_id)
+
+    def get_rules_writing(self, variable: str, agent_id: str = None) -> List[Dict]:
+        return self.dependency_repository.get_rules_writing(variable, agent_id)
+
+    def get_rule_dependencies(self, rule_id: str) -> Dict:
+        return self.dependency_repository.get_rule_dependencies(rule_id)
+
+    def get_supporting_rules(self, goal: str, agent_id: str = None) -> List[Dict]:
+        return self.dependency_repository.get_supporting_rules(goal, agent_id)
+
+    def get_input_variables(self, goal: str, agent_id: str = None) -> List[str]:
+        return self.dependency_repository.get_input_variables(goal, agent_id)
+
+    def find_dependency_cycles(self, agent_id: str = None) -> List[List[str]]:
+        return self.dependency_repository.find_dependency_cycles(agent_id)
+
     # Экспорт/импорт
 
-    def export_to_json(self, output_file: str) -> bool:
-        """Экспорт всей БД в JSON"""
-        try:
+    def _export_data(self) -> Dict:
+        """Данные для экспорта из одного согласованного снимка БД"""
+        with self.read_snapshot() as conn:
             data = {
                 'export_date': datetime.now().isoformat(),
-                'domains': self.get_all_domains(),
-                'agents': self.get_all_agents(),
-                'rules': self.get_all_rules(),
-                'facts': self.get_all_facts()
+                'data_version': conn.data_version,
             }
+            data.update(self._read_knowledge_base(conn, 'ORDER BY created_at DESC'))
+        return data
+
+    def export_to_json(self, output_file: str) -> bool:
+        """Экспорт всей БД в JSON"""
+        try:
+            data = self._export_data()
 
             with open(output_file, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
@@ -141,37 +499,38 @@ class DatabaseManager:
             print(f"Ошибка экспорта: {e}")
             return False
 
+    def _import_data(self, data: Dict) -> Optional[Dict]:
+        return self.import_repository.import_data(data)
+
+    def _import_stream(self, batches: Iterable[Tuple[str, List[Dict]]]) -> Optional[Dict]:
+        return self.import_repository.import_stream(batches)
+
+    def _report_import(self, summary: Optional[Dict], input_file: str, errors: List[Dict] = None) -> bool:
+        """Вывод итогов импорта"""
+        self.last_import_summary = summary
+        self.last_import_errors = errors or []
+        if summary is None:
+            return False
+
+        print(f"База данных импортирована из {input_file}")
+        for section, counts in summary.items():
+            print(f"  {section}: добавлено {counts['inserted']}, обновлено {counts['updated']}, "
+                  f"пропущено {counts['skipped']}")
+        return True
+
     def import_from_json(self, input_file: str) -> bool:
-        """Импорт БД из JSON"""
+        """
+        Импорт БД из JSON
+
+        Записи с ID, которые уже есть в БД, обновляются, совпадающие
+        пропускаются, поэтому повторный импорт файла безопасен. Итоги -
+        в last_import_summary.
+        """
         try:
             with open(input_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
 
-            # Импортируем домены
-            for domain_data in data.get('domains', []):
-                self.create_domain(
-                    name=domain_data['name'],
-                    description=domain_data.get('description', '')
-                )
-
-            # Импортируем агентов
-            for agent_data in data.get('agents', []):
-                self.create_agent(
-                    name=agent_data['name'],
-                    domain_id=agent_data.get('domain_id'),
-                    description=agent_data.get('description', '')
-                )
-
-            # Импортируем правила
-            for rule_data in data.get('rules', []):
-                self.save_rule(rule_data)
-
-            # Импортируем факты
-            for fact_data in data.get('facts', []):
-                self.save_fact(fact_data)
-
-            print(f"База данных импортирована из {input_file}")
-            return True
+            return self._report_import(self._import_data(data), input_file)
 
         except Exception as e:
             print(f"Ошибка импорта: {e}")
@@ -181,13 +540,7 @@ class DatabaseManager:
         """Экспорт всей БД в CSV"""
         try:
             # Получаем данные
-            data = {
-                'export_date': datetime.now().isoformat(),
-                'domains': self.get_all_domains(),
-                'agents': self.get_all_agents(),
-                'rules': self.get_all_rules(),
-                'facts': self.get_all_facts()
-            }
+            data = self._export_data()
 
             with open(output_file, 'w', encoding='utf-8', newline='') as f:
                 writer = csv.writer(f)
@@ -195,6 +548,7 @@ class DatabaseManager:
                 # Записываем дату экспорта
                 writer.writerow(['[EXPORT_INFO]'])
                 writer.writerow(['export_date', data['export_date']])
+                writer.writerow(['data_version', data['data_version']])
                 writer.writerow([])  # Пустая строка для разделения
 
                 # Записываем домены
@@ -258,101 +612,100 @@ class DatabaseManager:
             return False
 
     def import_from_csv(self, input_file: str) -> bool:
-        """Импорт БД из CSV"""
+        """
+        Импорт БД из CSV (по тем же правилам, что import_from_json)
+
+        Типы столбцов задаются схемами database.csv_import.CSV_SCHEMAS;
+        файл читается и импортируется пачками в одной транзакции. Строки
+        с ошибками пропускаются и перечисляются в last_import_errors.
+        """
         try:
-            with open(input_file, 'r', encoding='utf-8', newline='') as f:
-                reader = csv.reader(f)
-                current_section = None
-                headers = []
-
-                for row in reader:
-                    if not row:  # Пустая строка
-                        continue
-
-                    # Проверяем, является ли строка заголовком секции
-                    if row[0].startswith('[') and row[0].endswith(']'):
-                        current_section = row[0][1:-1]  # Убираем скобки
-                        headers = []
-                        continue
-
-                    # Если это строка заголовков для текущей секции
-                    if current_section and not headers and row[0] != 'export_date':
-                        headers = row
-                        continue
-
-                    # Обработка данных в зависимости от секции
-                    if current_section == 'EXPORT_INFO':
-                        if row[0] == 'export_date':
-                            # Можно сохранить дату экспорта если нужно
-                            continue
-
-                    elif current_section == 'DOMAINS' and headers:
-                        if len(row) == len(headers):
-                            domain_data = dict(zip(headers, row))
-                            self.create_domain(
-                                name=domain_data['name'],
-                                description=domain_data.get('description', '')
-                            )
-
-                    elif current_section == 'AGENTS' and headers:
-                        if len(row) == len(headers):
-                            agent_data = dict(zip(headers, row))
-                            domain_id = agent_data.get('domain_id')
-                            if domain_id:
-                                domain_id = int(domain_id) if domain_id.isdigit() else None
-
-                            self.create_agent(
-                                name=agent_data['name'],
-                                domain_id=domain_id,
-                                description=agent_data.get('description', '')
-                            )
-
-                    elif current_section == 'RULES' and headers:
-                        if len(row) == len(headers):
-                            rule_data = {}
-                            for i, header in enumerate(headers):
-                                value = row[i]
-                                if value == '':
-                                    rule_data[header] = None
-                                elif value.lower() in ['true', 'false']:
-                                    rule_data[header] = value.lower() == 'true'
-                                elif value.isdigit():
-                                    rule_data[header] = int(value)
-                                else:
-                                    try:
-                                        rule_data[header] = float(value)
-                                    except ValueError:
-                                        rule_data[header] = value
-
-                            self.save_rule(rule_data)
-
-                    elif current_section == 'FACTS' and headers:
-                        if len(row) == len(headers):
-                            fact_data = {}
-                            for i, header in enumerate(headers):
-                                value = row[i]
-                                if value == '':
-                                    fact_data[header] = None
-                                elif value.lower() in ['true', 'false']:
-                                    fact_data[header] = value.lower() == 'true'
-                                elif value.isdigit():
-                                    fact_data[header] = int(value)
-                                else:
-                                    try:
-                                        fact_data[header] = float(value)
-                                    except ValueError:
-                                        fact_data[header] = value
-
-                            self.save_fact(fact_data)
-
-            print(f"База данных импортирована из {input_file}")
-            return True
+            reader = CsvImportReader(input_file)
+            summary = self._import_stream(reader.iter_batches())
+            reader.errors.sort(key=lambda error: error['line'])
+
+            for error in reader.errors[:20]:
+                column = f", столбец {error['column']}" if error['column'] else ''
+                print(f"  строка {error['line']} ({error['section']}{column}): {error['error']}")
+            if len(reader.errors) > 20:
+                print(f"  ... и еще ошибок: {len(reader.errors) - 20}")
+
+            return self._report_import(summary, input_file, reader.errors)
 
         except Exception as e:
             print(f"Ошибка импорта из CSV: {e}")
             return False
 
+    # Компактный архив
+
+    ARCHIVE_COLUMNS = {'domains': DOMAIN_COLUMNS, 'agents': AGENT_COLUMNS,
+                       'rules': RULE_COLUMNS, 'facts': FACT_COLUMNS}
+
+    def _write_archive(self, writer: ArchiveWriter, sections: Sequence[str] = SECTIONS):
+        """Строки разделов из одного согласованного снимка БД"""
+        with self.read_snapshot() as conn:
+            writer.data_version = conn.data_version
+            for section in sections:
+                columns = ', '.join(self.ARCHIVE_COLUMNS[section])
+                cursor = conn.execute(f'SELECT {columns} FROM {section}')
+                while True:
+                    rows = cursor.fetchmany(writer.batch_rows)
+                    if not rows:
+                        break
+                    writer.write_rows(section, map(tuple, rows))
+
+    def export_to_archive(self, output_file: str) -> bool:
+        """
+        Экспорт всей БД в компактный архив (core.kb_archive)
+
+        Архив в несколько раз меньше JSON и читается быстрее; импортируется
+        через import_from_archive.
+        """
+        try:
+            with ArchiveWriter(output_file, self.ARCHIVE_COLUMNS,
+                               metadata={'export_date': datetime.now().isoformat()}) as writer:
+                self._write_archive(writer)
 
+            print(f"База данных экспортирована в {output_file}")
+            return True
+
+        except Exception as e:
+            print(f"Ошибка экспорта в архив: {e}")
+            return False
+
+    def import_from_archive(self, input_file: str) -> bool:
+        """Импорт БД из архива потоком, по тем же правилам, что import_from_json"""
+        try:
+            with ArchiveReader(input_file) as reader:
+                summary = self._import_stream(reader.iter_batches())
+            return self._report_import(summary, input_file)
+
+        except Exception as e:
+            print(f"Ошибка импорта из архива: {e}")
+            return False
+
+    # Журнал изменений
+
+    def export_changes(self, since_seq: int = 0) -> Optional[Dict]:
+        """
+        Изменения базы знаний после номера since_seq
+
+        Для синхронизации копий: получатель применяет выгрузку через
+        apply_changes и в следующий раз запрашивает изменения с ее last_seq.
+        """
+        return self.change_log_repository.export_changes(since_seq)
+
+    def apply_changes(self, changes: Dict) -> Optional[Dict]:
+        """Применение выгрузки export_changes; итоги - как у импорта, с числом удалений"""
+        summary = self.change_log_repository.apply_changes(changes)
+        self.last_import_summary = summary
+        return summary
+
+    def get_last_change_seq(self) -> int:
+        return self.change_log_repository.get_last_seq()
+
+    def prune_change_log(self, before_seq: int) -> int:
+        return self.change_log_repository.prune_change_log(before_seq)
 
     def create_agent(self, name: str, domain_id: str = None, description: str = "") -> Optional[Dict]:
         return self.agent_repository.create_agent(name, domain_id, description)
@@ -399,8 +752,8 @@ class DatabaseManager:
 
 
 
-    def save_rule(self, rule_data: Dict) -> Optional[Dict]:
-        return self.rule_repository.save_rule(rule_data)
+    def save_rule(self, rule_data: Dict, on_duplicate: str = 'skip') -> Optional[Dict]:
+        return self.rule_repository.save_rule(rule_data, on_duplicate)
 
     def get_rule(self, rule_id: str) -> Optional[Dict]:
         return self.rule_repository.get_rule(rule_id)
@@ -420,8 +773,18 @@ class DatabaseManager:
     def delete_rule(self, rule_id: str) -> bool:
         return self.rule_repository.delete_rule(rule_id)
 
-    def find_similar_rules(self, agent_id: str = None, threshold: float = 0.7) -> List[Dict]:
-        return self.rule_repository.find_similar_rules(agent_id, threshold)
+    def get_rules_by_ids(self, rule_ids: List[str]) -> List[Dict]:
+        return self.rule_repository.get_rules_by_ids(rule_ids)
+
+    def find_rules_by_id_prefix(self, prefix: str, limit: int = 100) -> List[Dict]:
+        return self.rule_repository.find_rules_by_id_prefix(prefix, limit)
+
+    def delete_rules(self, rule_ids: List[str]) -> int:
+        return self.rule_repository.delete_rules(rule_ids)
+
+    def find_similar_rules(self, agent_id: str = None, threshold: float = 0.7,
+                           lemmas: bool = False) -> List[Dict]:
+        return self.rule_repository.find_similar_rules(agent_id, threshold, lemmas)
 
     def find_conflicting_rules(self, agent_id: str = None) -> List[Dict]:
         return self.rule_repository.find_conflicting_rules(agent_id)
@@ -429,8 +792,52 @@ class DatabaseManager:
     def search_rules(self, query: str, agent_ids: List[str] = None) -> List[Dict]:
         return self.rule_repository.search_rules(query, agent_ids)
 
+    def count_duplicate_rules(self) -> int:
+        return self.rule_repository.count_duplicate_rules()
+
+    def delete_duplicate_rules(self) -> int:
+        return self.rule_repository.delete_duplicate_rules()
+
+    def get_rule_signatures(self, rule_ids: List[str], lemmas: bool = False) -> Dict:
+        return self.signature_repository.get_rule_signatures(rule_ids, lemmas)
+
+    def fill_missing_signatures(self) -> int:
+        return self.signature_repository.fill_missing_signatures()
+
+    # Индекс концепций
+
+    def index_concepts(self, concepts: List[Dict], relationships: List[Dict],
+                       rules: List[Dict], facts: List[Dict], source_file: str) -> int:
+        return self.concept_repository.index_concepts(concepts, relationships, rules, facts, source_file)
+
+    def find_concepts(self, prefix: str, limit: int = 50) -> List[Dict]:
+        return self.concept_repository.find_concepts(prefix, limit)
+
+    def get_rules_by_concept(self, concept: str, agent_id: str = None) -> List[Dict]:
+        return self.concept_repository.get_rules_by_concept(concept, agent_id)
+
+    def get_facts_by_concept(self, concept: str, agent_id: str = None) -> List[Dict]:
+        return self.concept_repository.get_facts_by_concept(concept, agent_id)
+
+    def get_cooccurring_facts(self, concept: str, agent_id: str = None) -> List[Dict]:
+        return self.concept_repository.get_cooccurring_facts(concept, agent_id)
+
+    def get_concept_relations(self, concept: str) -> List[Dict]:
+        return self.concept_repository.get_concept_relations(concept)
+
+    def get_rule_concepts(self, rule_id: str) -> List[Dict]:
+        return self.concept_repository.get_rule_concepts(rule_id)
+
     def get_statistics(self) -> Dict:
         return self.statistics_repository.get_statistics()
 
+    def get_metrics(self) -> Dict:
+        """Метрики производительности горячих путей"""
+        return metrics.snapshot()
+
+    def dump_metrics(self, output_file: str, fmt: str = None) -> bool:
+        """Сохранение метрик в JSON или текстовом формате Prometheus"""
+        return metrics.dump(output_file, fmt)
+
 
     __all__ = ['AgentRepository', 'DomainRepository', 'FactRepository', 'RuleRepository', 'StatisticsRepository']
\ No newline at end of file
@@ -0,0 +1,342 @@
+import json
+import sqlite3
+from typing import Dict, List, Iterable
+
+from core.inference_engine import InferenceEngine
+from core.metrics import instrument_repository
+from database.rule_rows import rules_from_rows
+
+
+def write_rule_dependencies(cursor: sqlite3.Cursor, rules: Iterable[Dict]):
+    """
+    Запись переменных, которые правила читают и записывают
+
+    Вызывается в транзакции сохранения правил; при удалении правила
+    его строки удаляются каскадно.
+    """
+    reads = []
+    writes = []
+    for rule in rules:
+        text = {'condition': str(rule.get('condition') or ''), 'action': str(rule.get('action') or '')}
+        reads.extend((variable, rule['id']) for variable in InferenceEngine.read_variables(text))
+        target = InferenceEngine.action_target(text['action'])
+        if target:
+            writes.append((target, rule['id']))
+
+    cursor.executemany('INSERT OR IGNORE INTO rule_reads (variable, rule_id) VALUES (?, ?)', reads)
+    cursor.executemany('INSERT OR IGNORE INTO rule_writes (variable, rule_id) VALUES (?, ?)', writes)
+
+
+@instrument_repository
+class DependencyRepository:
+    """Граф зависимостей правил: переменная -> читающие и записывающие правила"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Создание соединения с БД"""
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row  # Для доступа по имени столбцов
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def rebuild_dependencies(self, batch_size: int = 10000) -> int:
+        """
+        Полное перестроение индекса по всем правилам
+
+        Returns:
+            Количество проиндексированных правил
+        """
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute('DELETE FROM rule_reads')
+            cursor.execute('DELETE FROM rule_writes')
+
+            count = 0
+            rows = conn.execute('SELECT id, condition, action FROM rules')
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    break
+                write_rule_dependencies(cursor, [dict(row) for row in batch])
+                count += len(batch)
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO kb_meta (key, value) VALUES ('rule_dependencies', 1)
+                ''')
+
+            conn.commit()
+            conn.close()
+            return count
+
+        except sqlite3.Error as e:
+            print(f"Ошибка перестроения зависимостей правил: {e}")
+            return 0
+
+    def is_built(self) -> bool:
+        """Построен ли индекс для существующих правил"""
+        try:
+            conn = self._get_connection()
+            row = conn.execute("SELECT value FROM kb_meta WHERE key = 'rule_dependencies'").fetchone()
+            conn.close()
+            return row is not None
+
+        except sqlite3.Error as e:
+            print(f"Ошибка проверки индекса зависимостей: {e}")
+            return False
+
+    def _rules_for_variable(self, table: str, variable: str, agent_id: str = None) -> List[Dict]:
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            query = f'''
+                SELECT r.* FROM {table} d
+                JOIN rules r ON r.id = d.rule_id
+                WHERE d.variable = ?
+                '''
+            params = [variable]
+            if agent_id:
+                query += ' AND r.agent_id = ?'
+                params.append(agent_id)
+            query += ' ORDER BY r.priority DESC, r.created_at DESC'
+
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            conn.close()
+
+            return rules_from_rows(rows)
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения правил по переменной: {e}")
+            return []
+
+    def get_rules_reading(self, variable: str, agent_id: str = None) -> List[Dict]:
+        """Правила, условие или действие которых читает переменную"""
+        return self._rules_for_variable('rule_reads', variable, agent_id)
+
+    def get_rules_writing(self, variable: str, agent_id: str = None) -> List[Dict]:
+        """Правила, действие которых присваивает значение переменной"""
+        return self._rules_for_variable('rule_writes', variable, agent_id)
+
+    def get_rule_dependencies(self, rule_id: str) -> Dict:
+        """Переменные, которые правило читает и записывает"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT variable FROM rule_reads WHERE rule_id = ? ORDER BY variable',
+                           (rule_id,))
+            reads = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT variable FROM rule_writes WHERE rule_id = ? ORDER BY variable',
+                           (rule_id,))
+            writes = [row[0] for row in cursor.fetchall()]
+
+            conn.close()
+            return {'reads': reads, 'writes': writes}
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения зависимостей правила: {e}")
+            return {'reads': [], 'writes': []}
+
+    def get_supporting_rules(self, goal: str, agent_id: str = None,
+                             max_depth: int = 50) -> List[Dict]:
+        """
+        Правила, от которых транзитивно зависит вывод цели
+
+        Returns:
+            [{'rule_id', 'variable', 'depth'}] - правило записывает variable,
+            нужную на глубине depth (1 - сама цель)
+        """
+        agent_filter = 'AND r.agent_id = :agent_id' if agent_id else ''
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute(f'''
+                WITH RECURSIVE needed(variable, depth) AS (
+                    SELECT :goal, 1
+                    UNION
+                    SELECT rd.variable, n.depth + 1
+                    FROM needed n
+                    JOIN rule_writes w ON w.variable = n.variable
+                    JOIN rules r ON r.id = w.rule_id {agent_filter}
+                    JOIN rule_reads rd ON rd.rule_id = w.rule_id
+                    WHERE n.depth < :max_depth
+                )
+                SELECT w.rule_id, w.variable, MIN(n.depth) AS depth
+                FROM needed n
+                JOIN rule_writes w ON w.variable = n.variable
+                JOIN rules r ON r.id = w.rule_id {agent_filter}
+                GROUP BY w.rule_id, w.variable
+                ORDER BY depth, w.variable
+                ''', {'goal': goal, 'agent_id': agent_id, 'max_depth': max_depth})
+            rows = cursor.fetchall()
+            conn.close()
+
+            return [dict(row) for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска зависимостей цели: {e}")
+            return []
+
+    def get_input_variables(self, goal: str, agent_id: str = None,
+                            max_depth: int = 50) -> List[str]:
+        """Переменные, которые нужны для вывода цели, но не выводятся правилами"""
+        supporting = self.get_supporting_rules(goal, agent_id, max_depth)
+        if not supporting:
+            return []
+
+        rule_ids = json.dumps(sorted({row['rule_id'] for row in supporting}))
+        agent_filter = 'AND r.agent_id = ?' if agent_id else ''
+        params = [rule_ids] + ([agent_id] if agent_id else [])
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute(f'''
+                SELECT DISTINCT rd.variable FROM rule_reads rd
+                WHERE rd.rule_id IN (SELECT value FROM json_each(?))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM rule_writes w
+                      JOIN rules r ON r.id = w.rule_id {agent_filter}
+                      WHERE w.variable = rd.variable
+                  )
+                ORDER BY rd.variable
+                ''', params)
+            variables = [row[0] for row in cursor.fetchall()]
+
+            conn.close()
+            return variables
+
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска входных переменных: {e}")
+            return []
+
+    def get_dependency_edges(self, agent_id: str = None) -> List[Dict]:
+        """Ребра графа правил: правило from_rule записывает переменную, которую читает to_rule"""
+        agent_filter = 'WHERE a.agent_id = :agent_id AND b.agent_id = :agent_id' if agent_id else ''
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute(f'''
+                SELECT w.rule_id AS from_rule, rd.rule_id AS to_rule, w.variable
+                FROM rule_writes w
+                JOIN rule_reads rd ON rd.variable = w.variable
+                JOIN rules a ON a.id = w.rule_id
+                JOIN rules b ON b.id = rd.rule_id
+                {agent_filter}
+                ''', {'agent_id': agent_id})
+            rows = cursor.fetchall()
+            conn.close()
+
+            return [dict(row) for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения графа зависимостей: {e}")
+            return []
+
+    def find_dependency_cycles(self, agent_id: str = None) -> List[List[str]]:
+        """
+        Циклы в графе правил (компоненты сильной связности)
+
+        Граф строится по переменным: переменная -> читающие ее правила,
+        правило -> записываемая переменная. Он линеен по числу строк индекса,
+        тогда как прямых ребер между правилами может быть квадратично много.
+
+        Returns:
+            Списки ID правил, которые зависят друг от друга по кругу
+        """
+        agent_filter = 'WHERE r.agent_id = ?' if agent_id else ''
+        params = (agent_id,) if agent_id else ()
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            graph = {}
+            cursor.execute(f'''
+                SELECT d.variable, d.rule_id FROM rule_reads d
+                JOIN rules r ON r.id = d.rule_id {agent_filter}
+                ''', params)
+            for variable, rule_id in cursor.fetchall():
+                graph.setdefault(('variable', variable), set()).add(('rule', rule_id))
+
+            cursor.execute(f'''
+                SELECT d.variable, d.rule_id FROM rule_writes d
+                JOIN rules r ON r.id = d.rule_id {agent_filter}
+                ''', params)
+            for variable, rule_id in cursor.fetchall():
+                graph.setdefault(('rule', rule_id), set()).add(('variable', variable))
+
+            conn.close()
+
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска циклов зависимостей: {e}")
+            return []
+
+        # Компонента из одной вершины циклом быть не может: петель в двудольном графе нет
+        return [sorted(node for kind, node in component if kind == 'rule')
+                for component in _strongly_connected(graph) if len(component) > 1]
+
+
+def _strongly_connected(graph: Dict[str, set]) -> List[List[str]]:
+    """Алгоритм Тарьяна без рекурсии"""
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in graph:
+        if root in index:
+            continue
+
+        work = [(root, iter(graph.get(root, ())))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(graph.get(child, ()))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+    return components
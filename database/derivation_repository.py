@@ -0,0 +1,207 @@
+import json
+import sqlite3
+from typing import Dict, Optional, List
+
+from core.metrics import instrument_repository
+
+
+@instrument_repository
+class DerivationRepository:
+    """Хранение выведенных фактов и их обоснований"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Создание соединения с БД"""
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row  # Для доступа по имени столбцов
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def get_derivation_inputs(self, agent_id: str) -> Optional[Dict]:
+        """
+        Исходные факты и правила, учтенные при последнем выводе агента
+
+        Returns:
+            {'facts': {fact_id: variable_name}, 'rules': {rule_id, ...}}
+            или None, если инкрементальный вывод для агента не выполнялся
+        """
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT kind, item_id, variable_name FROM derivation_inputs
+                WHERE agent_id = ?
+                ''', (agent_id,))
+            rows = cursor.fetchall()
+
+            cursor.execute('SELECT 1 FROM derivation_state WHERE agent_id = ?', (agent_id,))
+            known = cursor.fetchone() is not None
+            conn.close()
+
+            if not known:
+                return None
+
+            return {
+                'facts': {row['item_id']: row['variable_name'] for row in rows if row['kind'] == 'fact'},
+                'rules': {row['item_id'] for row in rows if row['kind'] == 'rule'},
+            }
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения состояния вывода: {e}")
+            return None
+
+    def get_justifications(self, agent_id: str) -> Dict[str, Dict]:
+        """
+        Обоснования выведенных фактов агента
+
+        Returns:
+            fact_id -> {'rule_id', 'supports': [переменные опор]}
+        """
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT fact_id, rule_id FROM fact_justifications
+                WHERE agent_id = ?
+                ''', (agent_id,))
+            justifications = {row['fact_id']: {'rule_id': row['rule_id'], 'supports': []}
+                              for row in cursor.fetchall()}
+
+            cursor.execute('''
+                SELECT s.fact_id, s.support_variable FROM fact_supports s
+                JOIN fact_justifications j ON j.fact_id = s.fact_id
+                WHERE j.agent_id = ?
+                ORDER BY s.fact_id, s.support_variable
+                ''', (agent_id,))
+            for row in cursor.fetchall():
+                justifications[row['fact_id']]['supports'].append(row['support_variable'])
+
+            conn.close()
+            return justifications
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения обоснований: {e}")
+            return {}
+
+    def get_fact_provenance(self, fact_id: str) -> Optional[Dict]:
+        """Правило и опорные факты, из которых выведен факт"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT j.fact_id, j.rule_id, j.created_at, r.name AS rule_name,
+                       r.condition, r.action
+                FROM fact_justifications j
+                LEFT JOIN rules r ON r.id = j.rule_id
+                WHERE j.fact_id = ?
+                ''', (fact_id,))
+            row = cursor.fetchone()
+            if not row:
+                conn.close()
+                return None
+
+            provenance = dict(row)
+            cursor.execute('''
+                SELECT support_fact_id, support_variable FROM fact_supports
+                WHERE fact_id = ?
+                ORDER BY support_variable
+                ''', (fact_id,))
+            provenance['supports'] = [dict(r) for r in cursor.fetchall()]
+
+            conn.close()
+            return provenance
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения обоснования факта: {e}")
+            return None
+
+    def save_derivations(self, agent_id: str, domain_id: Optional[str], added: List[Dict],
+                         removed_ids: List[str], inputs_added: List[Dict],
+                         inputs_removed: List[Dict]) -> bool:
+        """
+        Сохранение результата инкрементального вывода в одной транзакции
+
+        Args:
+            added: Новые выведенные факты с обоснованием
+            removed_ids: ID снятых выведенных фактов
+            inputs_added: Учтенные исходные данные {'kind', 'item_id', 'variable_name'}
+            inputs_removed: Исходные данные, которых больше нет {'kind', 'item_id'}
+        """
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            # Снятые выводы: обоснования удаляются каскадно
+            if removed_ids:
+                cursor.execute('''
+                    SELECT domain_id, COUNT(*) FROM facts
+                    WHERE id IN (SELECT value FROM json_each(?)) AND domain_id IS NOT NULL
+                    GROUP BY domain_id
+                    ''', (json.dumps(list(removed_ids)),))
+                domain_counts = cursor.fetchall()
+
+                cursor.execute('''
+                    DELETE FROM facts WHERE id IN (SELECT value FROM json_each(?))
+                    ''', (json.dumps(list(removed_ids)),))
+
+                cursor.executemany('''
+                    UPDATE domains
+                    SET facts_count = facts_count - ?
+                    WHERE id = ?
+                    ''', [(count, domain) for domain, count in domain_counts])
+
+            cursor.executemany('''
+                INSERT INTO facts (
+                    id, variable_name, value, confidence,
+                    source_file, author, is_derived, agent_id, domain_id
+                ) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+                ''', [(fact['id'], fact['variable'], str(fact['value']),
+                       fact.get('confidence', 1.0), '', 'inference', agent_id, domain_id)
+                      for fact in added])
+
+            cursor.executemany('''
+                INSERT INTO fact_justifications (fact_id, rule_id, agent_id)
+                VALUES (?, ?, ?)
+                ''', [(fact['id'], fact['rule_id'], agent_id) for fact in added])
+
+            cursor.executemany('''
+                INSERT INTO fact_supports (fact_id, support_fact_id, support_variable)
+                VALUES (?, ?, ?)
+                ''', [(fact['id'], support['fact_id'], support['variable'])
+                      for fact in added for support in fact['supports']])
+
+            if domain_id and added:
+                cursor.execute('''
+                    UPDATE domains
+                    SET facts_count = facts_count + ?
+                    WHERE id = ?
+                    ''', (len(added), domain_id))
+
+            cursor.executemany('''
+                DELETE FROM derivation_inputs WHERE agent_id = ? AND kind = ? AND item_id = ?
+                ''', [(agent_id, item['kind'], item['item_id']) for item in inputs_removed])
+
+            cursor.executemany('''
+                INSERT OR REPLACE INTO derivation_inputs (agent_id, kind, item_id, variable_name)
+                VALUES (?, ?, ?, ?)
+                ''', [(agent_id, item['kind'], item['item_id'], item.get('variable_name'))
+                      for item in inputs_added])
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO derivation_state (agent_id, updated_at)
+                VALUES (?, CURRENT_TIMESTAMP)
+                ''', (agent_id,))
+
+            conn.commit()
+            conn.close()
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Ошибка сохранения выведенных фактов: {e}")
+            return False
@@ -2,7 +2,10 @@ import sqlite3
 import uuid
 from typing import Optional, Dict, List
 
+from core.metrics import instrument_repository
 
+
+@instrument_repository
 class DomainRepository:
     """CRUD операции для доменов"""
 
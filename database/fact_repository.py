@@ -2,7 +2,10 @@ import sqlite3
 import uuid
 from typing import Dict, Optional, List
 
+from core.metrics import instrument_repository
 
+
+@instrument_repository
 class FactRepository:
     """CRUD операции для фактов"""
 
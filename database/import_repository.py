@@ -0,0 +1,389 @@
+import json
+import sqlite3
+import uuid
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from core.metrics import instrument_repository, metrics
+from core.tokenizer import rule_fingerprint
+from database.dependency_repository import write_rule_dependencies
+from database.signature_repository import write_rule_signatures
+
+# Столбцы, переносимые при импорте; счетчики доменов растут на число вставленных записей
+DOMAIN_COLUMNS = ('id', 'name', 'description', 'created_at')
+AGENT_COLUMNS = ('id', 'name', 'domain_id', 'description', 'created_at')
+RULE_COLUMNS = ('id', 'name', 'condition', 'action', 'rule_type', 'priority', 'confidence',
+                'source_file', 'author', 'tags', 'agent_id', 'domain_id', 'created_at',
+                'fingerprint')
+FACT_COLUMNS = ('id', 'variable_name', 'value', 'confidence', 'source_file', 'author',
+                'is_derived', 'agent_id', 'domain_id', 'created_at')
+
+SECTIONS = ('domains', 'agents', 'rules', 'facts')
+
+
+def empty_summary() -> Dict[str, Dict[str, int]]:
+    return {section: {'inserted': 0, 'updated': 0, 'skipped': 0} for section in SECTIONS}
+
+
+def _same(stored, incoming) -> bool:
+    """Совпадение значения из БД и из файла (CSV и JSON теряют типы)"""
+    if stored == incoming:
+        return True
+    if stored is None or incoming is None:
+        return stored in (None, '') and incoming in (None, '')
+    try:
+        return float(stored) == float(incoming)
+    except (TypeError, ValueError):
+        return str(stored) == str(incoming)
+
+
+def _value(record: Dict, key: str, default):
+    """Значение поля; пустое (None, пустая ячейка CSV) заменяется значением по умолчанию"""
+    value = record.get(key)
+    return default if value is None or value == '' else value
+
+
+def _tags_json(tags) -> str:
+    if isinstance(tags, list):
+        return json.dumps(tags, ensure_ascii=False)
+    return tags or ''
+
+
+@instrument_repository
+class ImportRepository:
+    """
+    Идемпотентный импорт базы знаний
+
+    Записи сопоставляются с сохраненными по ID (правила еще и по
+    отпечатку): новые вставляются, измененные обновляются через
+    INSERT ... ON CONFLICT(id) DO UPDATE, совпадающие пропускаются.
+    Повторный импорт того же файла ничего не меняет. Весь импорт идет
+    одной транзакцией пачками executemany.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Создание соединения с БД"""
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row  # Для доступа по имени столбцов
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def import_data(self, data: Dict, batch_size: int = 10000) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        Импорт словаря с разделами domains, agents, rules, facts
+
+        Returns:
+            Количество вставленных, обновленных и пропущенных записей по
+            разделам или None при ошибке (изменения откатываются)
+        """
+        return self.import_stream(((section, data.get(section) or []) for section in SECTIONS),
+                                  batch_size)
+
+    def import_stream(self, batches: Iterable[Tuple[str, List[Dict]]],
+                      batch_size: int = 10000) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        Импорт пачек (раздел, записи) одной транзакцией
+
+        Пачки разделов идут в порядке внешних ключей: домены, агенты,
+        затем правила и факты. Итоги - как у import_data.
+        """
+        conn = self._get_connection()
+        try:
+            summary = self.import_batches(conn.cursor(), batches, batch_size)
+            conn.commit()
+
+            if metrics.enabled:
+                for section, counts in summary.items():
+                    for outcome, count in counts.items():
+                        metrics.increment(f'db.import.{section}.{outcome}', count)
+            return summary
+
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка импорта: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def import_rows(self, cursor: sqlite3.Cursor, data: Dict,
+                    batch_size: int = 10000) -> Dict[str, Dict[str, int]]:
+        """Импорт в уже открытой транзакции (без фиксации)"""
+        return self.import_batches(cursor, ((section, data.get(section) or []) for section in SECTIONS),
+                                   batch_size)
+
+    def import_batches(self, cursor: sqlite3.Cursor, batches: Iterable[Tuple[str, List[Dict]]],
+                       batch_size: int = 10000) -> Dict[str, Dict[str, int]]:
+        """Импорт пачек в уже открытой транзакции (без фиксации)"""
+        summary = empty_summary()
+        domain_map = _DomainMap(cursor, {})
+        importers = {
+            'agents': self._import_agents,
+            'rules': self._import_rules,
+            'facts': self._import_facts,
+        }
+        for section, records in batches:
+            if section == 'domains':
+                domain_map.update(self._import_domains(cursor, records, summary['domains'], batch_size))
+            elif section in importers:
+                importers[section](cursor, records, domain_map, summary[section], batch_size)
+        return summary
+
+    # Общие шаги
+
+    @staticmethod
+    def _unique(records: List[Dict]) -> List[Dict]:
+        """Записи без повторов ID (остается последняя)"""
+        return list({record['id']: record for record in records}.values())
+
+    @staticmethod
+    def _existing(cursor: sqlite3.Cursor, table: str, columns: Sequence[str],
+                  ids: List[str], batch_size: int) -> Dict[str, sqlite3.Row]:
+        """Сохраненные строки с указанными ID"""
+        rows = {}
+        for start in range(0, len(ids), batch_size):
+            for row in cursor.execute(f'''
+                    SELECT {', '.join(columns)} FROM {table}
+                    WHERE id IN (SELECT value FROM json_each(?))
+                    ''', (json.dumps(ids[start:start + batch_size]),)):
+                rows[row['id']] = row
+        return rows
+
+    @staticmethod
+    def _existing_ids(cursor: sqlite3.Cursor, table: str, ids) -> set:
+        return {row[0] for row in cursor.execute(
+            f'SELECT id FROM {table} WHERE id IN (SELECT value FROM json_each(?))',
+            (json.dumps(sorted(ids)),))}
+
+    @staticmethod
+    def _upsert(cursor: sqlite3.Cursor, table: str, columns: Sequence[str],
+                rows: List[Dict], batch_size: int):
+        """INSERT ... ON CONFLICT(id) DO UPDATE пачками; created_at не перезаписывается"""
+        values = ', '.join(f'COALESCE(:{column}, CURRENT_TIMESTAMP)' if column == 'created_at'
+                           else f':{column}' for column in columns)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns
+                            if column not in ('id', 'created_at'))
+        sql = f'''
+            INSERT INTO {table} ({', '.join(columns)}) VALUES ({values})
+            ON CONFLICT(id) DO UPDATE SET {updates}
+            '''
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[start:start + batch_size])
+
+    @staticmethod
+    def _classify(rows: List[Dict], existing: Dict[str, sqlite3.Row],
+                  columns: Sequence[str], counts: Dict[str, int]) -> List[Dict]:
+        """Новые и измененные строки; совпадающие с сохраненными пропускаются"""
+        changed = []
+        for row in rows:
+            stored = existing.get(row['id'])
+            if stored is None:
+                counts['inserted'] += 1
+            elif any(not _same(stored[column], row[column]) for column in columns
+                     if column not in ('id', 'created_at')):
+                counts['updated'] += 1
+            else:
+                counts['skipped'] += 1
+                continue
+            changed.append(row)
+        return changed
+
+    @staticmethod
+    def _domain_deltas(changed: List[Dict], existing: Dict[str, sqlite3.Row]) -> Counter:
+        """
+        Изменение счетчиков доменов: новая строка добавляется к своему
+        домену, обновленная с другим domain_id переходит из старого в новый
+        """
+        deltas = Counter()
+        for row in changed:
+            stored = existing.get(row['id'])
+            if stored is None:
+                deltas[row['domain_id']] += 1
+            elif not _same(stored['domain_id'], row['domain_id']):
+                deltas[stored['domain_id']] -= 1
+                deltas[row['domain_id']] += 1
+        return deltas
+
+    @staticmethod
+    def _increment_counters(cursor: sqlite3.Cursor, counter: str, domain_ids: Counter):
+        cursor.executemany(f'UPDATE domains SET {counter} = {counter} + ? WHERE id = ?',
+                           [(count, domain_id) for domain_id, count in domain_ids.items()
+                            if domain_id and count])
+
+    @staticmethod
+    def _resolve_domain(domain_id, domain_map: Dict[str, Optional[str]]) -> Optional[str]:
+        return domain_map[str(domain_id)] if domain_id else None
+
+    # Разделы
+
+    def _import_domains(self, cursor, records: List[Dict], counts: Dict[str, int],
+                        batch_size: int) -> Dict[str, Optional[str]]:
+        """
+        Импорт доменов
+
+        Returns:
+            ID домена из файла -> ID в БД (домен с тем же именем и другим
+            ID не создается, ссылки на него переводятся на сохраненный)
+        """
+        rows = self._unique([{
+            'id': str(record.get('id') or uuid.uuid4()),
+            'name': record['name'],
+            'description': record.get('description') or '',
+            'created_at': record.get('created_at') or None,
+        } for record in records if record.get('name')])
+
+        existing = self._existing(cursor, 'domains', DOMAIN_COLUMNS, [row['id'] for row in rows], batch_size)
+        by_name = {row['name']: row['id'] for row in cursor.execute(
+            'SELECT id, name FROM domains WHERE name IN (SELECT value FROM json_each(?))',
+            (json.dumps([row['name'] for row in rows]),))}
+
+        domain_map = {}
+        accepted = []
+        for row in rows:
+            owner = by_name.get(row['name'])
+            if row['id'] not in existing and owner is not None:
+                domain_map[row['id']] = owner
+                counts['skipped'] += 1
+                continue
+            by_name[row['name']] = row['id']
+            domain_map[row['id']] = row['id']
+            accepted.append(row)
+
+        self._upsert(cursor, 'domains', DOMAIN_COLUMNS,
+                     self._classify(accepted, existing, DOMAIN_COLUMNS, counts), batch_size)
+
+        return domain_map
+
+    def _import_agents(self, cursor, records: List[Dict], domain_map, counts: Dict[str, int],
+                       batch_size: int):
+        rows = self._unique([{
+            'id': str(record.get('id') or f"agent_{uuid.uuid4().hex[:8]}"),
+            'name': record['name'],
+            'domain_id': self._resolve_domain(record.get('domain_id'), domain_map),
+            'description': record.get('description') or '',
+            'created_at': record.get('created_at') or None,
+        } for record in records if record.get('name')])
+
+        existing = self._existing(cursor, 'agents', AGENT_COLUMNS, [row['id'] for row in rows], batch_size)
+        changed = self._classify(rows, existing, AGENT_COLUMNS, counts)
+        self._upsert(cursor, 'agents', AGENT_COLUMNS, changed, batch_size)
+        self._increment_counters(cursor, 'agents_count', self._domain_deltas(changed, existing))
+
+    def _import_rules(self, cursor, records: List[Dict], domain_map, counts: Dict[str, int],
+                      batch_size: int):
+        rows = []
+        for record in records:
+            if not record.get('condition') or not record.get('action') or not record.get('agent_id'):
+                counts['skipped'] += 1
+                continue
+            row = {
+                'id': str(record.get('id') or uuid.uuid4()),
+                'name': record.get('name') or '',
+                'condition': str(record['condition']),
+                'action': str(record['action']),
+                'rule_type': record.get('rule_type') or 'conditional',
+                'priority': _value(record, 'priority', 1),
+                'confidence': _value(record, 'confidence', 1.0),
+                'source_file': record.get('source_file') or '',
+                'author': record.get('author') or 'system',
+                'tags': _tags_json(record.get('tags', [])),
+                'agent_id': str(record['agent_id']),
+                'domain_id': self._resolve_domain(record.get('domain_id'), domain_map),
+                'created_at': record.get('created_at') or None,
+            }
+            row['fingerprint'] = rule_fingerprint(row)
+            rows.append(row)
+        rows = self._unique(rows)
+
+        rows = self._with_known_agents(cursor, rows, counts)
+        existing = self._existing(cursor, 'rules', RULE_COLUMNS, [row['id'] for row in rows], batch_size)
+
+        # Отпечаток занят другим правилом - в БД или раньше в файле
+        owners = {}
+        for start in range(0, len(rows), batch_size):
+            owners.update((row[0], row[1]) for row in cursor.execute(
+                'SELECT fingerprint, id FROM rules WHERE fingerprint IN (SELECT value FROM json_each(?))',
+                (json.dumps([row['fingerprint'] for row in rows[start:start + batch_size]]),)))
+        accepted = []
+        for row in rows:
+            owner = owners.setdefault(row['fingerprint'], row['id'])
+            if owner != row['id']:
+                counts['skipped'] += 1
+                continue
+            accepted.append(row)
+
+        changed = self._classify(accepted, existing, RULE_COLUMNS, counts)
+        inserted = [row for row in changed if row['id'] not in existing]
+        updated = [row for row in changed if row['id'] in existing]
+
+        self._upsert(cursor, 'rules', RULE_COLUMNS, changed, batch_size)
+
+        # Триггеры сбрасывают отпечаток и сигнатуры при обновлении текста
+        # правила; восстанавливаем их и пересчитываем зависимости
+        cursor.executemany('UPDATE rules SET fingerprint = ? WHERE id = ?',
+                           [(row['fingerprint'], row['id']) for row in updated])
+        rewritten = [row for row in updated
+                     if not _same(existing[row['id']]['condition'], row['condition'])
+                     or not _same(existing[row['id']]['action'], row['action'])]
+        for table in ('rule_reads', 'rule_writes'):
+            cursor.executemany(f'DELETE FROM {table} WHERE rule_id = ?', [(row['id'],) for row in rewritten])
+        write_rule_dependencies(cursor, inserted + rewritten)
+        write_rule_signatures(cursor, changed)
+
+        self._increment_counters(cursor, 'rules_count', self._domain_deltas(changed, existing))
+
+    def _import_facts(self, cursor, records: List[Dict], domain_map, counts: Dict[str, int],
+                      batch_size: int):
+        rows = []
+        for record in records:
+            if not record.get('variable_name') or record.get('value') is None or not record.get('agent_id'):
+                counts['skipped'] += 1
+                continue
+            rows.append({
+                'id': str(record.get('id') or uuid.uuid4()),
+                'variable_name': record['variable_name'],
+                'value': str(record['value']),
+                'confidence': _value(record, 'confidence', 1.0),
+                'source_file': record.get('source_file') or '',
+                'author': record.get('author') or 'system',
+                'is_derived': 1 if record.get('is_derived') in (True, 1, '1', 'true', 'True') else 0,
+                'agent_id': str(record['agent_id']),
+                'domain_id': self._resolve_domain(record.get('domain_id'), domain_map),
+                'created_at': record.get('created_at') or None,
+            })
+        rows = self._with_known_agents(cursor, self._unique(rows), counts)
+
+        existing = self._existing(cursor, 'facts', FACT_COLUMNS, [row['id'] for row in rows], batch_size)
+        changed = self._classify(rows, existing, FACT_COLUMNS, counts)
+        self._upsert(cursor, 'facts', FACT_COLUMNS, changed, batch_size)
+        self._increment_counters(cursor, 'facts_count', self._domain_deltas(changed, existing))
+
+    def _with_known_agents(self, cursor, rows: List[Dict], counts: Dict[str, int]) -> List[Dict]:
+        """Записи агентов, которых нет в БД, пропускаются"""
+        agents = self._existing_ids(cursor, 'agents', {row['agent_id'] for row in rows})
+        known = [row for row in rows if row['agent_id'] in agents]
+        if len(known) < len(rows):
+            print(f"Пропущено записей неизвестных агентов: {len(rows) - len(known)}")
+            counts['skipped'] += len(rows) - len(known)
+        return known
+
+
+class _DomainMap(dict):
+    """
+    Соответствие ID доменов из файла и из БД
+
+    ID, которых нет в файле, проверяются по БД; ссылка на отсутствующий
+    домен заменяется на NULL, как при его удалении.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor, mapping: Dict[str, Optional[str]]):
+        super().__init__(mapping)
+        self._cursor = cursor
+
+    def __missing__(self, domain_id):
+        row = self._cursor.execute('SELECT id FROM domains WHERE id = ?', (domain_id,)).fetchone()
+        self[domain_id] = row[0] if row else None
+        return self[domain_id]
@@ -0,0 +1,43 @@
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+class ReadSnapshotConnection(sqlite3.Connection):
+    """Соединение только для чтения, открытое в транзакции чтения"""
+
+    data_version: int = 0
+
+
+class VersionedList(list):
+    """Результат анализа с ревизией данных, по которой он получен"""
+
+    def __init__(self, items=(), data_version: int = 0):
+        super().__init__(items)
+        self.data_version = data_version
+
+
+@contextmanager
+def read_snapshot(db_path) -> Iterator[ReadSnapshotConnection]:
+    """
+    Согласованное представление БД для долгих чтений
+
+    В режиме WAL транзакция чтения видит данные на момент первого
+    запроса и не мешает записи, которая идет параллельно. Ревизия
+    данных этого момента доступна как conn.data_version.
+    """
+    uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, isolation_level=None,
+                           factory=ReadSnapshotConnection)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute('BEGIN')
+        # Первое чтение фиксирует снимок
+        row = conn.execute("SELECT value FROM kb_meta WHERE key = 'revision'").fetchone()
+        conn.data_version = row[0] if row else 0
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        conn.close()
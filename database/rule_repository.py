@@ -3,7 +3,15 @@ import sqlite3
 import uuid
 from typing import Optional, Dict, List
 
+from core.metrics import instrument_repository, metrics
+from database.dependency_repository import write_rule_dependencies
+from database.read_snapshot import read_snapshot, VersionedList
+from database.rule_rows import parse_tags, rules_from_rows
+from database.signature_repository import write_rule_signatures, pop_rule_signatures
+from core.tokenizer import jaccard, similarity_type, token_signature, rule_fingerprint
 
+
+@instrument_repository
 class RuleRepository:
 
     def __init__(self, db_path):
@@ -17,8 +25,24 @@ class RuleRepository:
         conn.execute("PRAGMA foreign_keys = ON")
         return conn
 
-    def save_rule(self, rule_data: Dict) -> Optional[Dict]:
-        """Сохранение правила"""
+    # Поведение save_rule для правила, которое у агента уже есть
+    DUPLICATE_MODES = ('skip', 'update', 'error')
+
+    def save_rule(self, rule_data: Dict, on_duplicate: str = 'skip') -> Optional[Dict]:
+        """
+        Сохранение правила
+
+        Правила с одинаковым отпечатком (агент и условие с действием с
+        точностью до регистра, пробелов и пунктуации) повторно не
+        сохраняются. on_duplicate:
+            'skip' - возвращается уже сохраненное правило;
+            'update' - у него обновляются название, тип, приоритет,
+                уверенность, источник, автор и теги;
+            'error' - ошибка сохранения, возвращается None.
+        """
+        if on_duplicate not in self.DUPLICATE_MODES:
+            raise ValueError(f"Неизвестный режим дубликатов: {on_duplicate}")
+
         # Проверяем обязательные поля
         required = ['condition', 'action', 'agent_id']
         for field in required:
@@ -37,15 +61,27 @@ class RuleRepository:
         else:
             tags_json = tags or ''
 
+        fingerprint = rule_fingerprint(rule_data)
+        conflict = {
+            'skip': 'ON CONFLICT(fingerprint) DO NOTHING',
+            'update': '''ON CONFLICT(fingerprint) DO UPDATE SET
+                name = excluded.name, rule_type = excluded.rule_type,
+                priority = excluded.priority, confidence = excluded.confidence,
+                source_file = excluded.source_file, author = excluded.author,
+                tags = excluded.tags''',
+            'error': '',
+        }[on_duplicate]
+
+        conn = self._get_connection()
         try:
-            conn = self._get_connection()
             cursor = conn.cursor()
 
-            cursor.execute('''
+            cursor.execute(f'''
                 INSERT INTO rules (
                     id, name, condition, action, rule_type, priority, confidence,
-                    source_file, author, tags, agent_id, domain_id
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    source_file, author, tags, agent_id, domain_id, fingerprint
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                {conflict}
                 ''', (
                 rule_data['id'],
                 rule_data.get('name', ''),
@@ -58,9 +94,25 @@ class RuleRepository:
                 rule_data.get('author', 'system'),
                 tags_json,
                 rule_data['agent_id'],
-                rule_data.get('domain_id')
+                rule_data.get('domain_id'),
+                fingerprint
             ))
 
+            cursor.execute('SELECT id FROM rules WHERE fingerprint = ?', (fingerprint,))
+            rule_id = cursor.fetchone()[0]
+
+            if rule_id != rule_data['id']:
+                # Такое правило уже есть
+                if metrics.enabled:
+                    metrics.increment(f'db.rules.duplicates_{on_duplicate}')
+                conn.commit()
+                return self.get_rule(rule_id)
+
+            # Переменные, которые правило читает и записывает
+            write_rule_dependencies(cursor, [rule_data])
+            # Сигнатуры текста для поиска схожих правил
+            write_rule_signatures(cursor, [rule_data])
+
             # Обновляем счетчик правил в домене
             if rule_data.get('domain_id'):
                 cursor.execute('''
@@ -70,14 +122,104 @@ class RuleRepository:
                     ''', (rule_data['domain_id'],))
 
             conn.commit()
-            conn.close()
-
-            return self.get_rule(rule_data['id'])
 
         except sqlite3.Error as e:
             print(f"Ошибка сохранения правила: {e}")
             return None
 
+        finally:
+            # Соединение с незавершенной транзакцией блокировало бы запись
+            conn.close()
+
+        return self.get_rule(rule_data['id'])
+
+    def fill_fingerprints(self, batch_size: int = 10000) -> int:
+        """
+        Отпечатки для правил, сохраненных до их появления
+
+        Из одинаковых правил отпечаток получает самое раннее, остальные
+        остаются без него (см. delete_duplicate_rules). Проверенная часть
+        таблицы (наибольший rowid) запоминается в kb_meta, поэтому при
+        следующих запусках пересчитываются только правила, добавленные
+        после нее, а не оставшиеся дубликаты.
+
+        Returns:
+            Количество правил, получивших отпечаток
+        """
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            row = conn.execute("SELECT value FROM kb_meta WHERE key = 'rule_fingerprints'").fetchone()
+            checked = row[0] if row else 0
+            last = conn.execute('SELECT IFNULL(MAX(rowid), 0) FROM rules').fetchone()[0]
+            if row is not None and last <= checked:
+                conn.close()
+                return 0
+
+            rows = conn.execute('''
+                SELECT id, condition, action, agent_id FROM rules
+                WHERE fingerprint IS NULL AND rowid > ? AND rowid <= ?
+                ORDER BY created_at, rowid
+                ''', (checked, last)).fetchall()
+
+            count = 0
+            for start in range(0, len(rows), batch_size):
+                for row in rows[start:start + batch_size]:
+                    cursor.execute('UPDATE OR IGNORE rules SET fingerprint = ? WHERE id = ?',
+                                   (rule_fingerprint(dict(row)), row['id']))
+                    count += cursor.rowcount
+                conn.commit()
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO kb_meta (key, value) VALUES ('rule_fingerprints', ?)
+                ''', (max(checked, last),))
+            conn.commit()
+
+            conn.close()
+            return count
+
+        except sqlite3.Error as e:
+            print(f"Ошибка расчета отпечатков правил: {e}")
+            return 0
+
+    def _duplicate_rule_ids(self, conn: sqlite3.Connection) -> List[str]:
+        """Правила без отпечатка, у которых есть сохраненный двойник"""
+        rows = conn.execute('''
+            SELECT id, condition, action, agent_id FROM rules WHERE fingerprint IS NULL
+            ''').fetchall()
+        duplicates = []
+        for row in rows:
+            if conn.execute('SELECT 1 FROM rules WHERE fingerprint = ?',
+                            (rule_fingerprint(dict(row)),)).fetchone():
+                duplicates.append(row['id'])
+        return duplicates
+
+    def count_duplicate_rules(self) -> int:
+        """Количество дубликатов, сохраненных до появления отпечатков"""
+        try:
+            conn = self._get_connection()
+            count = len(self._duplicate_rule_ids(conn))
+            conn.close()
+            return count
+
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска дубликатов правил: {e}")
+            return 0
+
+    def delete_duplicate_rules(self) -> int:
+        """Удаление дубликатов, сохраненных до появления отпечатков"""
+        try:
+            conn = self._get_connection()
+            duplicates = self._duplicate_rule_ids(conn)
+            conn.close()
+
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска дубликатов правил: {e}")
+            return 0
+
+        return self.delete_rules(duplicates)
+
     def get_rule(self, rule_id: str) -> Optional[Dict]:
         """Получение правила по ID"""
         try:
@@ -89,14 +231,7 @@ class RuleRepository:
             conn.close()
 
             if row:
-                rule = dict(row)
-                # Парсим теги из JSON
-                if rule.get('tags'):
-                    try:
-                        rule['tags'] = json.loads(rule['tags'])
-                    except:
-                        rule['tags'] = []
-                return rule
+                return parse_tags(dict(row))
             return None
 
         except sqlite3.Error as e:
@@ -117,17 +252,7 @@ class RuleRepository:
             rows = cursor.fetchall()
             conn.close()
 
-            rules = []
-            for row in rows:
-                rule = dict(row)
-                if rule.get('tags'):
-                    try:
-                        rule['tags'] = json.loads(rule['tags'])
-                    except:
-                        rule['tags'] = []
-                rules.append(rule)
-
-            return rules
+            return rules_from_rows(rows)
 
         except sqlite3.Error as e:
             print(f"Ошибка получения правил: {e}")
@@ -147,17 +272,7 @@ class RuleRepository:
             rows = cursor.fetchall()
             conn.close()
 
-            rules = []
-            for row in rows:
-                rule = dict(row)
-                if rule.get('tags'):
-                    try:
-                        rule['tags'] = json.loads(rule['tags'])
-                    except:
-                        rule['tags'] = []
-                rules.append(rule)
-
-            return rules
+            return rules_from_rows(rows)
 
         except sqlite3.Error as e:
             print(f"Ошибка получения правил: {e}")
@@ -173,17 +288,7 @@ class RuleRepository:
             rows = cursor.fetchall()
             conn.close()
 
-            rules = []
-            for row in rows:
-                rule = dict(row)
-                if rule.get('tags'):
-                    try:
-                        rule['tags'] = json.loads(rule['tags'])
-                    except:
-                        rule['tags'] = []
-                rules.append(rule)
-
-            return rules
+            return rules_from_rows(rows)
 
         except sqlite3.Error as e:
             print(f"Ошибка получения правил: {e}")
@@ -236,57 +341,181 @@ class RuleRepository:
             print(f"Ошибка удаления правила: {e}")
             return False
 
+    def get_rules_by_ids(self, rule_ids: List[str]) -> List[Dict]:
+        """Получение правил по списку полных ID одним запросом"""
+        if not rule_ids:
+            return []
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT * FROM rules
+                WHERE id IN (SELECT value FROM json_each(?))
+                ORDER BY priority DESC, created_at DESC
+                ''', (json.dumps(list(rule_ids)),))
+            rows = cursor.fetchall()
+            conn.close()
+
+            return rules_from_rows(rows)
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения правил: {e}")
+            return []
+
+    def find_rules_by_id_prefix(self, prefix: str, limit: int = 100) -> List[Dict]:
+        """Поиск правил по началу ID (диапазонный запрос по первичному ключу)"""
+        prefix = prefix.rstrip('.')
+        if not prefix:
+            return []
+
+        # Все строки с данным префиксом лежат в диапазоне [prefix, prefix_next)
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT * FROM rules
+                WHERE id >= ? AND id < ?
+                ORDER BY id
+                LIMIT ?
+                ''', (prefix, upper, limit))
+            rows = cursor.fetchall()
+            conn.close()
+
+            return rules_from_rows(rows)
+
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска правил по ID: {e}")
+            return []
+
+    def delete_rules(self, rule_ids: List[str]) -> int:
+        """
+        Удаление набора правил в одной транзакции
+
+        Returns:
+            Количество удаленных правил
+        """
+        if not rule_ids:
+            return 0
+
+        ids_json = json.dumps(list(rule_ids))
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            # Сколько правил уходит из каждого домена
+            cursor.execute('''
+                SELECT domain_id, COUNT(*) FROM rules
+                WHERE id IN (SELECT value FROM json_each(?)) AND domain_id IS NOT NULL
+                GROUP BY domain_id
+                ''', (ids_json,))
+            domain_counts = cursor.fetchall()
+
+            cursor.execute('''
+                DELETE FROM rules WHERE id IN (SELECT value FROM json_each(?))
+                ''', (ids_json,))
+            deleted = cursor.rowcount
+
+            # Обновляем счетчики правил в доменах
+            cursor.executemany('''
+                UPDATE domains
+                SET rules_count = rules_count - ?
+                WHERE id = ?
+                ''', [(count, domain_id) for domain_id, count in domain_counts])
+
+            conn.commit()
+            conn.close()
+
+            return deleted
+
+        except sqlite3.Error as e:
+            print(f"Ошибка удаления правил: {e}")
+            return 0
+
     # Анализ правил
 
-    def find_similar_rules(self, agent_id: str = None, threshold: float = 0.7) -> List[Dict]:
-        """Поиск схожих правил"""
-        # Получаем правила для анализа
-        if agent_id:
-            rules = self.get_rules_by_agent(agent_id)
-        else:
-            rules = self.get_all_rules()
+    def _read_rules_for_analysis(self, agent_id: str = None, lemmas: bool = False):
+        """Правила, их сигнатуры (условие, действие) и ревизия данных, которую они отражают"""
+        try:
+            with read_snapshot(self.db_path) as conn:
+                query = '''
+                    SELECT r.*, s.condition_tokens, s.action_tokens,
+                           s.condition_lemmas, s.action_lemmas
+                    FROM rules r
+                    LEFT JOIN rule_signatures s ON s.rule_id = r.id
+                    '''
+                if agent_id:
+                    rows = conn.execute(query + '''
+                        WHERE r.agent_id = ?
+                        ORDER BY r.priority DESC, r.created_at DESC
+                        ''', (agent_id,)).fetchall()
+                else:
+                    rows = conn.execute(query + 'ORDER BY r.created_at DESC').fetchall()
+                data_version = conn.data_version
 
-        similar_pairs = []
+            rules = []
+            signatures = []
+            for row in rows:
+                rule = dict(row)
+                signatures.append(pop_rule_signatures(rule, lemmas))
+                rules.append(parse_tags(rule))
+
+            return rules, signatures, data_version
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения правил: {e}")
+            return [], [], 0
+
+    def find_similar_rules(self, agent_id: str = None, threshold: float = 0.7,
+                           lemmas: bool = False) -> List[Dict]:
+        """
+        Поиск схожих правил
+
+        Сравниваются сохраненные сигнатуры токенов условий (lemmas=True -
+        сигнатуры основ слов, без учета словоформ).
+        """
+        # Правила для анализа читаются из снимка БД
+        rules, signatures, data_version = self._read_rules_for_analysis(agent_id, lemmas)
+
+        similar_pairs = VersionedList(data_version=data_version)
 
         # Попарное сравнение
         for i in range(len(rules)):
+            condition1, action1 = signatures[i]
             for j in range(i + 1, len(rules)):
-                similarity = self._calculate_similarity(
-                    rules[i]['condition'], rules[j]['condition']
-                )
+                condition2, action2 = signatures[j]
+                similarity = jaccard(condition1, condition2)
 
                 if similarity >= threshold:
                     similar_pairs.append({
                         'rule1': rules[i],
                         'rule2': rules[j],
                         'similarity': similarity,
-                        'type': self._determine_similarity_type(
-                            rules[i], rules[j]
-                        )
+                        'type': similarity_type(similarity, jaccard(action1, action2))
                     })
 
         return similar_pairs
 
     def find_conflicting_rules(self, agent_id: str = None) -> List[Dict]:
         """Поиск конфликтных правил"""
-        # Получаем правила для анализа
-        if agent_id:
-            rules = self.get_rules_by_agent(agent_id)
-        else:
-            rules = self.get_all_rules()
+        # Правила для анализа читаются из снимка БД
+        rules, signatures, data_version = self._read_rules_for_analysis(agent_id)
 
-        conflicting_pairs = []
+        conflicting_pairs = VersionedList(data_version=data_version)
 
         # Попарное сравнение
         for i in range(len(rules)):
+            rule1 = rules[i]
             for j in range(i + 1, len(rules)):
-                rule1 = rules[i]
                 rule2 = rules[j]
 
                 # Проверяем схожесть условий
-                condition_sim = self._calculate_similarity(
-                    rule1['condition'], rule2['condition']
-                )
+                condition_sim = jaccard(signatures[i][0], signatures[j][0])
 
                 # Если условия схожи, но действия разные - конфликт
                 if condition_sim > 0.8 and rule1['action'] != rule2['action']:
@@ -300,40 +529,8 @@ class RuleRepository:
         return conflicting_pairs
 
     def _calculate_similarity(self, text1: str, text2: str) -> float:
-        """Вычисление схожести текстов"""
-        if not text1 or not text2:
-            return 0.0
-
-        # Приводим к нижнему регистру
-        text1 = text1.lower()
-        text2 = text2.lower()
-
-        # Разбиваем на слова
-        words1 = set(text1.split())
-        words2 = set(text2.split())
-
-        if not words1 or not words2:
-            return 0.0
-
-        # Коэффициент Жаккара
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
-
-        return len(intersection) / len(union)
-
-    def _determine_similarity_type(self, rule1: Dict, rule2: Dict) -> str:
-        """Определение типа схожести"""
-        cond_sim = self._calculate_similarity(rule1['condition'], rule2['condition'])
-        act_sim = self._calculate_similarity(rule1['action'], rule2['action'])
-
-        if cond_sim > 0.8 and act_sim > 0.8:
-            return 'identical'
-        elif cond_sim > 0.8:
-            return 'same_condition'
-        elif act_sim > 0.8:
-            return 'same_action'
-        else:
-            return 'partial'
+        """Вычисление схожести текстов (коэффициент Жаккара по токенам)"""
+        return jaccard(frozenset(token_signature(text1)), frozenset(token_signature(text2)))
 
     def search_rules(self, query: str, agent_ids: List[str] = None) -> List[Dict]:
         """Поиск правил по тексту"""
@@ -365,17 +562,7 @@ class RuleRepository:
             rows = cursor.fetchall()
             conn.close()
 
-            rules = []
-            for row in rows:
-                rule = dict(row)
-                if rule.get('tags'):
-                    try:
-                        rule['tags'] = json.loads(rule['tags'])
-                    except:
-                        rule['tags'] = []
-                rules.append(rule)
-
-            return rules
+            return rules_from_rows(rows)
 
         except sqlite3.Error as e:
             print(f"Ошибка поиска правил: {e}")
@@ -0,0 +1,19 @@
+"""Словари правил из строк таблицы rules"""
+import json
+from typing import Dict, Iterable, List
+
+
+def parse_tags(rule: Dict) -> Dict:
+    """Теги правила из JSON; нечитаемые теги заменяются пустым списком"""
+    tags = rule.get('tags')
+    if tags and isinstance(tags, str):
+        try:
+            rule['tags'] = json.loads(tags)
+        except ValueError:
+            rule['tags'] = []
+    return rule
+
+
+def rules_from_rows(rows: Iterable) -> List[Dict]:
+    """Правила из строк rules (sqlite3.Row или словарей) с разобранными тегами"""
+    return [parse_tags(dict(row)) for row in rows]
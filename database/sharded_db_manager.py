@@ -0,0 +1,841 @@
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from core.kb_snapshot import KnowledgeBaseSnapshot
+from database.change_log_repository import CHANGE_TABLES
+from database.db_manager import DatabaseManager
+from database.import_repository import empty_summary
+from database.read_snapshot import VersionedList
+from database.rule_rows import rules_from_rows
+from database.signature_repository import read_rule_signatures
+
+
+# Сколько файлов SQLite подключает к одному соединению по умолчанию (SQLITE_MAX_ATTACHED)
+ATTACH_LIMIT = 10
+
+
+def open_database(db_path: str = None, **kwargs) -> DatabaseManager:
+    """
+    Открытие базы знаний в том режиме хранения, в котором она создана
+
+    Если хотя бы одна предметная область вынесена в отдельный файл,
+    возвращается ShardedDatabaseManager, иначе - обычный DatabaseManager.
+    """
+    path = Path(db_path or "knowledge_base.sqlite3")
+    if path.exists():
+        conn = sqlite3.connect(str(path))
+        try:
+            sharded = conn.execute('''
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'domain_shards'
+                ''').fetchone() is not None and \
+                conn.execute('SELECT 1 FROM domain_shards LIMIT 1').fetchone() is not None
+        finally:
+            conn.close()
+        if sharded:
+            return ShardedDatabaseManager(str(path), **kwargs)
+    return DatabaseManager(str(path))
+
+
+class ShardedDatabaseManager(DatabaseManager):
+    """
+    Хранение предметных областей в отдельных файлах SQLite
+
+    Основной файл остается каталогом: в нем предметные области, агенты,
+    таблица domain_shards и данные областей, не вынесенных в шарды.
+    Шард - обычная база DatabaseManager со своими правилами и фактами
+    (и копиями строк своей области и ее агентов для внешних ключей).
+    Одну группу областей можно хранить в одном шарде.
+
+    Запись и чтение по области или агенту направляются в его шард, так
+    что загрузка данных в разные области идет параллельно, не ожидая
+    общей блокировки записи. Запросы по всей базе знаний выполняются
+    одним SELECT ... UNION ALL по файлам, подключенным через ATTACH.
+
+    Граф зависимостей правил и инкрементальный вывод работают внутри
+    одного файла: без agent_id их результаты объединяются по шардам,
+    цепочки между правилами разных шардов не прослеживаются.
+    """
+
+    def __init__(self, db_path: str = None, shard_dir: str = None,
+                 shard_new_domains: bool = True):
+        self._shards: Dict[str, DatabaseManager] = {}  # имя шарда -> менеджер
+        self._shards_lock = threading.Lock()
+        self._agent_domains: Dict[str, Optional[str]] = {}  # кэш agent_id -> domain_id
+        self._replicated = set()  # (файл шарда, agent_id), агент уже скопирован
+
+        super().__init__(db_path)
+
+        if shard_dir is None:
+            shard_dir = self.db_path.with_name(self.db_path.stem + '_shards')
+        self.shard_dir = Path(shard_dir)
+        self.shard_new_domains = shard_new_domains
+        self._domain_shards = self._load_domain_shards()
+
+    def _init_database(self):
+        super()._init_database()
+
+        conn = self._get_connection()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS domain_shards (
+            domain_id TEXT PRIMARY KEY,
+            shard TEXT NOT NULL,
+            FOREIGN KEY (domain_id) REFERENCES domains(id) ON DELETE CASCADE
+        )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _load_domain_shards(self) -> Dict[str, str]:
+        conn = self._get_connection()
+        try:
+            return {row['domain_id']: row['shard']
+                    for row in conn.execute('SELECT domain_id, shard FROM domain_shards')}
+        finally:
+            conn.close()
+
+    # Шарды
+
+    def get_shard_path(self, shard: str) -> Path:
+        return self.shard_dir / f"{shard}.sqlite3"
+
+    def _shard(self, shard: str) -> DatabaseManager:
+        """Менеджер шарда; файл открывается при первом обращении"""
+        manager = self._shards.get(shard)
+        if manager is None:
+            with self._shards_lock:
+                manager = self._shards.get(shard)
+                if manager is None:
+                    self.shard_dir.mkdir(parents=True, exist_ok=True)
+                    manager = DatabaseManager(str(self.get_shard_path(shard)))
+                    self._shards[shard] = manager
+        return manager
+
+    def _shard_names(self) -> List[str]:
+        return sorted(set(self._domain_shards.values()))
+
+    def _shard_for_domain(self, domain_id: Optional[str]) -> Optional[DatabaseManager]:
+        shard = self._domain_shards.get(domain_id) if domain_id else None
+        return self._shard(shard) if shard else None
+
+    def _agent_domain(self, agent_id: Optional[str]) -> Optional[str]:
+        if not agent_id:
+            return None
+        if agent_id not in self._agent_domains:
+            agent = DatabaseManager.get_agent(self, agent_id)
+            self._agent_domains[agent_id] = agent.get('domain_id') if agent else None
+        return self._agent_domains[agent_id]
+
+    def _route(self, domain_id: Optional[str], name: str, *args):
+        """Вызов метода DatabaseManager в шарде области или в каталоге"""
+        shard = self._shard_for_domain(domain_id)
+        if shard is None:
+            return getattr(DatabaseManager, name)(self, *args)
+        return getattr(shard, name)(*args)
+
+    def _route_agent(self, agent_id: Optional[str], name: str, *args):
+        return self._route(self._agent_domain(agent_id), name, *args)
+
+    def _each(self, name: str, *args) -> List[Any]:
+        """Результаты метода в каталоге и во всех шардах"""
+        results = [getattr(DatabaseManager, name)(self, *args)]
+        for shard in self._shard_names():
+            results.append(getattr(self._shard(shard), name)(*args))
+        return results
+
+    def _locate(self, table: str, item_id: str, name: str, *args):
+        """Вызов метода в том файле, где хранится запись"""
+        stores = [(self._get_connection, lambda: getattr(DatabaseManager, name)(self, *args))]
+        for shard in self._shard_names():
+            manager = self._shard(shard)
+            stores.append((manager._get_connection,
+                           lambda manager=manager: getattr(manager, name)(*args)))
+
+        for connect, call in stores:
+            conn = connect()
+            try:
+                found = conn.execute(f'SELECT 1 FROM {table} WHERE id = ?', (item_id,)).fetchone()
+            finally:
+                conn.close()
+            if found:
+                return call()
+        return None
+
+    def shard_domain(self, domain_id: str, shard: str = None) -> bool:
+        """
+        Перенос предметной области в отдельный файл
+
+        Args:
+            shard: Имя шарда; области с одинаковым именем хранятся вместе.
+                По умолчанию - ID области.
+
+        Правила, факты и обоснования выводов области переносятся в шард
+        в одной транзакции через ATTACH.
+        """
+        if domain_id in self._domain_shards:
+            return True
+        shard = re.sub(r'[^\w-]', '_', shard or domain_id)
+        manager = self._shard(shard)
+
+        conn = self._get_connection()
+        try:
+            conn.execute('ATTACH DATABASE ? AS shard', (str(manager.db_path),))
+            cursor = conn.cursor()
+
+            # Та же маршрутизация, что у save_rule/save_fact: по domain_id,
+            # а без него - по области агента
+            agents = "SELECT id FROM main.agents WHERE domain_id = :domain"
+            rules = f"domain_id = :domain OR (domain_id IS NULL AND agent_id IN ({agents}))"
+            facts = f"SELECT id FROM main.facts WHERE {rules}"
+            params = {'domain': domain_id}
+
+            cursor.execute('INSERT OR IGNORE INTO shard.domains SELECT * FROM main.domains WHERE id = :domain', params)
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO shard.agents (id, name, domain_id, description, created_at)
+                SELECT a.id, a.name, (SELECT id FROM shard.domains WHERE id = a.domain_id),
+                       a.description, a.created_at
+                FROM main.agents a
+                WHERE a.id IN ({agents})
+                   OR a.id IN (SELECT agent_id FROM main.rules WHERE {rules})
+                   OR a.id IN (SELECT agent_id FROM main.facts WHERE {rules})
+                ''', params)
+            cursor.execute(f'INSERT INTO shard.rules SELECT * FROM main.rules WHERE {rules}', params)
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO shard.rule_signatures
+                SELECT * FROM main.rule_signatures
+                WHERE rule_id IN (SELECT id FROM main.rules WHERE {rules})
+                ''', params)
+            cursor.execute(f'INSERT INTO shard.facts SELECT * FROM main.facts WHERE id IN ({facts})', params)
+            cursor.execute(f'''
+                INSERT INTO shard.fact_justifications
+                SELECT * FROM main.fact_justifications WHERE fact_id IN ({facts})
+                ''', params)
+            cursor.execute(f'''
+                INSERT INTO shard.fact_supports
+                SELECT * FROM main.fact_supports WHERE fact_id IN ({facts})
+                ''', params)
+            for table in ('derivation_inputs', 'derivation_state'):
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO shard.{table}
+                    SELECT * FROM main.{table} WHERE agent_id IN ({agents})
+                    ''', params)
+            self._copy_concepts(cursor, f"SELECT id FROM main.rules WHERE {rules}", facts, params)
+
+            # Обоснования и зависимости в каталоге удаляются каскадно
+            cursor.execute(f'DELETE FROM main.facts WHERE id IN ({facts})', params)
+            cursor.execute(f'DELETE FROM main.rules WHERE {rules}', params)
+            cursor.execute(f'DELETE FROM main.derivation_state WHERE agent_id IN ({agents})', params)
+            cursor.execute(f'DELETE FROM main.derivation_inputs WHERE agent_id IN ({agents})', params)
+            cursor.execute('INSERT INTO main.domain_shards (domain_id, shard) VALUES (?, ?)',
+                           (domain_id, shard))
+
+            conn.commit()
+            conn.execute('DETACH DATABASE shard')
+
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка переноса предметной области в шард: {e}")
+            # Шард, созданный для этой области, не остается в списке открытых
+            with self._shards_lock:
+                if shard not in self._domain_shards.values():
+                    self._shards.pop(shard, None)
+            return False
+
+        finally:
+            # Закрытие соединения отключает и присоединенный шард
+            conn.close()
+
+        self._domain_shards[domain_id] = shard
+        manager.rebuild_rule_dependencies()
+        return True
+
+    @staticmethod
+    def _copy_concepts(cursor: sqlite3.Cursor, rules: str, facts: str, params: Dict):
+        """
+        Копирование в шард индекса концепций переносимых правил и фактов
+
+        ID концепций в файлах разные: связи переносятся по ключу концепции.
+        Копируются концепции, связанные с правилами и фактами, и концепции
+        их отношений; в каталоге концепции остаются, а связи с правилами и
+        фактами удаляются каскадно вместе с ними.
+        """
+        linked = f'''
+            SELECT concept_id FROM main.concept_rules WHERE rule_id IN ({rules})
+            UNION SELECT concept_id FROM main.concept_facts WHERE fact_id IN ({facts})
+            '''
+        related = f'''
+            {linked}
+            UNION SELECT object_id FROM main.concept_relations WHERE subject_id IN ({linked})
+            UNION SELECT subject_id FROM main.concept_relations WHERE object_id IN ({linked})
+            '''
+
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO shard.concepts (key, text, type)
+            SELECT key, text, type FROM main.concepts WHERE id IN ({related})
+            ''', params)
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO shard.concept_rules (concept_id, rule_id)
+            SELECT sc.id, cr.rule_id FROM main.concept_rules cr
+            JOIN main.concepts c ON c.id = cr.concept_id
+            JOIN shard.concepts sc ON sc.key = c.key
+            WHERE cr.rule_id IN ({rules})
+            ''', params)
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO shard.concept_facts (concept_id, fact_id)
+            SELECT sc.id, cf.fact_id FROM main.concept_facts cf
+            JOIN main.concepts c ON c.id = cf.concept_id
+            JOIN shard.concepts sc ON sc.key = c.key
+            WHERE cf.fact_id IN ({facts})
+            ''', params)
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO shard.concept_sources (concept_id, source_file)
+            SELECT sc.id, cs.source_file FROM main.concept_sources cs
+            JOIN main.concepts c ON c.id = cs.concept_id
+            JOIN shard.concepts sc ON sc.key = c.key
+            WHERE cs.concept_id IN ({related})
+            ''', params)
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO shard.concept_relations (subject_id, relation, object_id, source_file)
+            SELECT ss.id, r.relation, so.id, r.source_file FROM main.concept_relations r
+            JOIN main.concepts s ON s.id = r.subject_id
+            JOIN shard.concepts ss ON ss.key = s.key
+            JOIN main.concepts o ON o.id = r.object_id
+            JOIN shard.concepts so ON so.key = o.key
+            WHERE r.subject_id IN ({linked}) OR r.object_id IN ({linked})
+            ''', params)
+
+    # Запросы по всем файлам
+
+    def _query_all(self, table: str, where: str = '', params: Tuple = (),
+                   order_by: str = '', sort_key: Callable = None, reverse: bool = False) -> List[Dict]:
+        """
+        SELECT по таблице каталога и всех шардов через ATTACH
+
+        Файлы подключаются пачками по ATTACH_LIMIT; если пачек несколько,
+        строки сортируются по sort_key (тот же порядок, что order_by).
+        """
+        shards = [str(self._shard(shard).db_path) for shard in self._shard_names()]
+        batches = [shards[i:i + ATTACH_LIMIT] for i in range(0, len(shards), ATTACH_LIMIT)] or [[]]
+
+        rows = []
+        for number, batch in enumerate(batches):
+            conn = self._get_connection()
+            try:
+                schemas = ['main'] if number == 0 else []
+                for i, path in enumerate(batch):
+                    conn.execute(f'ATTACH DATABASE ? AS s{i}', (path,))
+                    schemas.append(f's{i}')
+                if not schemas:
+                    continue
+
+                query = ' UNION ALL '.join(f'SELECT * FROM {schema}.{table} {where}'
+                                           for schema in schemas)
+                rows.extend(dict(row) for row in conn.execute(
+                    f'SELECT * FROM ({query}) {order_by}', tuple(params) * len(schemas)))
+            finally:
+                conn.close()
+
+        if len(batches) > 1 and sort_key is not None:
+            rows.sort(key=sort_key, reverse=reverse)
+        return rows
+
+    def _query_rules(self, where: str = '', params: Tuple = (),
+                     order_by: str = 'ORDER BY created_at DESC',
+                     sort_key: Callable = None, reverse: bool = True) -> List[Dict]:
+        try:
+            return rules_from_rows(self._query_all(
+                'rules', where, params, order_by,
+                sort_key or (lambda rule: rule['created_at'] or ''), reverse))
+        except sqlite3.Error as e:
+            print(f"Ошибка получения правил: {e}")
+            return []
+
+    def _query_facts(self, where: str = '', params: Tuple = ()) -> List[Dict]:
+        try:
+            return self._query_all('facts', where, params, 'ORDER BY created_at DESC',
+                                   lambda fact: fact['created_at'] or '', True)
+        except sqlite3.Error as e:
+            print(f"Ошибка получения фактов: {e}")
+            return []
+
+    # Ревизия и снимок
+
+    def get_data_version(self) -> int:
+        """Сумма ревизий каталога и шардов: растет при любом изменении"""
+        return sum(self._each('get_data_version'))
+
+    def _read_stores(self, rules_order: str = '', signatures: bool = False) -> Tuple[int, Dict]:
+        """Данные всех файлов, каждый - из своего согласованного снимка"""
+        with self.read_snapshot() as conn:
+            revision = conn.data_version
+            data = self._read_knowledge_base(conn, rules_order)
+            if signatures:
+                data['signatures'] = read_rule_signatures(conn)
+
+        for shard in self._shard_names():
+            with self._shard(shard).read_snapshot() as conn:
+                revision += conn.data_version
+                shard_data = self._read_knowledge_base(conn, rules_order)
+                if signatures:
+                    data['signatures'].update(read_rule_signatures(conn))
+            data['rules'].extend(shard_data['rules'])
+            data['facts'].extend(shard_data['facts'])
+
+        data['facts'].sort(key=lambda fact: fact['created_at'] or '', reverse=True)
+        if rules_order:
+            data['rules'].sort(key=lambda rule: rule['created_at'] or '', reverse=True)
+        return revision, data
+
+    def build_snapshot(self) -> KnowledgeBaseSnapshot:
+        """Компиляция снимка по каталогу и всем шардам"""
+        revision, data = self._read_stores(signatures=True)
+        return KnowledgeBaseSnapshot.build(
+            self.get_snapshot_path(), revision,
+            data['domains'], data['agents'], data['rules'], data['facts'], data['signatures']
+        )
+
+    def _export_data(self) -> Dict:
+        revision, data = self._read_stores('ORDER BY created_at DESC')
+        result = {'export_date': datetime.now().isoformat(), 'data_version': revision}
+        result.update(data)
+        return result
+
+    def _import_data(self, data: Dict) -> Optional[Dict]:
+        """
+        Импорт с разделением по файлам
+
+        Домены и агенты импортируются в каталог (новые домены выносятся в
+        шарды при shard_new_domains), затем правила и факты - в хранилище
+        своей области. Каждое хранилище импортируется своей транзакцией.
+        """
+        known = {domain['id'] for domain in DatabaseManager.get_all_domains(self)}
+        summary = DatabaseManager._import_data(self, {'domains': data.get('domains') or [],
+                                                      'agents': data.get('agents') or []})
+        if summary is None:
+            return None
+
+        # ID доменов из файла -> ID в каталоге (домен с тем же именем мог уже быть)
+        domain_ids = {}
+        for domain in data.get('domains') or []:
+            if domain.get('id') and domain.get('name'):
+                stored = (DatabaseManager.get_domain(self, str(domain['id'])) or
+                          DatabaseManager.get_domain_by_name(self, domain['name']))
+                domain_ids[str(domain['id'])] = stored['id'] if stored else None
+
+        if self.shard_new_domains:
+            for domain_id in set(domain_ids.values()) - known - {None}:
+                self.shard_domain(domain_id)
+        self._agent_domains.clear()
+
+        stores = {None: (None, {'rules': [], 'facts': []})}
+        for section in ('rules', 'facts'):
+            for record in data.get(section) or []:
+                domain_id = record.get('domain_id')
+                if domain_id:
+                    domain_id = domain_ids.get(str(domain_id), str(domain_id))
+                    record = dict(record, domain_id=domain_id)
+                shard = self._shard_for_domain(domain_id or self._agent_domain(record.get('agent_id')))
+                key = shard.db_path if shard is not None else None
+                stores.setdefault(key, (shard, {'rules': [], 'facts': []}))[1][section].append(record)
+
+        for shard, shard_data in stores.values():
+            if shard is None:
+                result = DatabaseManager._import_data(self, shard_data)
+            else:
+                # Строки областей и агентов для внешних ключей шарда
+                agent_ids = {str(record['agent_id']) for records in shard_data.values()
+                             for record in records if record.get('agent_id')}
+                agents = [agent for agent in (DatabaseManager.get_agent(self, agent_id)
+                                              for agent_id in sorted(agent_ids)) if agent]
+                domains = [DatabaseManager.get_domain(self, domain_id) for domain_id, name in
+                           self._domain_shards.items() if self._shard(name) is shard]
+                result = shard._import_data(dict(shard_data, domains=domains, agents=agents))
+            if result is None:
+                return None
+            for section in ('rules', 'facts'):
+                for outcome, count in result[section].items():
+                    summary[section][outcome] += count
+
+        return summary
+
+    def _import_stream(self, batches) -> Optional[Dict]:
+        """
+        Пачки импортируются по одной через _import_data; домены передаются
+        с каждой пачкой, чтобы ссылки на них сопоставлялись так же
+        """
+        summary = empty_summary()
+        domains = []
+        for section, rows in batches:
+            if section == 'domains':
+                result = self._import_data({'domains': rows})
+                domains.extend(rows)
+            else:
+                result = self._import_data({'domains': domains, section: rows})
+            if result is None:
+                return None
+            for outcome, count in result[section].items():
+                summary[section][outcome] += count
+        return summary
+
+    def _write_archive(self, writer, sections=CHANGE_TABLES):
+        DatabaseManager._write_archive(self, writer, sections)
+        for shard in self._shard_names():
+            self._shard(shard)._write_archive(writer, [section for section in sections if section in ('rules', 'facts')])
+        writer.data_version = self.get_data_version()
+
+    # Журнал изменений
+
+    def _change_logs(self) -> List[Tuple[str, Any, Tuple[str, ...]]]:
+        """(имя хранилища, журнал, таблицы); в шардах домены и агенты - копии каталога"""
+        logs = [('', self.change_log_repository, CHANGE_TABLES)]
+        for shard in self._shard_names():
+            logs.append((shard, self._shard(shard).change_log_repository, ('rules', 'facts')))
+        return logs
+
+    def export_changes(self, since_seq: Union[int, Dict[str, int]] = 0) -> Optional[Dict]:
+        """
+        Изменения по всем файлам
+
+        У каждого файла свой журнал, поэтому since_seq и last_seq - словари
+        "имя шарда -> номер" (каталог - пустое имя). Число вместо словаря
+        считается номером каталога; шарды тогда выгружаются с начала.
+        """
+        positions = dict(since_seq) if isinstance(since_seq, dict) else {'': since_seq}
+        result = {'since_seq': positions, 'last_seq': {}, 'data_version': self.get_data_version(),
+                  'upserts': {table: [] for table in CHANGE_TABLES},
+                  'deletes': {table: [] for table in CHANGE_TABLES}}
+
+        for name, change_log, tables in self._change_logs():
+            changes = change_log.export_changes(positions.get(name, 0), tables)
+            if changes is None:
+                return None
+            result['last_seq'][name] = changes['last_seq']
+            for table in tables:
+                result['upserts'][table].extend(changes['upserts'][table])
+                result['deletes'][table].extend(changes['deletes'][table])
+
+        # Перенос области в шард - удаление в каталоге и вставка в шарде
+        for table in CHANGE_TABLES:
+            present = {row['id'] for row in result['upserts'][table]}
+            result['deletes'][table] = [row_id for row_id in result['deletes'][table]
+                                        if row_id not in present]
+        return result
+
+    def apply_changes(self, changes: Dict) -> Optional[Dict]:
+        """
+        Удаления выполняются во всех файлах, вставки и обновления
+        распределяются по ним, как при импорте
+        """
+        deletes = changes.get('deletes') or {}
+        deleted = {}
+        for _, change_log, tables in self._change_logs():
+            counts = change_log.delete_rows(deletes)
+            if counts is None:
+                return None
+            # Копии доменов и агентов в шардах не считаются
+            for table in tables:
+                deleted[table] = deleted.get(table, 0) + counts.get(table, 0)
+
+        self._domain_shards = self._load_domain_shards()
+        self._agent_domains.clear()
+        self._replicated.clear()
+
+        summary = self._import_data(changes.get('upserts') or {})
+        if summary is not None:
+            for section, counts in summary.items():
+                counts['deleted'] = deleted.get(section, 0)
+        self.last_import_summary = summary
+        return summary
+
+    def get_last_change_seq(self) -> Dict[str, int]:
+        return {name: change_log.get_last_seq() for name, change_log, _ in self._change_logs()}
+
+    def prune_change_log(self, before_seq: Union[int, Dict[str, int]]) -> int:
+        positions = dict(before_seq) if isinstance(before_seq, dict) else {'': before_seq}
+        return sum(change_log.prune_change_log(positions[name])
+                   for name, change_log, _ in self._change_logs() if name in positions)
+
+    # Предметные области и агенты
+
+    def create_domain(self, name: str, description: str = "", shard: str = None) -> Optional[Dict]:
+        domain = DatabaseManager.create_domain(self, name, description)
+        if domain and (shard or self.shard_new_domains):
+            self.shard_domain(domain['id'], shard)
+        return domain
+
+    def _with_shard_counts(self, domain: Optional[Dict]) -> Optional[Dict]:
+        """Счетчики правил и фактов вынесенной области ведутся в ее шарде"""
+        shard = self._shard_for_domain(domain['id']) if domain else None
+        if shard is not None:
+            stored = shard.domain_repository.get_domain(domain['id'])
+            if stored:
+                domain['rules_count'] = stored['rules_count']
+                domain['facts_count'] = stored['facts_count']
+        return domain
+
+    def get_domain(self, domain_id: str) -> Optional[Dict]:
+        return self._with_shard_counts(DatabaseManager.get_domain(self, domain_id))
+
+    def get_domain_by_name(self, name: str) -> Optional[Dict]:
+        return self._with_shard_counts(DatabaseManager.get_domain_by_name(self, name))
+
+    def get_all_domains(self) -> List[Dict]:
+        return [self._with_shard_counts(domain) for domain in DatabaseManager.get_all_domains(self)]
+
+    def create_agent(self, name: str, domain_id: str = None, description: str = "") -> Optional[Dict]:
+        agent = DatabaseManager.create_agent(self, name, domain_id, description)
+        shard = self._shard_for_domain(domain_id)
+        if agent and shard is not None:
+            self._replicate_agent(shard, agent['id'])
+        return agent
+
+    def _replicate_agent(self, shard: DatabaseManager, agent_id: str):
+        """Копия агента в шарде нужна для внешних ключей правил и фактов"""
+        key = (shard.db_path, agent_id)
+        if key in self._replicated or not agent_id:
+            return
+
+        agent = DatabaseManager.get_agent(self, agent_id)
+        if agent:
+            conn = shard._get_connection()
+            try:
+                conn.execute('''
+                    INSERT OR IGNORE INTO agents (id, name, domain_id, description, created_at)
+                    VALUES (:id, :name, (SELECT id FROM domains WHERE id = :domain_id),
+                            :description, :created_at)
+                    ''', agent)
+                conn.commit()
+            finally:
+                conn.close()
+        self._replicated.add(key)
+
+    def _save_routed(self, name: str, data: Dict, *args) -> Optional[Dict]:
+        domain_id = data.get('domain_id') or self._agent_domain(data.get('agent_id'))
+        shard = self._shard_for_domain(domain_id)
+        if shard is None:
+            return getattr(DatabaseManager, name)(self, data, *args)
+        self._replicate_agent(shard, data.get('agent_id'))
+        return getattr(shard, name)(data, *args)
+
+    # Правила
+
+    def save_rule(self, rule_data: Dict, on_duplicate: str = 'skip') -> Optional[Dict]:
+        return self._save_routed('save_rule', rule_data, on_duplicate)
+
+    def get_rule(self, rule_id: str) -> Optional[Dict]:
+        rules = self._query_rules('WHERE id = ?', (rule_id,))
+        return rules[0] if rules else None
+
+    def get_rules_by_agent(self, agent_id: str) -> List[Dict]:
+        return self._route_agent(agent_id, 'get_rules_by_agent', agent_id)
+
+    def get_rules_by_domain(self, domain_id: str) -> List[Dict]:
+        return self._route(domain_id, 'get_rules_by_domain', domain_id)
+
+    def get_all_rules(self) -> List[Dict]:
+        return self._query_rules()
+
+    def get_rules_by_ids(self, rule_ids: List[str]) -> List[Dict]:
+        return self._query_rules('WHERE id IN (SELECT value FROM json_each(?))',
+                                 (json.dumps(list(rule_ids)),))
+
+    def find_rules_by_id_prefix(self, prefix: str, limit: int = 100) -> List[Dict]:
+        prefix = prefix.rstrip('.')
+        if not prefix:
+            return []
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rules = self._query_rules('WHERE id >= ? AND id < ?', (prefix, upper),
+                                  'ORDER BY id', lambda rule: rule['id'], False)
+        return rules[:limit]
+
+    def search_rules(self, query: str, agent_ids: List[str] = None) -> List[Dict]:
+        query_lower = f"%{query.lower()}%"
+        where = 'WHERE (LOWER(condition) LIKE ? OR LOWER(action) LIKE ?)'
+        params = [query_lower, query_lower]
+        if agent_ids:
+            where += f" AND agent_id IN ({','.join(['?'] * len(agent_ids))})"
+            params += list(agent_ids)
+        return self._query_rules(where, tuple(params), 'ORDER BY priority DESC',
+                                 lambda rule: rule['priority'] or 0, True)
+
+    def update_rule_priority(self, rule_id: str, priority: int) -> bool:
+        return bool(self._locate('rules', rule_id, 'update_rule_priority', rule_id, priority))
+
+    def delete_rule(self, rule_id: str) -> bool:
+        return bool(self._locate('rules', rule_id, 'delete_rule', rule_id))
+
+    def delete_rules(self, rule_ids: List[str]) -> int:
+        return sum(self._each('delete_rules', rule_ids))
+
+    def find_similar_rules(self, agent_id: str = None, threshold: float = 0.7,
+                           lemmas: bool = False) -> List[Dict]:
+        if agent_id:
+            return self._route_agent(agent_id, 'find_similar_rules', agent_id, threshold, lemmas)
+        snapshot = self.get_snapshot()
+        return VersionedList(snapshot.find_similar_rules(None, threshold, lemmas), snapshot.revision)
+
+    def find_conflicting_rules(self, agent_id: str = None) -> List[Dict]:
+        if agent_id:
+            return self._route_agent(agent_id, 'find_conflicting_rules', agent_id)
+        snapshot = self.get_snapshot()
+        return VersionedList(snapshot.find_conflicting_rules(None), snapshot.revision)
+
+    # Факты
+
+    def save_fact(self, fact_data: Dict) -> Optional[Dict]:
+        return self._save_routed('save_fact', fact_data)
+
+    def get_fact(self, fact_id: str) -> Optional[Dict]:
+        facts = self._query_facts('WHERE id = ?', (fact_id,))
+        return facts[0] if facts else None
+
+    def get_facts_by_agent(self, agent_id: str) -> List[Dict]:
+        return self._route_agent(agent_id, 'get_facts_by_agent', agent_id)
+
+    def get_facts_by_variable(self, variable_name: str, agent_id: str = None) -> List[Dict]:
+        if agent_id:
+            return self._route_agent(agent_id, 'get_facts_by_variable', variable_name, agent_id)
+        return self._query_facts('WHERE variable_name = ?', (variable_name,))
+
+    def get_all_facts(self) -> List[Dict]:
+        return self._query_facts()
+
+    # Вывод и граф зависимостей
+
+    def update_derived_facts(self, agent_id: str, strategy: str = 'priority') -> Optional[Dict]:
+        return self._route_agent(agent_id, 'update_derived_facts', agent_id, strategy)
+
+    def get_fact_provenance(self, fact_id: str) -> Optional[Dict]:
+        return self._locate('facts', fact_id, 'get_fact_provenance', fact_id)
+
+    def rebuild_rule_dependencies(self) -> int:
+        return sum(self._each('rebuild_rule_dependencies'))
+
+    def fill_missing_signatures(self) -> int:
+        return sum(self._each('fill_missing_signatures'))
+
+    def count_duplicate_rules(self) -> int:
+        return sum(self._each('count_duplicate_rules'))
+
+    def delete_duplicate_rules(self) -> int:
+        return sum(self._each('delete_duplicate_rules'))
+
+    def get_rule_signatures(self, rule_ids: List[str], lemmas: bool = False) -> Dict:
+        signatures = {}
+        for result in self._each('get_rule_signatures', rule_ids, lemmas):
+            signatures.update(result)
+        return signatures
+
+    def get_rule_dependencies(self, rule_id: str) -> Dict:
+        return self._locate('rules', rule_id, 'get_rule_dependencies', rule_id) or \
+            {'reads': [], 'writes': []}
+
+    def _by_agent_or_all(self, name: str, agent_id: Optional[str], *args) -> List:
+        if agent_id:
+            return self._route_agent(agent_id, name, *args, agent_id)
+        return [item for result in self._each(name, *args, None) for item in result]
+
+    def get_rules_reading(self, variable: str, agent_id: str = None) -> List[Dict]:
+        return self._by_agent_or_all('get_rules_reading', agent_id, variable)
+
+    def get_rules_writing(self, variable: str, agent_id: str = None) -> List[Dict]:
+        return self._by_agent_or_all('get_rules_writing', agent_id, variable)
+
+    def get_supporting_rules(self, goal: str, agent_id: str = None) -> List[Dict]:
+        return self._by_agent_or_all('get_supporting_rules', agent_id, goal)
+
+    def get_input_variables(self, goal: str, agent_id: str = None) -> List[str]:
+        return sorted(set(self._by_agent_or_all('get_input_variables', agent_id, goal)))
+
+    def find_dependency_cycles(self, agent_id: str = None) -> List[List[str]]:
+        if agent_id:
+            return self._route_agent(agent_id, 'find_dependency_cycles', agent_id)
+        return [cycle for result in self._each('find_dependency_cycles', None) for cycle in result]
+
+    # Индекс концепций
+
+    def index_concepts(self, concepts: List[Dict], relationships: List[Dict],
+                       rules: List[Dict], facts: List[Dict], source_file: str) -> int:
+        """Концепции индексируются в каждом файле, где сохранены правила или факты текста"""
+        stores: Dict[Optional[str], Tuple[List[Dict], List[Dict]]] = {}
+        for position, items in ((0, rules), (1, facts)):
+            for item in items:
+                if not item:
+                    continue
+                domain_id = item.get('domain_id') or self._agent_domain(item.get('agent_id'))
+                stores.setdefault(self._domain_shards.get(domain_id) if domain_id else None,
+                                  ([], []))[position].append(item)
+
+        indexed = 0
+        for shard, (shard_rules, shard_facts) in (stores or {None: ([], [])}).items():
+            args = (concepts, relationships, shard_rules, shard_facts, source_file)
+            if shard is None:
+                count = DatabaseManager.index_concepts(self, *args)
+            else:
+                count = self._shard(shard).index_concepts(*args)
+            indexed = max(indexed, count)
+        return indexed
+
+    def find_concepts(self, prefix: str, limit: int = 50) -> List[Dict]:
+        merged: Dict[str, Dict] = {}
+        for result in self._each('find_concepts', prefix, limit):
+            for concept in result:
+                known = merged.setdefault(concept['key'], dict(concept, rules=0, facts=0, sources=0))
+                for counter in ('rules', 'facts'):
+                    known[counter] += concept[counter]
+                # Исходный файл текста записывается в каждый файл, где сохранены
+                # его правила и факты, поэтому источники не суммируются
+                known['sources'] = max(known['sources'], concept['sources'])
+        return [merged[key] for key in sorted(merged)][:limit]
+
+    def get_rules_by_concept(self, concept: str, agent_id: str = None) -> List[Dict]:
+        if agent_id:
+            return self._route_agent(agent_id, 'get_rules_by_concept', concept, agent_id)
+        rules = [rule for result in self._each('get_rules_by_concept', concept) for rule in result]
+        return sorted(rules, key=lambda rule: rule['priority'] or 0, reverse=True)
+
+    def get_facts_by_concept(self, concept: str, agent_id: str = None) -> List[Dict]:
+        if agent_id:
+            return self._route_agent(agent_id, 'get_facts_by_concept', concept, agent_id)
+        facts = [fact for result in self._each('get_facts_by_concept', concept) for fact in result]
+        return sorted(facts, key=lambda fact: fact['confidence'] or 0, reverse=True)
+
+    def get_cooccurring_facts(self, concept: str, agent_id: str = None) -> List[Dict]:
+        if agent_id:
+            return self._route_agent(agent_id, 'get_cooccurring_facts', concept, agent_id)
+        facts = [fact for result in self._each('get_cooccurring_facts', concept) for fact in result]
+        return sorted(facts, key=lambda fact: (fact['mentions'], fact['confidence'] or 0), reverse=True)
+
+    def get_concept_relations(self, concept: str) -> List[Dict]:
+        relations = {}
+        for result in self._each('get_concept_relations', concept):
+            for relation in result:
+                relations.setdefault(tuple(relation.values()), relation)
+        return [relations[key] for key in sorted(relations, key=lambda key: (key[1], key[0], key[2]))]
+
+    def get_rule_concepts(self, rule_id: str) -> List[Dict]:
+        return self._locate('rules', rule_id, 'get_rule_concepts', rule_id) or []
+
+    # Статистика
+
+    def get_statistics(self) -> Dict:
+        """Статистика по каталогу и шардам"""
+        stats = DatabaseManager.get_statistics(self)
+        rules_by_type = dict(stats.get('rules_by_type', {}))
+
+        for shard in self._shard_names():
+            shard_stats = self._shard(shard).get_statistics()
+            stats['rules'] = stats.get('rules', 0) + shard_stats.get('rules', 0)
+            stats['facts'] = stats.get('facts', 0) + shard_stats.get('facts', 0)
+            stats['data_version'] = stats.get('data_version', 0) + shard_stats.get('data_version', 0)
+            for rule_type, count in shard_stats.get('rules_by_type', {}).items():
+                rules_by_type[rule_type] = rules_by_type.get(rule_type, 0) + count
+
+        stats['rules_by_type'] = rules_by_type
+        stats['shards'] = len(self._shard_names())
+        return stats
+
@@ -0,0 +1,118 @@
+import sqlite3
+from typing import Dict, Iterable, List, Tuple, FrozenSet
+
+from core.metrics import instrument_repository
+from core.tokenizer import rule_signatures, pack_signature, unpack_signature
+
+SIGNATURE_FIELDS = ('condition_tokens', 'action_tokens', 'condition_lemmas', 'action_lemmas')
+
+
+def write_rule_signatures(cursor: sqlite3.Cursor, rules: Iterable[Dict]):
+    """
+    Запись сигнатур текста правил
+
+    Вызывается в транзакции сохранения правил. При изменении условия или
+    действия строка удаляется триггером и пересчитывается при следующем
+    чтении или запуске.
+    """
+    rows = []
+    for rule in rules:
+        signatures = rule_signatures(rule)
+        rows.append((rule['id'],) + tuple(pack_signature(signatures[field])
+                                          for field in SIGNATURE_FIELDS))
+
+    cursor.executemany('''
+        INSERT OR REPLACE INTO rule_signatures (
+            rule_id, condition_tokens, action_tokens, condition_lemmas, action_lemmas
+        ) VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+
+
+def pop_rule_signatures(rule: Dict, lemmas: bool = False) -> Tuple[FrozenSet[int], FrozenSet[int]]:
+    """
+    Сигнатуры (условие, действие) из строки rules LEFT JOIN rule_signatures
+
+    Столбцы сигнатур удаляются из словаря правила. Если строки сигнатур
+    нет (правило изменено после сохранения), они считаются по тексту.
+    """
+    packed = {field: rule.pop(field, None) for field in SIGNATURE_FIELDS}
+    condition_field, action_field = (('condition_lemmas', 'action_lemmas') if lemmas
+                                     else ('condition_tokens', 'action_tokens'))
+    if packed[condition_field] is None:
+        signatures = rule_signatures(rule)
+        return frozenset(signatures[condition_field]), frozenset(signatures[action_field])
+    return unpack_signature(packed[condition_field]), unpack_signature(packed[action_field])
+
+
+def read_rule_signatures(conn: sqlite3.Connection) -> Dict[str, Tuple[FrozenSet[int], ...]]:
+    """Все сохраненные сигнатуры: ID правила -> сигнатуры в порядке SIGNATURE_FIELDS"""
+    return {row[0]: tuple(unpack_signature(value) for value in row[1:])
+            for row in conn.execute(f"SELECT rule_id, {', '.join(SIGNATURE_FIELDS)} FROM rule_signatures")}
+
+
+@instrument_repository
+class SignatureRepository:
+    """Сигнатуры токенов и основ слов правил"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Создание соединения с БД"""
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.row_factory = sqlite3.Row  # Для доступа по имени столбцов
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def fill_missing_signatures(self, batch_size: int = 10000) -> int:
+        """
+        Расчет сигнатур для правил, у которых их нет
+
+        Returns:
+            Количество обработанных правил
+        """
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            count = 0
+            rows = conn.execute('''
+                SELECT r.id, r.condition, r.action FROM rules r
+                WHERE NOT EXISTS (SELECT 1 FROM rule_signatures s WHERE s.rule_id = r.id)
+                ''').fetchall()
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                write_rule_signatures(cursor, [dict(row) for row in batch])
+                count += len(batch)
+
+            conn.commit()
+            conn.close()
+            return count
+
+        except sqlite3.Error as e:
+            print(f"Ошибка расчета сигнатур правил: {e}")
+            return 0
+
+    def get_rule_signatures(self, rule_ids: List[str],
+                            lemmas: bool = False) -> Dict[str, Tuple[FrozenSet[int], FrozenSet[int]]]:
+        """Сигнатуры (условие, действие) правил по их ID"""
+        condition_field, action_field = (('condition_lemmas', 'action_lemmas') if lemmas
+                                         else ('condition_tokens', 'action_tokens'))
+        try:
+            conn = self._get_connection()
+            signatures = {}
+            for start in range(0, len(rule_ids), 500):
+                chunk = rule_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for row in conn.execute(f'''
+                        SELECT rule_id, {condition_field}, {action_field} FROM rule_signatures
+                        WHERE rule_id IN ({placeholders})
+                        ''', chunk):
+                    signatures[row[0]] = (unpack_signature(row[1]), unpack_signature(row[2]))
+            conn.close()
+            return signatures
+
+        except sqlite3.Error as e:
+            print(f"Ошибка получения сигнатур правил: {e}")
+            return {}
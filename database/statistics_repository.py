@@ -1,7 +1,11 @@
 import sqlite3
 from typing import Dict
 
+from core.metrics import instrument_repository
+from database.read_snapshot import read_snapshot
 
+
+@instrument_repository
 class StatisticsRepository:
 
     def __init__(self, db_path):
@@ -20,33 +24,35 @@ class StatisticsRepository:
         stats = {}
 
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            # Подсчет записей
-            cursor.execute("SELECT COUNT(*) FROM domains")
-            stats['domains'] = cursor.fetchone()[0]
+            # Все счетчики из одного снимка БД
+            with read_snapshot(self.db_path) as conn:
+                stats['data_version'] = conn.data_version
+                self._count(conn.cursor(), stats)
 
-            cursor.execute("SELECT COUNT(*) FROM agents")
-            stats['agents'] = cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Ошибка получения статистики: {e}")
 
-            cursor.execute("SELECT COUNT(*) FROM rules")
-            stats['rules'] = cursor.fetchone()[0]
+        return stats
 
-            cursor.execute("SELECT COUNT(*) FROM facts")
-            stats['facts'] = cursor.fetchone()[0]
+    @staticmethod
+    def _count(cursor: sqlite3.Cursor, stats: Dict):
+        """Подсчет записей по таблицам"""
+        cursor.execute("SELECT COUNT(*) FROM domains")
+        stats['domains'] = cursor.fetchone()[0]
 
-            # Статистика по типам правил
-            cursor.execute("""
-            SELECT rule_type, COUNT(*) as count 
-            FROM rules 
-            GROUP BY rule_type
-            """)
-            stats['rules_by_type'] = dict(cursor.fetchall())
+        cursor.execute("SELECT COUNT(*) FROM agents")
+        stats['agents'] = cursor.fetchone()[0]
 
-            conn.close()
+        cursor.execute("SELECT COUNT(*) FROM rules")
+        stats['rules'] = cursor.fetchone()[0]
 
-        except sqlite3.Error as e:
-            print(f"Ошибка получения статистики: {e}")
+        cursor.execute("SELECT COUNT(*) FROM facts")
+        stats['facts'] = cursor.fetchone()[0]
 
-        return stats
\ No newline at end of file
+        # Статистика по типам правил
+        cursor.execute("""
+        SELECT rule_type, COUNT(*) as count 
+        FROM rules 
+        GROUP BY rule_type
+        """)
+        stats['rules_by_type'] = dict(cursor.fetchall())
\ No newline at end of file
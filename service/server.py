@@ -0,0 +1,451 @@
+"""
+Локальный сервис вывода и запросов к базе знаний
+
+Запуск без графического интерфейса:
+    python -m service.server --db knowledge_base.sqlite3 --port 8765
+    python -m service.server --socket /tmp/kb.sock
+
+Протокол - JSON-RPC 2.0 поверх HTTP: POST /rpc с одним запросом или
+пакетом запросов, GET /health - состояние сервиса. Методы:
+    forward_inference(facts, agent_id, domain_id, strategy)
+    backward_inference(goal, agent_id)
+    search_rules(query, agent_ids, limit)
+    get_facts(fact_id | variable | agent_id)
+    status()
+
+Пример:
+    curl -d '{"jsonrpc": "2.0", "id": 1, "method": "forward_inference",
+              "params": {"facts": {"температура": 39.5}}}' localhost:8765/rpc
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.agenda import STRATEGIES
+from core.inference_engine import InferenceEngine, CompiledRules
+from core.metrics import metrics
+from database.db_manager import DatabaseManager
+from database.sharded_db_manager import open_database
+
+
+# Коды ошибок JSON-RPC 2.0
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class RpcError(Exception):
+    """Ошибка, возвращаемая клиенту в ответе JSON-RPC"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class KnowledgeBaseService:
+    """
+    Операции над базой знаний для конкурентных запросов
+
+    Правила компилируются один раз на область (все правила, агент или
+    предметная область) и переиспользуются всеми запросами, пока не
+    изменится ревизия данных. Обращения к SQLite и сам вывод выполняются
+    в ограниченном пуле потоков, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, db_path: str, workers: int = 4, refresh_interval: float = 1.0):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kb-service')
+        self.engine = InferenceEngine()
+        self.db_manager: Optional[DatabaseManager] = None
+
+        self._revision = None
+        self._checked_at = 0.0
+        self._compiled: Dict[Tuple, CompiledRules] = {}  # область -> правила
+        self._lock: Optional[asyncio.Lock] = None
+        self.started_at = time.time()
+
+    async def start(self):
+        """Открытие БД и компиляция всех правил"""
+        # open_database создал бы пустую базу, и сервис отвечал бы на все
+        # запросы пустым результатом
+        if not os.path.isfile(self.db_path):
+            raise FileNotFoundError(f"Файл базы знаний не найден: {self.db_path}")
+        self._lock = asyncio.Lock()
+        # Сообщения базы данных не должны смешиваться с выводом клиентов
+        with contextlib.redirect_stdout(sys.stderr):
+            self.db_manager = await self._run(open_database, self.db_path)
+        await self.compiled_rules()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def _run(self, function, *args):
+        """Выполнение блокирующего вызова в пуле потоков"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    # Скомпилированные правила
+
+    async def compiled_rules(self, agent_id: str = None, domain_id: str = None) -> CompiledRules:
+        """Правила области, скомпилированные для текущей ревизии данных"""
+        scope = (agent_id, domain_id)
+
+        async with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at >= self.refresh_interval:
+                revision = await self._run(self.db_manager.get_data_version)
+                self._checked_at = now
+                if revision != self._revision:
+                    self._revision = revision
+                    self._compiled.clear()
+
+            compiled = self._compiled.get(scope)
+            if compiled is None:
+                # Снимок читается только под блокировкой: при смене ревизии
+                # get_snapshot закрывает предыдущий
+                compiled = await self._run(self._compile, agent_id, domain_id)
+                self._compiled[scope] = compiled
+                if metrics.enabled:
+                    metrics.increment('service.rules_compiled')
+
+            return compiled
+
+    def _compile(self, agent_id: str = None, domain_id: str = None) -> CompiledRules:
+        snapshot = self.db_manager.get_snapshot()
+        if agent_id:
+            rules = snapshot.get_rules_by_agent(agent_id)
+        elif domain_id:
+            rules = snapshot.get_rules_by_domain(domain_id)
+        else:
+            rules = snapshot.rules
+        return InferenceEngine.compile_rules(rules)
+
+    # Операции
+
+    async def forward_inference(self, facts, agent_id: str = None, domain_id: str = None,
+                                strategy: str = 'priority') -> Dict:
+        """Прямой вывод из переданных фактов"""
+        if strategy not in STRATEGIES:
+            raise RpcError(INVALID_PARAMS, f"Неизвестная стратегия: {strategy}")
+        if isinstance(facts, dict):
+            facts = [{'variable': variable, 'value': value} for variable, value in facts.items()]
+        elif not isinstance(facts, list) or not all(
+                isinstance(fact, dict) and 'variable' in fact and 'value' in fact for fact in facts):
+            raise RpcError(INVALID_PARAMS, "facts: ожидается объект или список {variable, value}")
+
+        rules = await self.compiled_rules(agent_id, domain_id)
+        result = await self._run(self.engine.forward_chaining, facts, rules, strategy)
+        return {
+            'fired_rules': result['applied_rules'],
+            'derived_facts': result['new_facts'],
+            'final_facts': result['final_facts'],
+        }
+
+    async def backward_inference(self, goal: str, agent_id: str = None) -> Dict:
+        """Правила, выводящие цель, цепочка зависимостей и нужные исходные данные"""
+        if not isinstance(goal, str) or not goal:
+            raise RpcError(INVALID_PARAMS, "goal: ожидается непустая строка")
+        return await self._run(self._backward, goal, agent_id)
+
+    def _backward(self, goal: str, agent_id: str = None) -> Dict:
+        rules = self.db_manager.get_rules_writing(goal, agent_id)
+        if not rules:
+            rules = (self.db_manager.get_rules_by_agent(agent_id) if agent_id
+                     else self.db_manager.get_all_rules())
+
+        return {
+            'rules': self.engine.backward_chaining(goal, rules),
+            'supporting_rules': self.db_manager.get_supporting_rules(goal, agent_id),
+            'inputs': self.db_manager.get_input_variables(goal, agent_id),
+        }
+
+    async def search_rules(self, query: str, agent_ids: List[str] = None,
+                           limit: int = 100) -> List[Dict]:
+        """Поиск правил по тексту условия или действия"""
+        if not isinstance(query, str):
+            raise RpcError(INVALID_PARAMS, "query: ожидается строка")
+        rules = await self._run(self.db_manager.search_rules, query, agent_ids)
+        return rules[:limit] if limit else rules
+
+    async def get_facts(self, fact_id: str = None, variable: str = None,
+                        agent_id: str = None) -> List[Dict]:
+        """Факты по ID, по переменной (с агентом) или все факты агента"""
+        if fact_id:
+            fact = await self._run(self.db_manager.get_fact, fact_id)
+            return [fact] if fact else []
+        if variable:
+            return await self._run(self.db_manager.get_facts_by_variable, variable, agent_id)
+        if agent_id:
+            return await self._run(self.db_manager.get_facts_by_agent, agent_id)
+        raise RpcError(INVALID_PARAMS, "Укажите fact_id, variable или agent_id")
+
+    async def status(self) -> Dict:
+        return {
+            'db': str(self.db_path),
+            'revision': self._revision,
+            'compiled_scopes': len(self._compiled),
+            'uptime_s': time.time() - self.started_at,
+        }
+
+    METHODS = ('forward_inference', 'backward_inference', 'search_rules', 'get_facts', 'status')
+
+    async def call(self, method: str, params: Any) -> Any:
+        """Вызов метода по имени из запроса JSON-RPC"""
+        if method not in self.METHODS:
+            raise RpcError(METHOD_NOT_FOUND, f"Метод не найден: {method}")
+        function = getattr(self, method)
+
+        try:
+            if isinstance(params, dict):
+                call = function(**params)
+            elif isinstance(params, list):
+                call = function(*params)
+            elif params is None:
+                call = function()
+            else:
+                raise RpcError(INVALID_PARAMS, "params: ожидается объект или массив")
+        except TypeError as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+
+        if not metrics.enabled:
+            return await call
+        with metrics.timer(f'service.{method}'):
+            return await call
+
+
+class JsonRpcHttpServer:
+    """Минимальный HTTP/1.1 сервер JSON-RPC на asyncio"""
+
+    def __init__(self, service: KnowledgeBaseService):
+        self.service = service
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                if method == 'GET' and path == '/health':
+                    status, payload = 200, await self.service.status()
+                elif method == 'POST' and path in ('/', '/rpc'):
+                    status, payload = 200, await self.dispatch(body)
+                else:
+                    status, payload = 404, {'error': f"Не найдено: {method} {path}"}
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            with contextlib.suppress(ConnectionError):
+                await self._write_response(writer, 400, {'error': str(e)}, False)
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader):
+        """Строка запроса, заголовки и тело; None при закрытии соединения"""
+        line = await reader.readline()
+        if not line:
+            return None
+
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise ValueError("Некорректная строка запроса")
+        method, path, _ = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Слишком большой запрос")
+        body = await reader.readexactly(length) if length else b''
+
+        return method.upper(), path.split('?', 1)[0], headers, body
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+        body = b'' if payload is None else \
+            json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        reason = http.client.responses.get(status, '')
+        head = (f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def dispatch(self, body: bytes):
+        """Обработка одного запроса или пакета; None, если ответ не нужен"""
+        try:
+            message = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            return self._error(None, PARSE_ERROR, f"Ошибка разбора JSON: {e}")
+
+        if isinstance(message, list):
+            if not message:
+                return self._error(None, INVALID_REQUEST, "Пустой пакет")
+            # Запросы пакета выполняются конкурентно
+            responses = await asyncio.gather(*(self._handle(item) for item in message))
+            return [response for response in responses if response is not None] or None
+
+        return await self._handle(message)
+
+    async def _handle(self, message) -> Optional[Dict]:
+        if not isinstance(message, dict) or not isinstance(message.get('method'), str):
+            return self._error(None, INVALID_REQUEST, "Ожидается объект с полем method")
+
+        request_id = message.get('id')
+        try:
+            result = await self.service.call(message['method'], message.get('params'))
+        except RpcError as e:
+            response = self._error(request_id, e.code, e.message)
+        except Exception as e:
+            print(f"Ошибка выполнения {message['method']}: {e}", file=sys.stderr)
+            response = self._error(request_id, INTERNAL_ERROR, str(e))
+        else:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+        # Уведомления (без id) ответа не получают
+        return response if 'id' in message else None
+
+    @staticmethod
+    def _error(request_id, code: int, message: str) -> Dict:
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+async def serve(db_path: str, host: str = '127.0.0.1', port: int = 8765,
+                socket_path: str = None, workers: int = 4, ready: asyncio.Event = None):
+    """Запуск сервиса до отмены задачи"""
+    service = KnowledgeBaseService(db_path, workers)
+    try:
+        await service.start()
+    except BaseException:
+        service.close()
+        raise
+    server = JsonRpcHttpServer(service)
+
+    if socket_path:
+        listener = await asyncio.start_unix_server(server.handle_connection, path=socket_path)
+        address = socket_path
+    else:
+        listener = await asyncio.start_server(server.handle_connection, host, port)
+        address = '{}:{}'.format(*listener.sockets[0].getsockname()[:2])
+
+    print(f"Сервис базы знаний: {address}, правил: {len((await service.compiled_rules()).rules)}",
+          file=sys.stderr)
+    if ready is not None:
+        ready.set()
+
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        service.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class KnowledgeBaseClient:
+    """
+    Синхронный клиент сервиса для других инструментов
+
+    Соединение переиспользуется между вызовами:
+        client = KnowledgeBaseClient(port=8765)
+        client.call('forward_inference', facts={'температура': 39.5})
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765,
+                 socket_path: str = None, timeout: float = 30.0):
+        if socket_path:
+            self.connection = _UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        self._next_id = 0
+
+    def call(self, method: str, **params) -> Any:
+        """Вызов метода; ошибка сервиса поднимается как RpcError"""
+        self._next_id += 1
+        body = json.dumps({'jsonrpc': '2.0', 'id': self._next_id,
+                           'method': method, 'params': params}, ensure_ascii=False)
+        self.connection.request('POST', '/rpc', body.encode('utf-8'),
+                                {'Content-Type': 'application/json'})
+        response = json.loads(self.connection.getresponse().read().decode('utf-8'))
+
+        if 'error' in response:
+            raise RpcError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP-соединение через Unix-сокет"""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Локальный сервис базы знаний (JSON-RPC поверх HTTP)')
+    parser.add_argument('--db', default='knowledge_base.sqlite3', help='Файл базы знаний')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес для TCP')
+    parser.add_argument('--port', type=int, default=8765, help='Порт для TCP')
+    parser.add_argument('--socket', default=None, help='Unix-сокет вместо TCP')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Размер пула потоков для SQLite и вывода')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.socket, args.workers))
+    except FileNotFoundError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
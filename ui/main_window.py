@@ -1,4 +1,3 @@
-import re
 import sys
 import os
 from typing import List, Dict, Optional
@@ -10,7 +9,13 @@ from PyQt5.QtGui import *
 # Добавляем путь к модулям
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database.db_manager import DatabaseManager
+from database.sharded_db_manager import open_database
+from database.async_db_manager import AsyncDatabaseManager
+from core.agent_comparison import AgentComparison
+from core.doc_cache import DocCache
+from core.document_reader import DocumentReader, extract_from_document
+from core.inference_engine import InferenceEngine
+from core.metrics import metrics
 # from core.text_processor import TextProcessor
 from core.text_processor_spacy import TextProcessor
 
@@ -18,18 +23,31 @@ from core.text_processor_spacy import TextProcessor
 class MainWindow(QMainWindow):
     """Главное окно приложения"""
 
+    # Сколько символов большого документа показывать в редакторе
+    PREVIEW_CHARS = 200_000
+    # Каталог кэша разобранных документов
+    DOC_CACHE_DIR = 'doc_cache'
+
     def __init__(self):
         super().__init__()
 
         # Инициализация менеджера БД
-        self.db_manager = DatabaseManager()
+        self.db_manager = open_database()
+        self.async_db = AsyncDatabaseManager(self.db_manager)
 
         # Инициализация текстового процессора
-        self.text_processor = TextProcessor(language='ru')
+        # Разобранные тексты кэшируются на диске: повторный анализ
+        # документа не запускает конвейер spaCy
+        self.text_processor = TextProcessor(language='ru', doc_cache=DocCache(self.DOC_CACHE_DIR))
+
+        # Машина логического вывода
+        self.inference_engine = InferenceEngine()
 
         # Текущие данные
         self.current_agent_id = None
         self.current_domain_id = None
+        # Большой документ, от которого в редакторе только начало
+        self.loaded_document = None
 
         # Инициализация UI
         self.init_ui()
@@ -244,6 +262,20 @@ class MainWindow(QMainWindow):
         import_action_csv.triggered.connect(self.import_data_csv)
         kb_menu.addAction(import_action_csv)
 
+        export_action_archive = QAction('Экспорт в архив', self)
+        export_action_archive.triggered.connect(self.export_data_archive)
+        kb_menu.addAction(export_action_archive)
+
+        import_action_archive = QAction('Импорт из архива', self)
+        import_action_archive.triggered.connect(self.import_data_archive)
+        kb_menu.addAction(import_action_archive)
+
+        kb_menu.addSeparator()
+
+        duplicates_action = QAction('Удалить дубликаты правил', self)
+        duplicates_action.triggered.connect(self.delete_duplicate_rules)
+        kb_menu.addAction(duplicates_action)
+
         # Меню Анализ
         analysis_menu = menubar.addMenu('Анализ')
 
@@ -259,6 +291,10 @@ class MainWindow(QMainWindow):
         compare_action.triggered.connect(self.compare_agents)
         analysis_menu.addAction(compare_action)
 
+        concept_action = QAction('Поиск по концепции', self)
+        concept_action.triggered.connect(self.search_concept)
+        analysis_menu.addAction(concept_action)
+
         # Меню Вывод
         inference_menu = menubar.addMenu('Вывод')
 
@@ -270,6 +306,10 @@ class MainWindow(QMainWindow):
         backward_action.triggered.connect(self.backward_inference)
         inference_menu.addAction(backward_action)
 
+        incremental_action = QAction('Обновить выведенные факты агента', self)
+        incremental_action.triggered.connect(self.incremental_inference)
+        inference_menu.addAction(incremental_action)
+
         # Меню Помощь
         help_menu = menubar.addMenu('Помощь')
 
@@ -323,10 +363,22 @@ class MainWindow(QMainWindow):
 
         if filename:
             try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                    self.text_edit.setText(text)
+                # Файл не читается целиком: в редактор попадает только начало,
+                # анализ большого документа идет по файлу окнами
+                with DocumentReader(filename) as reader:
+                    text, complete = reader.preview(self.PREVIEW_CHARS)
+                    size = reader.size
+
+                self.text_edit.setPlainText(text)
+                self.loaded_document = None if complete else filename
+
+                if complete:
                     self.statusBar().showMessage(f'Загружен файл: {filename}')
+                else:
+                    self.statusBar().showMessage(
+                        f'Загружен файл: {filename} ({size / 2 ** 20:.1f} МБ, показано начало; '
+                        f'анализируется весь документ, пока текст не изменен)'
+                    )
             except Exception as e:
                 QMessageBox.warning(self, "Ошибка",
                                     f"Не удалось загрузить файл:\n{str(e)}")
@@ -355,6 +407,11 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Нет текста для анализа")
             return
 
+        # Правка превью означает анализ текста редактора, а не документа
+        document = self.loaded_document
+        if document and self.text_edit.document().isModified():
+            document = None
+
         try:
             # Выбор агента для сохранения
             agent_id = self.select_agent_for_saving()
@@ -369,15 +426,27 @@ class MainWindow(QMainWindow):
             source_info = {
                 'agent_id': agent_id,
                 'domain_id': domain_id,
-                'source_file': 'text_input.txt',
+                'source_file': os.path.basename(document) if document else 'text_input.txt',
                 'author': 'Пользователь'
             }
 
-            # Анализируем структуру текста
-            structure = self.text_processor.analyze_text_structure(text)
+            if document:
+                # Структура, знания и концепции всего документа, окно за окном
+                extracted_data = extract_from_document(self.text_processor, document, source_info,
+                                                       structure=True, concepts=True)
+                structure = extracted_data.pop('structure')
+                concepts = extracted_data.pop('concepts')
+                relationships = extracted_data.pop('relationships')
+            else:
+                # Анализируем структуру текста
+                structure = self.text_processor.analyze_text_structure(text)
+
+                # Извлекаем знания
+                extracted_data = self.text_processor.extract_from_text(text, source_info)
 
-            # Извлекаем знания
-            extracted_data = self.text_processor.extract_from_text(text, source_info)
+                # Концепции и отношения (разбор текста берется из кэша документов)
+                concepts = self.text_processor.extract_key_concepts(text)
+                relationships = self.text_processor.extract_relationships(text)
 
             # Сохраняем правила в БД
             saved_rules = []
@@ -393,6 +462,10 @@ class MainWindow(QMainWindow):
                 if saved_fact:
                     saved_facts.append(saved_fact)
 
+            # Индекс концепций для поиска правил и фактов по концепции
+            self.db_manager.index_concepts(concepts, relationships, saved_rules, saved_facts,
+                                           source_info['source_file'])
+
             # Формируем отчет
             report = self.create_analysis_report(
                 structure, extracted_data, saved_rules, saved_facts
@@ -492,7 +565,13 @@ class MainWindow(QMainWindow):
         report += f"  Найдено правил: {len(extracted_data['rules'])}\n"
         report += f"  Сохранено правил: {len(saved_rules)}\n"
         report += f"  Найдено фактов: {len(extracted_data['facts'])}\n"
-        report += f"  Сохранено фактов: {len(saved_facts)}\n\n"
+        report += f"  Сохранено фактов: {len(saved_facts)}\n"
+        tiers = extracted_data.get('statistics', {}).get('tiers')
+        if tiers:
+            report += (f"  Предложений через парсер: {tiers['parser']}, "
+                       f"через регулярные выражения: {tiers['regex']}, "
+                       f"пропущено: {tiers['skipped']}\n")
+        report += "\n"
 
         if saved_rules:
             report += "СОХРАНЕННЫЕ ПРАВИЛА:\n"
@@ -520,9 +599,10 @@ class MainWindow(QMainWindow):
             self.rules_table.setRowCount(len(rules))
 
             for row, rule in enumerate(rules):
-                # ID (укороченный)
-                self.rules_table.setItem(row, 0,
-                                         QTableWidgetItem(rule['id'][:8] + '...'))
+                # ID (укороченный, полный ID хранится в данных ячейки)
+                id_item = QTableWidgetItem(rule['id'][:8] + '...')
+                id_item.setData(Qt.UserRole, rule['id'])
+                self.rules_table.setItem(row, 0, id_item)
 
                 # Название
                 self.rules_table.setItem(row, 1,
@@ -652,21 +732,34 @@ class MainWindow(QMainWindow):
         )
 
         if reply == QMessageBox.Yes:
-            for index in selected_rows:
-                row = index.row()
-                rule_id_item = self.rules_table.item(row, 0)
-
-                if rule_id_item:
-                    # Получаем полный ID (нужно хранить полные ID в таблице)
-                    # В реальном приложении нужно хранить полные ID в данных ячеек
-                    rules = self.db_manager.get_all_rules()
-                    if row < len(rules):
-                        rule_id = rules[row]['id']
-                        self.db_manager.delete_rule(rule_id)
+            rule_ids = self.get_selected_rule_ids(selected_rows)
+
+            # Все выбранные правила удаляются одной транзакцией
+            deleted = self.db_manager.delete_rules(rule_ids)
 
             # Обновляем таблицу
             self.refresh_rules_table()
-            self.statusBar().showMessage("Правило удалено")
+            self.statusBar().showMessage(f"Удалено правил: {deleted}")
+
+    def get_selected_rule_ids(self, selected_rows) -> List[str]:
+        """Полные ID правил в выбранных строках таблицы"""
+        rule_ids = []
+        for index in selected_rows:
+            rule_id_item = self.rules_table.item(index.row(), 0)
+            if not rule_id_item:
+                continue
+
+            rule_id = rule_id_item.data(Qt.UserRole)
+            if not rule_id:
+                # Восстанавливаем ID по отображаемому префиксу
+                matches = self.db_manager.find_rules_by_id_prefix(rule_id_item.text(), limit=2)
+                if len(matches) == 1:
+                    rule_id = matches[0]['id']
+
+            if rule_id:
+                rule_ids.append(rule_id)
+
+        return rule_ids
 
     def edit_rule_priority(self):
         """Изменение приоритета правила"""
@@ -677,14 +770,12 @@ class MainWindow(QMainWindow):
                                 "Выберите одно правило для изменения приоритета")
             return
 
-        row = selected_rows[0].row()
-        rules = self.db_manager.get_all_rules()
+        rule_ids = self.get_selected_rule_ids(selected_rows)
+        rule = self.db_manager.get_rule(rule_ids[0]) if rule_ids else None
 
-        if row >= len(rules):
+        if not rule:
             return
 
-        rule = rules[row]
-
         # Диалог ввода нового приоритета
         priority, ok = QInputDialog.getInt(
             self, "Изменение приоритета",
@@ -726,18 +817,25 @@ class MainWindow(QMainWindow):
                     break
 
             if agent_id:
+                # Анализ выполняется по снимку без обращения к SQLite
+                snapshot = self.db_manager.get_snapshot()
+
                 # Получаем правила агента
-                agent_rules = self.db_manager.get_rules_by_agent(agent_id)
+                agent_rules = snapshot.get_rules_by_agent(agent_id)
 
                 # Ищем схожие правила
-                similar_rules = self.db_manager.find_similar_rules(agent_id)
+                similar_rules = snapshot.find_similar_rules(agent_id)
 
                 # Ищем конфликтные правила
-                conflicting_rules = self.db_manager.find_conflicting_rules(agent_id)
+                conflicting_rules = snapshot.find_conflicting_rules(agent_id)
+
+                # Циклы в графе зависимостей правил
+                cycles = self.db_manager.find_dependency_cycles(agent_id)
 
                 # Формируем отчет
                 report = self.create_trace_report(
-                    agent_name, agent_rules, similar_rules, conflicting_rules
+                    agent_name, agent_rules, similar_rules, conflicting_rules, cycles,
+                    snapshot.revision
                 )
 
                 # Отображаем отчет
@@ -746,18 +844,84 @@ class MainWindow(QMainWindow):
 
                 self.statusBar().showMessage(f"Выполнена трассировка агента: {agent_name}")
 
+    def search_concept(self):
+        """Правила, факты и отношения концепции по индексу концепций"""
+        query, ok = QInputDialog.getText(self, "Поиск по концепции", "Концепция или начало названия:")
+        if not ok or not query.strip():
+            return
+
+        candidates = self.db_manager.find_concepts(query)
+        if not candidates:
+            QMessageBox.information(self, "Информация", f"Концепция не найдена: {query}")
+            return
+
+        concept = candidates[0]
+        if len(candidates) > 1:
+            labels = [f"{item['text']} ({item['type']}, правил: {item['rules']}, фактов: {item['facts']})"
+                      for item in candidates]
+            label, ok = QInputDialog.getItem(self, "Выбор концепции", "Найденные концепции:",
+                                             labels, 0, False)
+            if not ok:
+                return
+            concept = candidates[labels.index(label)]
+
+        rules = self.db_manager.get_rules_by_concept(concept['key'])
+        facts = self.db_manager.get_cooccurring_facts(concept['key'])
+        relations = self.db_manager.get_concept_relations(concept['key'])
+
+        self.trace_text.setText(self.create_concept_report(concept, rules, facts, relations))
+        self.tab_widget.setCurrentIndex(4)  # Вкладка трассировки
+        self.statusBar().showMessage(
+            f"Концепция «{concept['text']}»: правил {len(rules)}, фактов {len(facts)}"
+        )
+
+    def create_concept_report(self, concept: Dict, rules: List, facts: List,
+                              relations: List) -> str:
+        """Отчет по концепции"""
+        report = "=" * 70 + "\n"
+        report += f"КОНЦЕПЦИЯ: {concept['text']} ({concept['type']})\n"
+        report += f"Исходных файлов: {concept['sources']}\n"
+        report += "=" * 70 + "\n\n"
+
+        report += f"ПРАВИЛА, УПОМИНАЮЩИЕ КОНЦЕПЦИЮ ({len(rules)}):\n"
+        report += "-" * 40 + "\n"
+        for i, rule in enumerate(rules, 1):
+            report += f"{i}. ЕСЛИ {rule['condition']}\n"
+            report += f"   ТО {rule['action']}\n"
+            report += f"   Источник: {rule.get('source_file') or '-'}\n\n"
+
+        report += f"\nФАКТЫ ИЗ ТЕХ ЖЕ ИСТОЧНИКОВ ({len(facts)}):\n"
+        report += "-" * 40 + "\n"
+        for i, fact in enumerate(facts, 1):
+            marker = " *" if fact.get('mentions') else ""
+            report += f"{i}. {fact['variable_name']} = {fact['value']}{marker}\n"
+        if any(fact.get('mentions') for fact in facts):
+            report += "   (* - факт упоминает концепцию)\n"
+
+        if relations:
+            report += f"\nОТНОШЕНИЯ ({len(relations)}):\n"
+            report += "-" * 40 + "\n"
+            for relation in relations:
+                report += f"  {relation['subject']} -[{relation['relation']}]-> {relation['object']}\n"
+
+        return report
+
     def create_trace_report(self, agent_name: str, agent_rules: List,
-                            similar_rules: List, conflicting_rules: List) -> str:
+                            similar_rules: List, conflicting_rules: List,
+                            cycles: List = None, data_version: int = None) -> str:
         """Создание отчета трассировки"""
         report = "=" * 70 + "\n"
         report += f"ОТЧЕТ ТРАССИРОВКИ АГЕНТА: {agent_name}\n"
+        if data_version is not None:
+            report += f"Версия данных: {data_version}\n"
         report += "=" * 70 + "\n\n"
 
         # Статистика
         report += "СТАТИСТИКА:\n"
         report += f"  Всего правил: {len(agent_rules)}\n"
         report += f"  Схожих пар правил: {len(similar_rules)}\n"
-        report += f"  Конфликтных пар: {len(conflicting_rules)}\n\n"
+        report += f"  Конфликтных пар: {len(conflicting_rules)}\n"
+        report += f"  Циклов зависимостей: {len(cycles or [])}\n\n"
 
         if similar_rules:
             report += "СХОЖИЕ ПРАВИЛА:\n"
@@ -783,6 +947,21 @@ class MainWindow(QMainWindow):
                 report += f"   Правило 2: ЕСЛИ {conflict['rule2']['condition']}\n"
                 report += f"             ТО {conflict['rule2']['action']}\n\n"
 
+        if cycles:
+            report += "\nЦИКЛИЧЕСКИЕ ЗАВИСИМОСТИ:\n"
+            report += "-" * 40 + "\n"
+
+            rules_by_id = {rule['id']: rule for rule in agent_rules}
+            for i, cycle in enumerate(cycles, 1):
+                report += f"{i}. Правил в цикле: {len(cycle)}\n"
+                for rule_id in cycle[:10]:
+                    rule = rules_by_id.get(rule_id)
+                    if rule:
+                        report += f"   ЕСЛИ {rule['condition']} ТО {rule['action']}\n"
+                if len(cycle) > 10:
+                    report += f"   ... и еще {len(cycle) - 10}\n"
+                report += "\n"
+
         # Рекомендации
         report += "\nРЕКОМЕНДАЦИИ:\n"
         report += "-" * 40 + "\n"
@@ -793,6 +972,9 @@ class MainWindow(QMainWindow):
         if conflicting_rules:
             report += "• Разрешите конфликты путем изменения приоритетов или условий\n"
 
+        if cycles:
+            report += "• Проверьте циклические зависимости: правила выводят переменные друг для друга\n"
+
         if len(agent_rules) < 5:
             report += "• База знаний мала. Добавьте больше правил\n"
         elif len(agent_rules) > 50:
@@ -857,14 +1039,17 @@ class MainWindow(QMainWindow):
         """Создание отчета сравнения агентов"""
         report = "=" * 70 + "\n"
         report += "СРАВНЕНИЕ АГЕНТОВ\n"
-        report += "=" * 70 + "\n\n"
 
         # Собираем данные по каждому агенту
         agents_data = []
+        snapshot = self.db_manager.get_snapshot()
+
+        report += f"Версия данных: {snapshot.revision}\n"
+        report += "=" * 70 + "\n\n"
 
         for agent in agents:
-            rules = self.db_manager.get_rules_by_agent(agent['id'])
-            facts = self.db_manager.get_facts_by_agent(agent['id'])
+            rules = snapshot.get_rules_by_agent(agent['id'])
+            facts = snapshot.get_facts_by_agent(agent['id'])
 
             agents_data.append({
                 'name': agent['name'],
@@ -938,10 +1123,55 @@ class MainWindow(QMainWindow):
         if duplicates:
             report += f"• Обнаружено {len(duplicates)} дубликатов правил между агентами\n"
 
+        report += "\n" + self.create_overlap_report(agents, agents_data)
+
         report += "\n" + "=" * 70
 
         return report
 
+    def create_overlap_report(self, agents: List[Dict], agents_data: List[Dict]) -> str:
+        """Матрицы сходства и пересечения правил агентов"""
+        report = "ПЕРЕСЕЧЕНИЕ БАЗ ЗНАНИЙ:\n"
+        report += "-" * 40 + "\n"
+
+        if not AgentComparison.available():
+            report += "• Для расчета пересечения установите numpy и scipy\n"
+            return report
+
+        comparison = AgentComparison()
+        rules_by_agent = {agent['id']: data['rules'] for agent, data in zip(agents, agents_data)}
+        signatures = self.db_manager.get_rule_signatures(
+            [rule['id'] for rules in rules_by_agent.values() for rule in rules])
+        result = comparison.compare(agents, rules_by_agent, signatures)
+
+        # Столбцы обозначаются номерами агентов, имена - в легенде
+        names = [f"#{i}" for i in range(1, len(agents_data) + 1)]
+        for name, data in zip(names, agents_data):
+            report += f"  {name}: {data['name']} ({data['rules_count']} правил)\n"
+        report += "\n"
+        header = " " * 6 + "".join(f"{name:>9}" for name in names) + "\n"
+
+        report += "Сходство профилей (косинус):\n" + header
+        for name, row in zip(names, result['similarity']):
+            report += f"{name:<6}" + "".join(f"{value:>9.3f}" for value in row) + "\n"
+
+        report += f"\nДоля правил с почти дубликатом у другого агента "
+        report += f"(Жаккар >= {comparison.threshold}):\n" + header
+        for name, row in zip(names, result['overlap']):
+            report += f"{name:<6}" + "".join(f"{value:>9.1%}" for value in row) + "\n"
+
+        if result['top_shared']:
+            report += "\nОбщие правила:\n"
+            names_by_id = {agent['id']: agent['name'] for agent in agents}
+            for entry in result['top_shared']:
+                report += f"  {names_by_id[entry['agent1']]} - {names_by_id[entry['agent2']]}:\n"
+                for shared in entry['rules']:
+                    rule = shared['rule1']
+                    report += f"    • [{shared['similarity']:.2f}] ЕСЛИ {rule['condition']} "
+                    report += f"ТО {rule['action']}\n"
+
+        return report
+
     def forward_inference(self):
         """Прямой вывод"""
         # Диалог выбора начальных фактов
@@ -956,6 +1186,15 @@ class MainWindow(QMainWindow):
         facts_edit.setPlaceholderText("температура = 39.5\nдавление = 150/95")
         layout.addWidget(facts_edit)
 
+        # Стратегия разрешения конфликтов агенды
+        layout.addWidget(QLabel("Стратегия выбора правил:"))
+        strategy_combo = QComboBox()
+        strategy_combo.addItem("По приоритету", 'priority')
+        strategy_combo.addItem("Сначала новые активации", 'recency')
+        strategy_combo.addItem("Сначала более конкретные условия", 'specificity')
+        strategy_combo.addItem("По достоверности", 'confidence')
+        layout.addWidget(strategy_combo)
+
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         button_box.accepted.connect(dialog.accept)
         button_box.rejected.connect(dialog.reject)
@@ -976,11 +1215,12 @@ class MainWindow(QMainWindow):
                             'value': parts[1].strip()
                         })
 
-            # Получаем все правила
-            rules = self.db_manager.get_all_rules()
+            # Получаем все правила из скомпилированного снимка
+            rules = self.db_manager.get_snapshot().rules
 
             # Простой алгоритм прямого вывода
-            result = self.simple_forward_chaining(initial_facts, rules)
+            result = self.simple_forward_chaining(initial_facts, rules,
+                                                  strategy_combo.currentData())
 
             # Отображаем результат
             report = self.create_inference_report("Прямой вывод",
@@ -991,85 +1231,10 @@ class MainWindow(QMainWindow):
 
             self.statusBar().showMessage("Прямой вывод выполнен")
 
-    def simple_forward_chaining(self, initial_facts: List, rules: List) -> Dict:
+    def simple_forward_chaining(self, initial_facts: List, rules: List,
+                                strategy: str = 'priority') -> Dict:
         """Простой алгоритм прямого вывода"""
-        # Создаем рабочую память
-        working_memory = {}
-        for fact in initial_facts:
-            working_memory[fact['variable']] = fact['value']
-
-        applied_rules = []
-        new_facts = []
-
-        # Сортируем правила по приоритету
-        sorted_rules = sorted(rules, key=lambda x: x.get('priority', 1), reverse=True)
-
-        # Цикл вывода
-        changed = True
-        while changed:
-            changed = False
-
-            for rule in sorted_rules:
-                # Проверяем, сработало ли правило
-                if self.check_rule_condition(rule['condition'], working_memory):
-                    # Извлекаем действие
-                    action_result = self.execute_rule_action(rule['action'], working_memory)
-
-                    if action_result:
-                        variable, value = action_result
-
-                        # Добавляем новый факт
-                        if variable not in working_memory:
-                            working_memory[variable] = value
-                            new_facts.append({
-                                'variable': variable,
-                                'value': value,
-                                'rule': rule['name']
-                            })
-                            applied_rules.append(rule['name'])
-                            changed = True
-
-        return {
-            'final_facts': working_memory,
-            'applied_rules': applied_rules,
-            'new_facts': new_facts
-        }
-
-    def check_rule_condition(self, condition: str, facts: Dict) -> bool:
-        """Проверка условия правила"""
-        # Простая проверка для демонстрации, нужен полноценный парсер условий
-
-        try:
-            # Заменяем переменные на их значения
-            expr = condition
-            for var, value in facts.items():
-                expr = expr.replace(var, str(value))
-
-            # Вычисляем выражение
-            return eval(expr)
-        except:
-            return False
-
-    def execute_rule_action(self, action: str, facts: Dict) -> Optional[tuple]:
-        """Выполнение действия правила"""
-        # Простой парсер для действий вида "переменная = значение"
-        match = re.match(r'([\w]+)\s*=\s*(.+)', action)
-        if match:
-            variable = match.group(1)
-            value_expr = match.group(2)
-
-            try:
-                # Заменяем переменные в выражении значения
-                for var, val in facts.items():
-                    value_expr = value_expr.replace(var, str(val))
-
-                # Вычисляем значение
-                value = eval(value_expr)
-                return (variable, value)
-            except:
-                return None
-
-        return None
+        return self.inference_engine.forward_chaining(initial_facts, rules, strategy)
 
     def create_inference_report(self, inference_type: str, initial_facts: List,
                                 rules: List, result: Dict) -> str:
@@ -1103,6 +1268,67 @@ class MainWindow(QMainWindow):
 
         return report
 
+    def incremental_inference(self):
+        """Инкрементальный вывод с сохранением выведенных фактов агента"""
+        agents = self.db_manager.get_all_agents()
+
+        if not agents:
+            QMessageBox.information(self, "Информация", "Нет доступных агентов")
+            return
+
+        agent_names = [agent['name'] for agent in agents]
+        agent_name, ok = QInputDialog.getItem(
+            self, "Выбор агента", "Выберите агента для обновления выводов:",
+            agent_names, 0, False
+        )
+
+        if not ok or not agent_name:
+            return
+
+        agent = agents[agent_names.index(agent_name)]
+        result = self.db_manager.update_derived_facts(agent['id'])
+
+        if result is None:
+            QMessageBox.warning(self, "Ошибка", "Не удалось выполнить вывод")
+            return
+
+        report = "=" * 70 + "\n"
+        report += f"ИНКРЕМЕНТАЛЬНЫЙ ВЫВОД: {agent_name}\n"
+        report += "=" * 70 + "\n\n"
+
+        if result['removed']:
+            report += "СНЯТЫЕ ВЫВОДЫ:\n"
+            for fact in result['removed']:
+                report += f"  • {fact['variable']} = {fact['value']}\n"
+            report += "\n"
+
+        if result['added']:
+            report += "НОВЫЕ ВЫВОДЫ:\n"
+            for fact in result['added']:
+                report += f"  • {fact['variable']} = {fact['value']} "
+                report += f"(из правила: {fact['rule']})\n"
+            report += "\n"
+
+        if not result['added'] and not result['removed']:
+            report += "Изменений нет: выведенные факты актуальны\n\n"
+
+        tms = result['tms']
+        derived = [variable for variable, fact in tms.facts.items() if fact['derived']]
+        if derived:
+            report += "ОБОСНОВАНИЯ ВЫВЕДЕННЫХ ФАКТОВ:\n"
+            for variable in derived:
+                for line in tms.explain(variable):
+                    report += f"  {line}\n"
+                report += "\n"
+
+        report += "=" * 70
+
+        self.trace_text.setText(report)
+        self.tab_widget.setCurrentIndex(4)
+
+        self.statusBar().showMessage(
+            f"Выводы обновлены: +{len(result['added'])}, -{len(result['removed'])}")
+
     def backward_inference(self):
         """Обратный вывод"""
         # Диалог ввода цели
@@ -1126,22 +1352,22 @@ class MainWindow(QMainWindow):
         report += f"ОБРАТНЫЙ ВЫВОД: доказать '{goal}'\n"
         report += "=" * 70 + "\n\n"
 
-        # Получаем все правила
-        rules = self.db_manager.get_all_rules()
+        # Если цель - переменная, правила берутся из графа зависимостей,
+        # иначе ищем цель в действиях всех правил
+        rules = self.db_manager.get_rules_writing(goal)
+        if not rules:
+            rules = self.db_manager.get_snapshot().rules
 
         # Ищем правила, которые выводят цель
-        relevant_rules = []
-        for rule in rules:
-            # Простая проверка: содержится ли цель в действии
-            if goal.lower() in rule['action'].lower():
-                relevant_rules.append(rule)
+        relevant_rules = self.inference_engine.backward_chaining(goal, rules)
 
         if not relevant_rules:
             report += f"Не найдено правил, выводящих '{goal}'\n"
         else:
             report += f"Найдено правил, выводящих '{goal}': {len(relevant_rules)}\n\n"
 
-            for i, rule in enumerate(relevant_rules, 1):
+            for i, item in enumerate(relevant_rules, 1):
+                rule = item['rule']
                 report += f"ПРАВИЛО {i}:\n"
                 report += f"  ЕСЛИ: {rule['condition']}\n"
                 report += f"  ТО: {rule['action']}\n"
@@ -1150,43 +1376,36 @@ class MainWindow(QMainWindow):
                 # Анализ условий
                 report += f"  Условия для доказательства:\n"
 
-                # Простой парсинг условий
-                conditions = self.extract_conditions(rule['condition'])
-                for cond in conditions:
+                for cond in item['conditions']:
                     report += f"    • {cond}\n"
 
                 report += "\n"
 
 
-        # TODO: Доказательство обратного вывода
-        # report += "\nПЛАН ДОКАЗАТЕЛЬСТВА:\n"
-        # report += "-" * 40 + "\n"
-        # if relevant_rules:
-        #     report += "1. Выбрать правило с наивысшим приоритетом\n"
-        #     report += "2. Доказать условия выбранного правила\n"
-        #     report += "3. Если условия доказаны, цель считается доказанной\n"
-        #     report += "4. Если условия не доказаны, перейти к следующему правилу\n"
-        # else:
-        #     report += "Невозможно построить план: нет подходящих правил\n"
-        #
-        # report += "\n" + "=" * 70
-
-        return report
+        # Цепочка правил, от которых зависит вывод цели
+        supporting = self.db_manager.get_supporting_rules(goal)
+        if supporting:
+            report += "\nЦЕПОЧКА ЗАВИСИМОСТЕЙ:\n"
+            report += "-" * 40 + "\n"
 
-    def extract_conditions(self, condition_text: str) -> List[str]:
-        """Извлечение условий из текста условия"""
-        # Простой парсер для демонстрации
-        conditions = []
+            names = {rule['id']: rule.get('name') or rule['id']
+                     for rule in self.db_manager.get_snapshot().rules}
+            for item in supporting:
+                indent = "  " * item['depth']
+                report += f"{indent}{item['variable']} <- {names.get(item['rule_id'], item['rule_id'])}\n"
 
-        # Разбиваем по "и", "или"
-        parts = re.split(r'\s+и\s+|\s+или\s+', condition_text, flags=re.IGNORECASE)
+            inputs = self.db_manager.get_input_variables(goal)
+            report += "\nНЕОБХОДИМЫЕ ИСХОДНЫЕ ДАННЫЕ:\n"
+            report += "-" * 40 + "\n"
+            if inputs:
+                for variable in inputs:
+                    report += f"  • {variable}\n"
+            else:
+                report += "  Нет: все переменные выводятся правилами\n"
 
-        for part in parts:
-            part = part.strip()
-            if part:
-                conditions.append(part)
+        report += "\n" + "=" * 70
 
-        return conditions
+        return report
 
     def new_domain(self):
         """Создание новой предметной области"""
@@ -1267,7 +1486,16 @@ class MainWindow(QMainWindow):
 
     def show_statistics(self):
         """Показать статистику базы данных"""
-        stats = self.db_manager.get_statistics()
+        # Подсчет идет в фоне, окно не блокируется на время запросов к БД
+        self.statusBar().showMessage("Подсчет статистики...")
+        call = self.async_db.qt_call('get_statistics')
+        call.finished.connect(self.show_statistics_dialog)
+        call.failed.connect(
+            lambda error: QMessageBox.warning(self, "Ошибка", f"Не удалось получить статистику: {error}"))
+
+    def show_statistics_dialog(self, stats: Dict):
+        """Диалог со статистикой базы данных"""
+        self.statusBar().clearMessage()
 
         stats_text = "📊 СТАТИСТИКА БАЗЫ ДАННЫХ\n"
         stats_text += "=" * 40 + "\n\n"
@@ -1275,17 +1503,20 @@ class MainWindow(QMainWindow):
         stats_text += f"Предметные области: {stats.get('domains', 0)}\n"
         stats_text += f"Агенты: {stats.get('agents', 0)}\n"
         stats_text += f"Правила: {stats.get('rules', 0)}\n"
-        stats_text += f"Факты: {stats.get('facts', 0)}\n\n"
+        stats_text += f"Факты: {stats.get('facts', 0)}\n"
+        stats_text += f"Версия данных: {stats.get('data_version', '-')}\n\n"
 
         if 'rules_by_type' in stats:
             stats_text += "Правила по типам:\n"
             for rule_type, count in stats['rules_by_type'].items():
                 stats_text += f"  • {rule_type}: {count}\n"
 
+        stats_text += "\n" + self.create_metrics_report(self.db_manager.get_metrics())
+
         # Показываем в диалоговом окне
         dialog = QDialog(self)
         dialog.setWindowTitle("Статистика")
-        dialog.setMinimumWidth(300)
+        dialog.setMinimumWidth(500)
 
         layout = QVBoxLayout(dialog)
 
@@ -1294,12 +1525,58 @@ class MainWindow(QMainWindow):
         text_edit.setReadOnly(True)
         layout.addWidget(text_edit)
 
+        metrics_checkbox = QCheckBox("Собирать метрики производительности")
+        metrics_checkbox.setChecked(metrics.enabled)
+        metrics_checkbox.toggled.connect(
+            lambda checked: metrics.enable() if checked else metrics.disable())
+        layout.addWidget(metrics_checkbox)
+
         button_box = QDialogButtonBox(QDialogButtonBox.Ok)
+        save_metrics_btn = button_box.addButton("Сохранить метрики", QDialogButtonBox.ActionRole)
+        reset_metrics_btn = button_box.addButton("Сбросить метрики", QDialogButtonBox.ResetRole)
+        save_metrics_btn.clicked.connect(self.save_metrics)
+        reset_metrics_btn.clicked.connect(metrics.reset)
         button_box.accepted.connect(dialog.accept)
         layout.addWidget(button_box)
 
         dialog.exec_()
 
+    def create_metrics_report(self, data: Dict) -> str:
+        """Создание отчета по метрикам производительности"""
+        report = "⏱ МЕТРИКИ ПРОИЗВОДИТЕЛЬНОСТИ\n"
+        report += "=" * 40 + "\n\n"
+
+        if not data['enabled'] and not data['timings']:
+            report += "Сбор метрик выключен\n"
+            return report
+
+        if data['timings']:
+            report += "Операции (вызовы / среднее / макс. / строк):\n"
+            for name, timing in data['timings'].items():
+                report += f"  • {name}: {timing['count']} / "
+                report += f"{timing['mean_s'] * 1000:.2f} мс / "
+                report += f"{timing['max_s'] * 1000:.2f} мс / {timing['rows']}\n"
+
+        if data['counters']:
+            report += "\nСчетчики:\n"
+            for name, value in data['counters'].items():
+                report += f"  • {name}: {value}\n"
+
+        return report
+
+    def save_metrics(self):
+        """Сохранение метрик в файл"""
+        filename, selected_filter = QFileDialog.getSaveFileName(
+            self, "Сохранить метрики", "",
+            "JSON файлы (*.json);;Prometheus (*.prom);;Все файлы (*)"
+        )
+
+        if filename:
+            if self.db_manager.dump_metrics(filename):
+                self.statusBar().showMessage(f"Метрики сохранены в {filename}")
+            else:
+                QMessageBox.warning(self, "Ошибка", "Не удалось сохранить метрики")
+
     def export_data(self):
         """Экспорт данных в JSON"""
         filename, _ = QFileDialog.getSaveFileName(
@@ -1331,7 +1608,8 @@ class MainWindow(QMainWindow):
         if filename:
             reply = QMessageBox.question(
                 self, "Подтверждение",
-                "Импортировать базу данных? Существующие данные не будут удалены.",
+                "Импортировать базу данных? Существующие данные не будут удалены, "
+                "записи с теми же ID будут обновлены.",
                 QMessageBox.Yes | QMessageBox.No, QMessageBox.No
             )
 
@@ -1340,7 +1618,8 @@ class MainWindow(QMainWindow):
 
                 if success:
                     QMessageBox.information(self, "Успех",
-                                            f"База данных импортирована из {filename}")
+                                            f"База данных импортирована из {filename}\n\n"
+                                            f"{self._format_import_summary()}")
 
                     # Обновляем данные
                     self.refresh_rules_table()
@@ -1351,6 +1630,20 @@ class MainWindow(QMainWindow):
                     QMessageBox.warning(self, "Ошибка",
                                         "Не удалось импортировать базу данных")
 
+    def _format_import_summary(self) -> str:
+        """Итоги последнего импорта для сообщения"""
+        summary = self.db_manager.last_import_summary or {}
+        titles = {'domains': 'Домены', 'agents': 'Агенты', 'rules': 'Правила', 'facts': 'Факты'}
+        lines = [f"{titles[section]}: добавлено {counts['inserted']}, обновлено {counts['updated']}, "
+                 f"пропущено {counts['skipped']}"
+                 for section, counts in summary.items()]
+
+        errors = self.db_manager.last_import_errors
+        if errors:
+            lines.append(f"\nСтрок с ошибками: {len(errors)}")
+            lines.extend(f"строка {error['line']}: {error['error']}" for error in errors[:5])
+        return '\n'.join(lines)
+
     def export_data_csv(self):
         """Экспорт данных в CSV"""
         filename, _ = QFileDialog.getSaveFileName(
@@ -1379,7 +1672,8 @@ class MainWindow(QMainWindow):
         if filename:
             reply = QMessageBox.question(
                 self, "Подтверждение",
-                "Импортировать базу данных? Существующие данные не будут удалены.",
+                "Импортировать базу данных? Существующие данные не будут удалены, "
+                "записи с теми же ID будут обновлены.",
                 QMessageBox.Yes | QMessageBox.No, QMessageBox.No
             )
 
@@ -1388,7 +1682,61 @@ class MainWindow(QMainWindow):
 
                 if success:
                     QMessageBox.information(self, "Успех",
-                                            f"База данных импортирована из {filename}")
+                                            f"База данных импортирована из {filename}\n\n"
+                                            f"{self._format_import_summary()}")
+
+                    # Обновляем данные
+                    self.refresh_rules_table()
+                    self.refresh_facts_table()
+
+                    self.statusBar().showMessage(f"Импорт из {filename} выполнен")
+                else:
+                    QMessageBox.warning(self, "Ошибка",
+                                        "Не удалось импортировать базу данных")
+
+    def export_data_archive(self):
+        """Экспорт данных в компактный архив"""
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Экспорт базы данных", "",
+            "Архивы базы знаний (*.kba);;Все файлы (*)"
+        )
+
+        if filename:
+            if not filename.endswith('.kba'):
+                filename += '.kba'
+
+            success = self.db_manager.export_to_archive(filename)
+
+            if success:
+                QMessageBox.information(self, "Успех",
+                                        f"База данных экспортирована в {filename}")
+                self.statusBar().showMessage(f"Экспорт в {filename} выполнен")
+            else:
+                QMessageBox.warning(self, "Ошибка",
+                                    "Не удалось экспортировать базу данных")
+
+    def import_data_archive(self):
+        """Импорт данных из компактного архива"""
+        filename, _ = QFileDialog.getOpenFileName(
+            self, "Импорт базы данных", "",
+            "Архивы базы знаний (*.kba);;Все файлы (*)"
+        )
+
+        if filename:
+            reply = QMessageBox.question(
+                self, "Подтверждение",
+                "Импортировать базу данных? Существующие данные не будут удалены, "
+                "записи с теми же ID будут обновлены.",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+            )
+
+            if reply == QMessageBox.Yes:
+                success = self.db_manager.import_from_archive(filename)
+
+                if success:
+                    QMessageBox.information(self, "Успех",
+                                            f"База данных импортирована из {filename}\n\n"
+                                            f"{self._format_import_summary()}")
 
                     # Обновляем данные
                     self.refresh_rules_table()
@@ -1399,6 +1747,26 @@ class MainWindow(QMainWindow):
                     QMessageBox.warning(self, "Ошибка",
                                         "Не удалось импортировать базу данных")
 
+    def delete_duplicate_rules(self):
+        """Удаление дубликатов правил, сохраненных прежними версиями"""
+        count = self.db_manager.count_duplicate_rules()
+        if not count:
+            QMessageBox.information(self, "Дубликаты правил", "Дубликатов правил нет")
+            return
+
+        reply = QMessageBox.question(
+            self, "Подтверждение",
+            f"Найдено дубликатов правил: {count}. У каждого дубликата есть "
+            f"такое же правило того же агента, сохраненное раньше. Удалить дубликаты?",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+
+        if reply == QMessageBox.Yes:
+            deleted = self.db_manager.delete_duplicate_rules()
+
+            self.refresh_rules_table()
+            self.statusBar().showMessage(f"Удалено дубликатов правил: {deleted}")
+
     def show_about(self):
         """Показать информацию о программе"""
         about_text = """
@@ -1431,6 +1799,7 @@ class MainWindow(QMainWindow):
         )
 
         if reply == QMessageBox.Yes:
+            self.async_db.close()
             event.accept()
         else:
             event.ignore()
\ No newline at end of file